@@ -0,0 +1,68 @@
+"""
+Measures the per-query overhead of the database connectors against a local Postgres.
+
+Runs the same trivial query through each connector, so that the time is dominated by the driver
+and the hop between event loops rather than by the server::
+
+    python benchmarks/db_overhead.py --dsn postgresql://jokusoramame@127.0.0.1/jokusoramame
+"""
+import statistics
+import time
+from typing import List
+
+import click
+import curio
+import tabulate
+from asyncqlio import DatabaseInterface
+
+from jokusoramame.db.connector import CONNECTORS
+from jokusoramame.utils import loop as bridge_loop
+
+
+async def run_queries(db: DatabaseInterface, count: int) -> List[float]:
+    """
+    Runs a parameterised query in one session, timing each one.
+    """
+    timings = []
+    async with db.get_session() as sess:
+        for i in range(count):
+            before = time.perf_counter()
+            cursor = await sess.cursor("SELECT {value}::int AS value", {"value": i})
+            await cursor.fetch_row()
+            timings.append(time.perf_counter() - before)
+
+    return timings
+
+
+async def benchmark(dsn: str, connector: str, count: int, warmup: int) -> List[float]:
+    db = DatabaseInterface(dsn, connector=CONNECTORS[connector])
+    await db.connect()
+    try:
+        await run_queries(db, warmup)
+        return await run_queries(db, count)
+    finally:
+        await db.close()
+
+
+@click.command()
+@click.option("--dsn", default="postgresql://jokusoramame@127.0.0.1/jokusoramame",
+              help="The database to connect to.")
+@click.option("--count", default=5000, help="The number of queries to time per connector.")
+@click.option("--warmup", default=500, help="The number of untimed queries to run first.")
+def main(dsn: str, count: int, warmup: int):
+    rows = []
+    try:
+        for name in CONNECTORS:
+            timings = curio.run(benchmark(dsn, name, count, warmup))
+            timings = sorted(timing * 1e6 for timing in timings)
+            rows.append((name, statistics.mean(timings), timings[len(timings) // 2],
+                         timings[int(len(timings) * 0.99)]))
+    finally:
+        curio.run(bridge_loop.shutdown())
+
+    click.echo(tabulate.tabulate(rows, headers=["Connector", "Mean (us)", "p50 (us)", "p99 (us)"],
+                                 floatfmt=".1f", tablefmt="orgtbl"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Columnar member activity data.
+"""
+import datetime
+from typing import Dict, Iterator, List, Set, Tuple
+
+import numpy as np
+from curious import Member
+
+from jokusoramame.utils import timesliced
+
+#: The number of seconds in a day.
+DAY = 86_400
+
+#: The post count is capped at this, to protect the bot's sanity.
+MAX_POST_COUNT = 5000
+
+
+class ActivityResult(object):
+    """
+    The result of scoring an :class:`.ActivityTable`.
+
+    All columns are ordered by days inactive, ascending.
+    """
+
+    def __init__(self, member_ids: np.ndarray, flagged: np.ndarray, active: np.ndarray,
+                 algo_result: np.ndarray, post_count: np.ndarray, last_post: np.ndarray,
+                 days_inactive: np.ndarray):
+        self.member_ids = member_ids
+        self.flagged = flagged
+        self.active = active
+        self.algo_result = algo_result
+        self.post_count = post_count
+        self.last_post = last_post
+        self.days_inactive = days_inactive
+
+    def __len__(self) -> int:
+        return len(self.member_ids)
+
+    @property
+    def skipped_count(self) -> int:
+        """
+        :return: The number of members that could not be evaluated.
+        """
+        return int(np.count_nonzero(self.flagged))
+
+    @property
+    def active_count(self) -> int:
+        return int(np.count_nonzero(self.active & ~self.flagged))
+
+    @property
+    def inactive_count(self) -> int:
+        return int(np.count_nonzero(~self.active & ~self.flagged))
+
+    def inactive_ids(self) -> List[int]:
+        """
+        :return: The IDs of all evaluated members that are inactive.
+        """
+        return self.member_ids[~self.active & ~self.flagged].tolist()
+
+    def rows(self) -> Iterator[Tuple[int, bool, float, int, datetime.datetime, int]]:
+        """
+        Iterates over the evaluated members.
+
+        :return: An iterator of (member ID, active, score, post count, last post, days inactive).
+            The last post is None for members that have never posted.
+        """
+        for i in np.flatnonzero(~self.flagged):
+            if np.isnan(self.last_post[i]):
+                last_post = None
+            else:
+                last_post = datetime.datetime.fromtimestamp(self.last_post[i])
+
+            yield (int(self.member_ids[i]), bool(self.active[i]), float(self.algo_result[i]),
+                   int(self.post_count[i]), last_post, int(self.days_inactive[i]))
+
+
+class ActivityTable(object):
+    """
+    A columnar table of member activity for a guild.
+    """
+
+    def __init__(self, member_ids: np.ndarray, joined_at: np.ndarray, last_post: np.ndarray,
+                 post_count: np.ndarray, protected: np.ndarray, flagged: np.ndarray):
+        """
+        :param member_ids: The ID of each member.
+        :param joined_at: The join timestamp of each member.
+        :param last_post: The timestamp of the last post of each member, or NaN if they have never
+            posted.
+        :param post_count: The post count of each member.
+        :param protected: If each member is protected from pruning.
+        :param flagged: If each member has opted out of analytics.
+        """
+        self.member_ids = member_ids
+        self.joined_at = joined_at
+        self.last_post = last_post
+        self.post_count = post_count
+        self.protected = protected
+        self.flagged = flagged
+
+    def __len__(self) -> int:
+        return len(self.member_ids)
+
+    @classmethod
+    async def from_members(cls, members: List[Member], index: Dict[int, Tuple[float, int]],
+                           flagged: Set[int]) -> 'ActivityTable':
+        """
+        Builds a table from some members and a guild's activity index.
+
+        This is time-sliced, as computing permissions for every member of a large guild is slow.
+
+        :param members: The members to include.
+        :param index: A mapping of user ID -> (last post timestamp, post count).
+        :param flagged: The IDs of members who have opted out of analytics.
+        """
+        count = len(members)
+        member_ids = np.empty(count, dtype=np.int64)
+        joined_at = np.empty(count, dtype=np.float64)
+        last_post = np.full(count, np.nan, dtype=np.float64)
+        post_count = np.zeros(count, dtype=np.int64)
+        protected = np.zeros(count, dtype=bool)
+        is_flagged = np.zeros(count, dtype=bool)
+
+        async for i, member in timesliced(enumerate(members), name="activity"):
+            member_ids[i] = member.id
+            joined_at[i] = member.joined_at.timestamp()
+            protected[i] = member.guild_permissions.kick_members
+            is_flagged[i] = member.id in flagged
+
+            try:
+                last_post[i], post_count[i] = index[member.id]
+            except KeyError:
+                pass
+
+        return cls(member_ids, joined_at, last_post, post_count, protected, is_flagged)
+
+    def score(self, now: float) -> ActivityResult:
+        """
+        Scores every member in this table.
+
+        Members who can kick members are always active. A member that has never posted is inactive
+        once they have been here for a week. Otherwise, a member is inactive if
+        ``1.8 * 1.09 ^ days_inactive - 26`` exceeds their post count, unless they joined less than
+        three days ago.
+
+        :param now: The current timestamp.
+        """
+        has_posted = ~np.isnan(self.last_post)
+        days_joined = np.floor((now - self.joined_at) / DAY)
+        days_inactive = np.where(has_posted, np.floor((now - self.last_post) / DAY), 0)
+        days_inactive = days_inactive.astype(np.int64)
+
+        with np.errstate(over="ignore"):
+            algo_result = np.where(has_posted, 1.8 * np.power(1.09, days_inactive) - 26, 0.0)
+
+        post_count = np.minimum(self.post_count, MAX_POST_COUNT)
+        active = np.where(has_posted, (post_count > algo_result) | (days_joined < 3),
+                          days_joined < 7)
+        active |= self.protected
+
+        order = np.argsort(days_inactive, kind="mergesort")
+        return ActivityResult(member_ids=self.member_ids[order], flagged=self.flagged[order],
+                              active=active[order], algo_result=algo_result[order],
+                              post_count=post_count[order], last_post=self.last_post[order],
+                              days_inactive=days_inactive[order])
+
+
+#: The granularities that timestamps can be binned by.
+GRANULARITIES = ("day", "hour", "weekday")
+
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+
+def bin_keys(timestamps: np.ndarray, granularity: str = "day") -> np.ndarray:
+    """
+    Gets the bin of each timestamp.
+
+    :param timestamps: An array of UNIX timestamps.
+    :param granularity: One of ``day`` (days since the epoch), ``hour`` (hour of the day) or
+        ``weekday``.
+    :return: An integer array of bins.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity {granularity!r}")
+
+    seconds = timestamps.astype(np.int64)
+
+    if granularity == "day":
+        return seconds // DAY
+
+    if granularity == "hour":
+        return (seconds // 3600) % 24
+
+    # the epoch was a thursday
+    return (seconds // DAY + 3) % 7
+
+
+def bin_timestamps(timestamps: np.ndarray, granularity: str = "day") \
+        -> Tuple[List[str], np.ndarray]:
+    """
+    Bins some timestamps into a histogram.
+
+    :param timestamps: An array of UNIX timestamps.
+    :param granularity: One of ``day`` (calendar days), ``hour`` (hour of the day) or ``weekday``.
+    :return: A tuple of (bin labels, counts per bin).
+    """
+    keys, counts = bin_counts(bin_keys(timestamps, granularity), granularity)
+    return bin_labels(keys, granularity), counts
+
+
+def bin_counts(keys: np.ndarray, granularity: str,
+               weights: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Counts the timestamps in each bin.
+
+    :param keys: The bins, from :func:`.bin_keys`.
+    :param weights: The number of timestamps each key stands for, if not one each.
+    :return: A tuple of (bins, counts per bin). Only used days are included, but every hour and
+        weekday is.
+    """
+    if granularity == "day":
+        if weights is None:
+            return np.unique(keys, return_counts=True)
+
+        bins, inverse = np.unique(keys, return_inverse=True)
+        return bins, np.bincount(inverse, weights=weights).astype(np.int64)
+
+    size = 24 if granularity == "hour" else 7
+    counts = np.bincount(keys, weights=weights, minlength=size)
+    return np.arange(size), counts.astype(np.int64)
+
+
+def bin_labels(keys: np.ndarray, granularity: str) -> List[str]:
+    """
+    Gets the labels of some bins.
+    """
+    if granularity == "day":
+        days = keys.astype("datetime64[D]")
+        return list(np.datetime_as_string(days, unit="D"))
+
+    if granularity == "hour":
+        return [f"{hour:02d}:00" for hour in keys]
+
+    return [WEEKDAYS[day] for day in keys]
+
+
+#: The number of hours in a week.
+HOURS_PER_WEEK = 168
+
+
+def heatmap_array(counters: Dict[Tuple[int, int], int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Builds a channel x hour of the week array from some message counters.
+
+    :param counters: A mapping of (channel ID, hour of the week) -> message count.
+    :return: A tuple of (channel IDs, counts). The counts have a row for each channel, and a
+        column for each hour of the week.
+    """
+    channel_ids = np.asarray(sorted({channel_id for (channel_id, _) in counters}), dtype=np.int64)
+    counts = np.zeros((len(channel_ids), HOURS_PER_WEEK), dtype=np.int64)
+    if not counters:
+        return channel_ids, counts
+
+    keys = np.asarray(list(counters.keys()), dtype=np.int64)
+    rows = np.searchsorted(channel_ids, keys[:, 0])
+    counts[rows, keys[:, 1]] = np.fromiter(counters.values(), dtype=np.int64, count=len(counters))
+    return channel_ids, counts
@@ -11,8 +11,14 @@ from curious.commands.exc import CommandInvokeError, CommandRateLimited, Command
     MissingArgumentError
 from curious.exc import CuriousError, HTTPException
 
-from jokusoramame.db.connector import CurioAsyncpgConnector
+from jokusoramame.breakers import BreakerRegistry, CircuitOpenError, UpstreamError, UpstreamTimeout
+from jokusoramame.cache import RenderCache, ResponseCache
+from jokusoramame.db.connector import CONNECTORS
+from jokusoramame.jobs import JobManager
 from jokusoramame.redis import RedisInterface
+from jokusoramame.sessions import SessionPool
+from jokusoramame.sketch import SketchStore
+from jokusoramame.snapshots import SnapshotScheduler
 from jokusoramame.utils import display_time
 
 logger = logbook.Logger("Jokusoramame")
@@ -40,19 +46,54 @@ class Jokusoramame(Client):
 
         #: The DB object.
         self.db = DatabaseInterface(self.config.get("db_url"),
-                                    connector=CurioAsyncpgConnector)
+                                    connector=CONNECTORS[self.config.get("db_connector",
+                                                                        "asyncpg")])
 
         #: The redis interface.
         self.redis = RedisInterface(**self.config["redis"])
 
+        #: The response cache. Used to avoid repeating paid API requests.
+        response_cache_config = dict(self.config.get("response_cache", {}))
+        use_redis = response_cache_config.pop("redis", True)
+        self.response_cache = ResponseCache(self.redis if use_redis else None,
+                                            **response_cache_config)
+
+        #: The per-guild quantile sketches. Updated as messages are stored.
+        self.sketches = SketchStore(self.redis, **self.config.get("sketches", {}))
+
+        #: The circuit breakers for external APIs.
+        self.breakers = BreakerRegistry(self.config.get("breakers", {}))
+
+        #: The pooled HTTP sessions. Used for all outbound API requests.
+        self.sessions = SessionPool(self.breakers, **self.config.get("http", {}))
+
         #: The plotting lock. Used for pyplot compatability.
         self._plot_lock = threading.Lock()
 
+        #: The render cache. Used to avoid re-plotting identical plots.
+        self.render_cache = RenderCache(**self.config.get("render_cache", {}))
+
+        #: The background job manager. Used for long-running analyses.
+        self.jobs = JobManager(self, self.redis, **self.config.get("jobs", {}))
+
+        #: The analytics snapshot scheduler.
+        self.snapshots = SnapshotScheduler(self, self.redis, **self.config.get("snapshots", {}))
+
         self._loaded = False
 
     @event("command_error")
     async def command_error(self, ev_ctx: EventContext, ctx: Context, error: CommandsError):
-        if isinstance(error, CommandInvokeError):
+        if isinstance(error, CommandInvokeError) and isinstance(error.__cause__, UpstreamError):
+            cause = error.__cause__
+            if isinstance(cause, CircuitOpenError):
+                retry = display_time(int(math.ceil(cause.retry_after))) or "a moment"
+                await ctx.channel.messages.send(f":x: {cause.upstream} is currently unavailable. "
+                                                f"Try again in {retry}.")
+            elif isinstance(cause, UpstreamTimeout):
+                await ctx.channel.messages.send(f":x: {cause.upstream} took too long to respond.")
+            else:
+                await ctx.channel.messages.send(f":x: {cause}.")
+        elif isinstance(error, CommandInvokeError):
             if self.config.get("dev_mode"):
                 tb = traceback.format_exception(None,
                                                 error.__cause__,
@@ -99,6 +140,9 @@ class Jokusoramame(Client):
         else:
             return
 
+        # before any plugin can update a sketch
+        self.sketches.bind(self.user.id)
+
         logger.info(f"Connecting database.")
         try:
             await self.db.connect()
@@ -117,6 +161,10 @@ class Jokusoramame(Client):
                 logger.exception("Unable to load", plugin)
             logger.info("Loaded plugin {}.".format(plugin))
 
+        logger.info("Starting job workers.")
+        await self.jobs.start()
+        await self.snapshots.start()
+
     @event("message_create")
     async def log_message(self, ctx: EventContext, message: Message):
         """
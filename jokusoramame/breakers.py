@@ -0,0 +1,284 @@
+"""
+Circuit breakers for external APIs.
+"""
+import collections
+import enum
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple, Type
+
+import curio
+
+
+class BreakerState(enum.Enum):
+    #: Calls are let through.
+    CLOSED = "closed"
+
+    #: Calls fail fast.
+    OPEN = "open"
+
+    #: A single probe call is let through to test if the upstream has recovered.
+    HALF_OPEN = "half-open"
+
+
+class UpstreamError(Exception):
+    """
+    Base class for errors raised when an upstream can't be used.
+    """
+
+    def __init__(self, upstream: str, message: str):
+        super().__init__(message)
+
+        #: The name of the upstream.
+        self.upstream = upstream
+
+
+class CircuitOpenError(UpstreamError):
+    """
+    Raised when a call is made to an upstream with an open breaker.
+    """
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(upstream, f"The circuit for {upstream} is open")
+
+        #: The number of seconds until the breaker will let a probe call through.
+        self.retry_after = retry_after
+
+
+class UpstreamTimeout(UpstreamError):
+    """
+    Raised when a call to an upstream exceeds its deadline.
+    """
+
+    def __init__(self, upstream: str, deadline: float):
+        super().__init__(upstream, f"{upstream} did not respond within {deadline}s")
+
+        #: The deadline that was exceeded.
+        self.deadline = deadline
+
+
+class UpstreamBusy(UpstreamError):
+    """
+    Raised when too many calls to an upstream are still running in worker threads.
+    """
+
+    def __init__(self, upstream: str, max_threads: int):
+        super().__init__(upstream, f"{upstream} already has {max_threads} requests in progress")
+
+        #: The maximum number of threads.
+        self.max_threads = max_threads
+
+
+class CircuitBreaker(object):
+    """
+    A circuit breaker for a single upstream.
+
+    Calls are tracked in a rolling window. When enough calls in the window have failed or were
+    slower than the latency threshold, the breaker opens and all calls fail fast until the cooldown
+    has passed. After that, a single probe call is let through; if it succeeds the breaker closes
+    again, otherwise it re-opens.
+    """
+
+    def __init__(self, name: str, *, deadline: float = 10, window: float = 60,
+                 error_threshold: float = 0.5, latency_threshold: float = None,
+                 min_calls: int = 5, cooldown: float = 30, max_threads: int = 4):
+        """
+        :param name: The name of the upstream.
+        :param deadline: The hard deadline of a call, in seconds.
+        :param window: The length of the rolling window, in seconds.
+        :param error_threshold: The ratio of bad calls in the window that opens the breaker.
+        :param latency_threshold: Calls slower than this many seconds are counted as bad.
+        :param min_calls: The minimum number of calls in the window before the breaker can open.
+        :param cooldown: The number of seconds to stay open before letting a probe through.
+        :param max_threads: The maximum number of calls that can run in worker threads at once.
+        """
+        self.name = name
+        self.deadline = deadline
+        self.window = window
+        self.error_threshold = error_threshold
+        self.latency_threshold = latency_threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.max_threads = max_threads
+
+        #: The current state of this breaker.
+        self.state = BreakerState.CLOSED
+
+        #: The (timestamp, latency, ok) samples in the current window.
+        self.samples = collections.deque()
+
+        self._opened_at = 0.0
+        self._probing = False
+        self._threads = threading.BoundedSemaphore(max_threads)
+
+    def _prune(self, now: float):
+        while self.samples and self.samples[0][0] < now - self.window:
+            self.samples.popleft()
+
+    def check(self):
+        """
+        Checks if a call can be made, raising :class:`.CircuitOpenError` if not.
+        """
+        if self.state is BreakerState.CLOSED:
+            return
+
+        now = time.monotonic()
+        if self.state is BreakerState.OPEN:
+            retry_after = self._opened_at + self.cooldown - now
+            if retry_after > 0:
+                raise CircuitOpenError(self.name, retry_after)
+
+            self.state = BreakerState.HALF_OPEN
+
+        # half-open, only one probe at a time
+        if self._probing:
+            raise CircuitOpenError(self.name, 0)
+
+        self._probing = True
+
+    def record(self, latency: float, ok: bool):
+        """
+        Records the result of a call.
+
+        :param latency: How long the call took, in seconds.
+        :param ok: If the call succeeded.
+        """
+        now = time.monotonic()
+        if ok and self.latency_threshold is not None and latency > self.latency_threshold:
+            ok = False
+
+        self.samples.append((now, latency, ok))
+        self._prune(now)
+
+        if self.state is BreakerState.HALF_OPEN:
+            self._probing = False
+            if ok:
+                self.state = BreakerState.CLOSED
+                self.samples.clear()
+            else:
+                self._open(now)
+            return
+
+        if len(self.samples) < self.min_calls:
+            return
+
+        if self.error_rate >= self.error_threshold:
+            self._open(now)
+
+    def _open(self, now: float):
+        self.state = BreakerState.OPEN
+        self._opened_at = now
+
+    @property
+    def error_rate(self) -> float:
+        """
+        :return: The ratio of bad calls in the current window.
+        """
+        if not self.samples:
+            return 0.0
+
+        return sum(not ok for (_, _, ok) in self.samples) / len(self.samples)
+
+    def latency_percentile(self, percentile: float) -> float:
+        """
+        Gets a latency percentile over the current window.
+
+        :param percentile: The percentile to get, from 0 to 100.
+        :return: The latency, in seconds.
+        """
+        self._prune(time.monotonic())
+        latencies = sorted(latency for (_, latency, _) in self.samples)
+        if not latencies:
+            return 0.0
+
+        index = min(int(len(latencies) * percentile / 100), len(latencies) - 1)
+        return latencies[index]
+
+    async def call(self, func: Callable[..., Awaitable[Any]], *args,
+                   failed: Callable[[Any], bool] = None,
+                   ignore: Tuple[Type[Exception], ...] = (), **kwargs) -> Any:
+        """
+        Calls a coroutine function through this breaker, under its deadline.
+
+        :param func: The coroutine function to call.
+        :param failed: A callable that checks if a successful result should count as a failure.
+        :param ignore: Exception types that are not the upstream's fault, and don't count.
+        :return: The result of the call.
+        """
+        self.check()
+
+        before = time.monotonic()
+        try:
+            async with curio.timeout_after(self.deadline):
+                result = await func(*args, **kwargs)
+        except curio.TaskTimeout:
+            self.record(time.monotonic() - before, False)
+            raise UpstreamTimeout(self.name, self.deadline) from None
+        except curio.CancelledError:
+            # the caller went away, which says nothing about the upstream
+            self._probing = False
+            raise
+        except ignore:
+            self.record(time.monotonic() - before, True)
+            raise
+        except Exception:
+            self.record(time.monotonic() - before, False)
+            raise
+
+        self.record(time.monotonic() - before, failed is None or not failed(result))
+        return result
+
+    async def call_in_thread(self, func: Callable[..., Any], *args,
+                             ignore: Tuple[Type[Exception], ...] = (), **kwargs) -> Any:
+        """
+        Calls a blocking function in a worker thread through this breaker, under its deadline.
+
+        Threads can't be cancelled, so a call that passes the deadline keeps running in its thread
+        after :class:`.UpstreamTimeout` is raised. To stop a slow upstream from piling up
+        abandoned threads, at most ``max_threads`` calls can be running at once, including
+        abandoned ones; calls past that raise :class:`.UpstreamBusy`.
+
+        :param func: The function to call.
+        :param ignore: Exception types that are not the upstream's fault, and don't count.
+        :return: The result of the call.
+        """
+        def run():
+            # acquired and released in the thread, so that abandoned calls still hold a slot
+            if not self._threads.acquire(blocking=False):
+                raise UpstreamBusy(self.name, self.max_threads)
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._threads.release()
+
+        return await self.call(curio.run_in_thread, run, ignore=(UpstreamBusy, *ignore))
+
+
+class BreakerRegistry(object):
+    """
+    Holds the circuit breakers for each upstream.
+    """
+
+    def __init__(self, config: Dict[str, dict] = None):
+        """
+        :param config: A mapping of upstream -> breaker options. The ``default`` key applies to
+            every upstream.
+        """
+        self.config = config or {}
+        self.breakers = {}  # type: Dict[str, CircuitBreaker]
+
+    def get(self, name: str) -> CircuitBreaker:
+        """
+        Gets the breaker for an upstream, creating it if needed.
+        """
+        try:
+            return self.breakers[name]
+        except KeyError:
+            options = {**self.config.get("default", {}), **self.config.get(name, {})}
+            breaker = CircuitBreaker(name, **options)
+            self.breakers[name] = breaker
+            return breaker
+
+    def __iter__(self):
+        return iter(sorted(self.breakers.values(), key=lambda b: b.name))
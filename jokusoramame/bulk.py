@@ -0,0 +1,241 @@
+"""
+Bulk member operations.
+"""
+import enum
+import time
+from typing import Any, Dict, List, Tuple
+
+import curio
+import logbook
+from curious import Guild, Member, Message
+from curious.exc import CuriousError
+from dataclasses import dataclass
+
+from jokusoramame.redis import RedisInterface
+from jokusoramame.utils import timesliced
+
+logger = logbook.Logger("Jokusoramame.bulk")
+
+
+class BulkAction(enum.Enum):
+    KICK = "kick"
+    NICKNAME = "nickname"
+    ADD_ROLES = "add roles"
+    REMOVE_ROLES = "remove roles"
+
+
+@dataclass
+class BulkOperation:
+    #: The ID of the member to operate on.
+    member_id: int
+
+    #: The action to perform.
+    action: BulkAction
+
+    #: The nickname, or the list of role IDs, for the action.
+    value: Any = None
+
+
+@dataclass
+class BulkResult:
+    #: The number of operations that succeeded.
+    succeeded: int = 0
+
+    #: The number of operations that failed.
+    failed: int = 0
+
+    #: The number of operations skipped, because they were already done or the member left.
+    skipped: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.succeeded + self.failed + self.skipped
+
+
+class RouteBucket(object):
+    """
+    Paces requests to a single Discord rate-limit route.
+
+    This keeps bulk operations under the route's limit, rather than relying on 429 responses that
+    would also delay every other request to the same route.
+    """
+
+    def __init__(self, limit: int, per: float):
+        """
+        :param limit: The number of requests allowed per period.
+        :param per: The length of the period, in seconds.
+        """
+        self.limit = limit
+        self.per = per
+        self._lock = curio.Lock()
+        self._sent = []  # type: List[float]
+
+    async def acquire(self):
+        """
+        Waits until a request can be made on this route.
+        """
+        async with self._lock:
+            now = time.monotonic()
+            self._sent = [sent for sent in self._sent if sent > now - self.per]
+            if len(self._sent) >= self.limit:
+                await curio.sleep(self._sent[0] + self.per - now)
+
+            self._sent.append(time.monotonic())
+
+
+class BulkEngine(object):
+    """
+    Runs a batch of member operations in a guild.
+
+    Operations run with bounded concurrency, paced per Discord rate-limit route. Completed members
+    are checkpointed in Redis, so a job that is interrupted and started again with the same ID
+    resumes where it left off.
+    """
+    #: The (limit, period) of each route. Every action is a per-guild route.
+    ROUTE_LIMITS = {
+        BulkAction.KICK: (5, 5.0),
+        BulkAction.NICKNAME: (10, 10.0),
+        BulkAction.ADD_ROLES: (10, 10.0),
+        BulkAction.REMOVE_ROLES: (10, 10.0),
+    }
+
+    def __init__(self, redis: RedisInterface, guild: Guild, job_id: str,
+                 operations: List[BulkOperation], *, concurrency: int = 4,
+                 dry_run: bool = False, progress_message: Message = None,
+                 progress_interval: float = 5.0):
+        """
+        :param redis: The :class:`.RedisInterface` used for checkpoints.
+        :param guild: The :class:`.Guild` to operate in.
+        :param job_id: The ID of this job. Re-using an ID resumes the job.
+        :param operations: The operations to run.
+        :param concurrency: The maximum number of operations running at once.
+        :param dry_run: If True, operations are counted but not performed.
+        :param progress_message: A message to edit with progress updates.
+        :param progress_interval: The minimum number of seconds between progress updates.
+        """
+        self.redis = redis
+        self.guild = guild
+        self.job_id = job_id
+        self.operations = operations
+        self.concurrency = concurrency
+        self.dry_run = dry_run
+        self.progress_message = progress_message
+        self.progress_interval = progress_interval
+
+        #: The result so far.
+        self.result = BulkResult()
+
+        self._buckets = {}  # type: Dict[Tuple[int, BulkAction], RouteBucket]
+        self._last_progress = 0.0
+
+    def _get_bucket(self, action: BulkAction) -> RouteBucket:
+        key = (self.guild.id, action)
+        try:
+            return self._buckets[key]
+        except KeyError:
+            bucket = RouteBucket(*self.ROUTE_LIMITS[action])
+            self._buckets[key] = bucket
+            return bucket
+
+    async def _perform(self, member: Member, operation: BulkOperation):
+        action = operation.action
+        if action is BulkAction.KICK:
+            await self.guild.kick(member)
+        elif action is BulkAction.NICKNAME:
+            await member.nickname.set(operation.value)
+        else:
+            roles = [self.guild.roles[role_id] for role_id in operation.value
+                     if role_id in self.guild.roles]
+            if action is BulkAction.ADD_ROLES:
+                await member.roles.add(*roles)
+            else:
+                await member.roles.remove(*roles)
+
+    async def _run_operation(self, operation: BulkOperation):
+        member = self.guild.members.get(operation.member_id)
+        if member is None:
+            self.result.skipped += 1
+            return
+
+        if self.dry_run:
+            self.result.succeeded += 1
+            return
+
+        await self._get_bucket(operation.action).acquire()
+        try:
+            await self._perform(member, operation)
+        except CuriousError:
+            logger.exception(f"Failed to {operation.action.value} {operation.member_id}")
+            self.result.failed += 1
+        else:
+            self.result.succeeded += 1
+            await self.redis.add_bulk_checkpoint(self.job_id, operation.member_id)
+
+    async def _worker(self, queue: curio.Queue):
+        while True:
+            operation = await queue.get()
+            try:
+                if operation is None:
+                    return
+
+                await self._run_operation(operation)
+                await self.update_progress()
+            finally:
+                await queue.task_done()
+
+    def format_progress(self, finished: bool = False) -> str:
+        """
+        Formats a progress message.
+        """
+        prefix = "[dry run] " if self.dry_run else ""
+        status = "Finished" if finished else "Working"
+        return (f"{prefix}{status}: {self.result.total}/{len(self.operations)} members "
+                f"({self.result.succeeded} successful, {self.result.failed} failed, "
+                f"{self.result.skipped} skipped).")
+
+    async def update_progress(self, *, force: bool = False, finished: bool = False):
+        """
+        Edits the progress message, if enough time has passed since the last edit.
+        """
+        if self.progress_message is None:
+            return
+
+        now = time.monotonic()
+        if not force and now - self._last_progress < self.progress_interval:
+            return
+
+        self._last_progress = now
+        try:
+            await self.progress_message.edit(self.format_progress(finished))
+        except CuriousError:
+            pass
+
+    async def run(self) -> BulkResult:
+        """
+        Runs all of the operations.
+
+        :return: The :class:`.BulkResult` of this job.
+        """
+        done = set() if self.dry_run else await self.redis.get_bulk_checkpoint(self.job_id)
+
+        queue = curio.Queue()
+        async for operation in timesliced(self.operations, name="bulk"):
+            if operation.member_id in done:
+                self.result.skipped += 1
+                continue
+
+            await queue.put(operation)
+
+        workers = max(min(self.concurrency, queue.qsize()), 1)
+        for _ in range(workers):
+            await queue.put(None)
+
+        async with curio.TaskGroup() as group:
+            for _ in range(workers):
+                await group.spawn(self._worker, queue)
+
+        if not self.dry_run:
+            await self.redis.clear_bulk_checkpoint(self.job_id)
+
+        await self.update_progress(force=True, finished=True)
+        return self.result
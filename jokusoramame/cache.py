@@ -0,0 +1,416 @@
+"""
+Caching utilities.
+"""
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+def make_key(*parts: Any) -> str:
+    """
+    Makes a content-addressed key out of some parts.
+
+    Every part is hashed by its ``repr``, so parts should be plain data (numbers, strings,
+    tuples, lists).
+
+    :param parts: The parts to hash.
+    :return: The hex digest of the parts.
+    """
+    hasher = hashlib.sha256()
+    for part in parts:
+        hasher.update(repr(part).encode("utf-8"))
+        hasher.update(b"\x00")
+
+    return hasher.hexdigest()
+
+
+class ByteLRUCache(object):
+    """
+    A least-recently-used cache of bytes, bounded by the total size of the values stored.
+
+    This is safe to use from threads.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 ** 2):
+        """
+        :param max_bytes: The maximum amount of bytes to hold in memory.
+        """
+        #: The maximum size of this cache.
+        self.max_bytes = max_bytes
+
+        #: The current size of this cache.
+        self.size = 0
+
+        #: The number of lookups that were hits.
+        self.hits = 0
+
+        #: The number of lookups that were misses.
+        self.misses = 0
+
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._items
+
+    def _get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                return None
+
+            self._items.move_to_end(key)
+            return value
+
+    def _put(self, key: str, value: bytes) -> List[Tuple[str, bytes]]:
+        """
+        Puts an item into the cache.
+
+        :return: A list of (key, value) pairs that were evicted to make room.
+        """
+        evicted = []
+
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+
+            # never cache something that can't fit
+            if len(value) > self.max_bytes:
+                return [(key, value)]
+
+            self._items[key] = value
+            self.size += len(value)
+
+            while self.size > self.max_bytes:
+                old_key, old_value = self._items.popitem(last=False)
+                self.size -= len(old_value)
+                evicted.append((old_key, old_value))
+
+        return evicted
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Gets an item from the cache.
+
+        :param key: The key to look up.
+        :return: The cached bytes, or None if this key is not cached.
+        """
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return value
+
+    def put(self, key: str, value: bytes):
+        """
+        Puts an item into the cache, evicting the least recently used items if needed.
+
+        :param key: The key to store under.
+        :param value: The bytes to store.
+        """
+        self._put(key, value)
+
+    def clear(self):
+        """
+        Clears this cache.
+        """
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        :return: The ratio of lookups that were hits.
+        """
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+
+        return self.hits / total
+
+
+class RenderCache(ByteLRUCache):
+    """
+    A cache for rendered plots, keyed by a hash of the plot inputs.
+
+    Items evicted from memory are optionally spilled to a directory on disk, and promoted back
+    into memory when they are next requested. The spill directory has its own byte budget, and
+    the least recently used files are deleted to stay under it.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 ** 2, disk_path: str = None,
+                 max_disk_bytes: int = 256 * 1024 ** 2):
+        """
+        :param max_bytes: The maximum amount of bytes to hold in memory.
+        :param disk_path: The directory to spill evicted renders to, if any.
+        :param max_disk_bytes: The maximum amount of bytes to keep in the spill directory.
+        """
+        super().__init__(max_bytes=max_bytes)
+
+        #: The directory to spill renders to.
+        self.disk_path = disk_path
+
+        #: The maximum size of the spill directory.
+        self.max_disk_bytes = max_disk_bytes
+
+        #: The current size of the spill directory.
+        self.disk_size = 0
+
+        # key -> size of the spilled files, least recently used first
+        self._disk_items = collections.OrderedDict()
+        self._disk_lock = threading.Lock()
+
+        if self.disk_path is not None:
+            os.makedirs(self.disk_path, exist_ok=True)
+            self._scan_disk()
+
+    def _disk_file(self, key: str) -> str:
+        return os.path.join(self.disk_path, f"{key}.bin")
+
+    def _scan_disk(self):
+        """
+        Indexes the files left in the spill directory by a previous run, oldest first.
+        """
+        files = []
+        for entry in os.scandir(self.disk_path):
+            if entry.name.endswith(".tmp"):
+                os.remove(entry.path)
+            elif entry.name.endswith(".bin"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+
+        for _, key, size in sorted(files):
+            self._disk_items[key] = size
+            self.disk_size += size
+
+        self._trim_disk()
+
+    def _trim_disk(self):
+        """
+        Deletes the least recently used spilled files until the directory is within its budget.
+        """
+        while self.disk_size > self.max_disk_bytes and self._disk_items:
+            key, size = self._disk_items.popitem(last=False)
+            self.disk_size -= size
+            try:
+                os.remove(self._disk_file(key))
+            except FileNotFoundError:
+                pass
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        with self._disk_lock:
+            if key not in self._disk_items:
+                return None
+
+            try:
+                with open(self._disk_file(key), 'rb') as f:
+                    value = f.read()
+            except FileNotFoundError:
+                self.disk_size -= self._disk_items.pop(key)
+                return None
+
+            self._disk_items.move_to_end(key)
+            return value
+
+    def _write_disk(self, key: str, value: bytes):
+        # never spill something that can't fit
+        if len(value) > self.max_disk_bytes:
+            return
+
+        with self._disk_lock:
+            if key in self._disk_items:
+                self._disk_items.move_to_end(key)
+                return
+
+            # write then rename, so that a reader never sees half a file
+            path = self._disk_file(key)
+            tmp = path + ".tmp"
+            with open(tmp, 'wb') as f:
+                f.write(value)
+            os.replace(tmp, path)
+
+            self._disk_items[key] = len(value)
+            self.disk_size += len(value)
+            self._trim_disk()
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._get(key)
+        if value is None and self.disk_path is not None:
+            value = self._read_disk(key)
+            if value is not None:
+                self.put(key, value)
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return value
+
+    def put(self, key: str, value: bytes):
+        evicted = self._put(key, value)
+        if self.disk_path is None:
+            return
+
+        for old_key, old_value in evicted:
+            self._write_disk(old_key, old_value)
+
+
+class CachedResponse(object):
+    """
+    A response served from a :class:`.ResponseCache`.
+
+    This mirrors the parts of :class:`asks.response_objects.Response` used by the plugins.
+    """
+
+    def __init__(self, status_code: int, content: bytes, cached: bool = True):
+        #: The status code of the original response.
+        self.status_code = status_code
+
+        #: The body of the original response.
+        self.content = content
+
+        #: If this response was served from the cache.
+        self.cached = cached
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+class ResponseCache(object):
+    """
+    A two-tier cache for responses from external text analysis APIs.
+
+    Responses are keyed on the endpoint, the model, and a hash of the normalized input text. The
+    first tier is a byte-bounded in-memory LRU, and the second tier is an optional shared Redis
+    cache.
+    """
+    #: The default time-to-live of responses, in seconds, by endpoint.
+    DEFAULT_TTLS = {
+        "perspective": 86_400,
+        "aylien.sentiment": 604_800,
+        "aylien.related": 2_592_000,
+        "watson.personality": 86_400,
+    }
+
+    def __init__(self, redis: 'RedisInterface' = None, *, max_bytes: int = 8 * 1024 ** 2,
+                 ttls: Dict[str, int] = None):
+        """
+        :param redis: The :class:`.RedisInterface` to use as the second tier, if any.
+        :param max_bytes: The maximum amount of bytes to hold in memory.
+        :param ttls: A mapping of endpoint -> TTL overrides.
+        """
+        self.redis = redis
+        self.memory = ByteLRUCache(max_bytes=max_bytes)
+
+        #: The time-to-live of responses, by endpoint.
+        self.ttls = {**self.DEFAULT_TTLS, **(ttls or {})}
+
+        #: The hits, by endpoint.
+        self.hits = collections.Counter()
+
+        #: The misses, by endpoint.
+        self.misses = collections.Counter()
+
+        #: The hits, by the tier that answered them (``memory`` or ``redis``).
+        self.tier_hits = collections.Counter()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """
+        Normalizes text for hashing.
+
+        This only folds unicode forms and whitespace, as the case of a message affects the results
+        of most of the APIs.
+        """
+        text = unicodedata.normalize("NFC", text)
+        return " ".join(text.split())
+
+    def make_key(self, endpoint: str, model: str, text: str) -> str:
+        """
+        Makes the cache key for a request.
+        """
+        return f"{endpoint}:{model}:{make_key(self.normalize(text))}"
+
+    async def get(self, endpoint: str, model: str, text: str) -> Optional[CachedResponse]:
+        """
+        Gets a cached response.
+
+        :param endpoint: The name of the endpoint.
+        :param model: The model or attribute requested from the endpoint.
+        :param text: The text the request was for.
+        :return: A :class:`.CachedResponse`, or None if nothing was cached.
+        """
+        key = self.make_key(endpoint, model, text)
+
+        item = self.memory.get(key)
+        if item is not None:
+            expires, content = item.split(b"\x00", 1)
+            if float(expires) > time.time():
+                self.hits[endpoint] += 1
+                self.tier_hits["memory"] += 1
+                return CachedResponse(200, content)
+
+        if self.redis is not None:
+            content = await self.redis.get_cached_response(key)
+            if content is not None:
+                self.hits[endpoint] += 1
+                self.tier_hits["redis"] += 1
+                self._put_memory(key, endpoint, content)
+                return CachedResponse(200, content)
+
+        self.misses[endpoint] += 1
+        return None
+
+    def _put_memory(self, key: str, endpoint: str, content: bytes):
+        expires = time.time() + self.ttls.get(endpoint, 3600)
+        self.memory.put(key, str(expires).encode() + b"\x00" + content)
+
+    async def put(self, endpoint: str, model: str, text: str, content: bytes):
+        """
+        Caches the body of a successful response.
+        """
+        key = self.make_key(endpoint, model, text)
+        self._put_memory(key, endpoint, content)
+
+        if self.redis is not None:
+            await self.redis.set_cached_response(key, content, self.ttls.get(endpoint, 3600))
+
+    async def fetch(self, endpoint: str, model: str, text: str,
+                    request: Callable[[], Awaitable[Any]]):
+        """
+        Gets a response from the cache, or makes the request and caches the result if it was
+        successful.
+
+        :param endpoint: The name of the endpoint.
+        :param model: The model or attribute requested from the endpoint.
+        :param text: The text the request was for.
+        :param request: A callable that makes the real request.
+        :return: A :class:`.CachedResponse` or the response returned by ``request``.
+        """
+        cached = await self.get(endpoint, model, text)
+        if cached is not None:
+            return cached
+
+        response = await request()
+        if response.status_code == 200:
+            await self.put(endpoint, model, text, response.content)
+
+        return response
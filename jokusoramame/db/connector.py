@@ -1,10 +1,17 @@
 """
-A custom connector, that wraps asyncpg in curio.
+Custom connectors, that run PostgreSQL queries from curio.
 """
+import collections
+import functools
+import typing
+
+from asyncqlio.backends.base import BaseConnector, BaseResultSet, BaseTransaction, DictRow
 from asyncqlio.backends.postgresql.asyncpg import AsyncpgConnector, AsyncpgResultSet, \
-    AsyncpgTransaction
+    AsyncpgTransaction, get_param_query
+from asyncqlio.exc import DatabaseException, IntegrityError, OperationalError
 from curio import asyncio_coroutine
 
+from jokusoramame.db.pgwire import ConnectionPool, PostgresConnection, PostgresError, QueryResult
 from jokusoramame.utils import loop as bridge_loop
 
 
@@ -24,6 +31,9 @@ class CurioAsyncpgConnector(AsyncpgConnector):
         super().__init__(*args, **kwargs)
 
         self.params["max_size"] = 50
+        # asyncpg keeps its own per-connection LRU of prepared statements
+        if "statement_cache_size" in self.params:
+            self.params["statement_cache_size"] = int(self.params["statement_cache_size"])
 
         # Monkeypatch some methods
         self.close = patch(self.close)
@@ -72,3 +82,167 @@ class CurioAsyncpgResultSet(AsyncpgResultSet):
         self.fetch_row = patch(self.fetch_row)
         self.fetch_many = patch(self.fetch_many)
         self.close = patch(self.close)
+
+
+def translate_error(error: PostgresError) -> DatabaseException:
+    """
+    Translates a server error into the asyncqlio exception for its SQLSTATE class.
+    """
+    if error.sqlstate.startswith("23"):
+        return IntegrityError(*error.args)
+
+    if error.sqlstate.startswith("55"):
+        return OperationalError(*error.args)
+
+    return DatabaseException(*error.args)
+
+
+class CurioPostgresConnector(BaseConnector):
+    """
+    A connector that speaks the PostgreSQL protocol natively with curio.
+
+    Unlike :class:`.CurioAsyncpgConnector`, queries never leave the curio loop.
+    """
+
+    def __init__(self, parsed, *, loop=None):
+        super().__init__(parsed, loop=loop)
+
+        #: The :class:`.ConnectionPool` of this connector.
+        self.pool = None  # type: ConnectionPool
+
+        #: The prepared statement cache hits, misses and evictions, across every connection.
+        self.statement_stats = collections.Counter()
+
+    async def connect(self, **kwargs) -> 'CurioPostgresConnector':
+        connect = functools.partial(PostgresConnection.connect, host=self.host or "127.0.0.1",
+                                    port=self.port or 5432, user=self.username,
+                                    password=self.password, database=self.db,
+                                    statement_cache_size=int(self.params.get(
+                                        "statement_cache_size", 100)),
+                                    statement_stats=self.statement_stats)
+        self.pool = ConnectionPool(connect, max_size=int(self.params.get("max_size", 50)))
+
+        # open the first connection now, so that bad credentials fail at startup
+        connection = await self.pool.acquire()
+        await self.pool.release(connection)
+        return self
+
+    async def close(self):
+        await self.pool.close()
+
+    def emit_param(self, name: str) -> str:
+        # the same placeholders as the asyncpg connector, rewritten by get_param_query
+        return "{{{name}}}".format(name=name)
+
+    def get_transaction(self) -> 'CurioPostgresTransaction':
+        return CurioPostgresTransaction(self)
+
+    async def get_db_server_info(self):
+        return None
+
+
+class CurioPostgresTransaction(BaseTransaction):
+    """
+    A transaction on a connection acquired from a :class:`.CurioPostgresConnector`.
+    """
+
+    def __init__(self, connector: CurioPostgresConnector):
+        super().__init__(connector)
+
+        #: The acquired connection from the connection pool.
+        self.connection = None  # type: PostgresConnection
+
+    async def _run(self, sql: str, params: typing.Mapping[str, typing.Any] = None) \
+            -> QueryResult:
+        query, args = get_param_query(sql, params)
+        try:
+            return await self.connection.execute(query, args)
+        except PostgresError as e:
+            raise translate_error(e) from e
+
+    async def _run_simple(self, sql: str):
+        try:
+            await self.connection.simple_query(sql)
+        except PostgresError as e:
+            raise translate_error(e) from e
+
+    async def begin(self):
+        self.connection = await self.connector.pool.acquire()
+        await self._run_simple("BEGIN")
+        return self
+
+    async def commit(self):
+        await self._run_simple("COMMIT")
+
+    async def rollback(self, checkpoint: str = None):
+        if checkpoint is not None:
+            await self._run_simple("ROLLBACK TO {}".format(checkpoint))
+        else:
+            await self._run_simple("ROLLBACK")
+
+    async def close(self):
+        if self.connection is None:
+            return
+
+        connection, self.connection = self.connection, None
+        if connection.transaction_status != b"I" and not connection.broken:
+            # never hand a connection back mid-transaction
+            try:
+                await connection.simple_query("ROLLBACK")
+            except PostgresError:
+                pass
+
+        await self.connector.pool.release(connection)
+
+    async def execute(self, sql: str, params: typing.Mapping[str, typing.Any] = None):
+        result = await self._run(sql, params)
+        return result.status
+
+    async def cursor(self, sql: str, params: typing.Mapping[str, typing.Any] = None) \
+            -> 'CurioPostgresResultSet':
+        return CurioPostgresResultSet(await self._run(sql, params))
+
+    async def create_savepoint(self, name: str):
+        await self._run_simple("SAVEPOINT {};".format(name))
+
+    async def release_savepoint(self, name: str):
+        await self._run_simple("RELEASE SAVEPOINT {};".format(name))
+
+
+class CurioPostgresResultSet(BaseResultSet):
+    """
+    The rows of a query run by a :class:`.CurioPostgresTransaction`.
+
+    Rows are read in full before the query returns, so fetching them never waits on the server.
+    """
+
+    def __init__(self, result: QueryResult):
+        self.result = result
+        self._position = 0
+
+    @property
+    def keys(self) -> typing.Iterable[str]:
+        return self.result.columns
+
+    async def fetch_row(self):
+        if self._position >= len(self.result.rows):
+            return None
+
+        row = self.result.rows[self._position]
+        self._position += 1
+        return DictRow(zip(self.result.columns, row))
+
+    async def fetch_many(self, n: int):
+        rows = self.result.rows[self._position:self._position + n]
+        self._position += len(rows)
+        return [DictRow(zip(self.result.columns, row)) for row in rows]
+
+    async def close(self):
+        pass
+
+
+#: The connectors that can be selected with the ``db_connector`` config option.
+CONNECTORS = {
+    "asyncpg": CurioAsyncpgConnector,
+    "curio": CurioPostgresConnector,
+}
@@ -0,0 +1,686 @@
+"""
+A curio-native PostgreSQL client.
+
+This speaks version 3 of the PostgreSQL wire protocol directly over a curio socket, so that queries
+run on the bot's own event loop instead of being handed over to asyncpg on the asyncio bridge.
+"""
+import base64
+import collections
+import datetime
+import decimal
+import hashlib
+import hmac
+import os
+import struct
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import curio
+
+#: Protocol version 3.0.
+PROTOCOL_VERSION = 196608
+
+_INT16 = struct.Struct("!h")
+_INT32 = struct.Struct("!i")
+_HEADER = struct.Struct("!ci")
+_NULL = _INT32.pack(-1)
+
+
+class InterfaceError(Exception):
+    """
+    Raised when the connection can't be used, or the server does something unexpected.
+    """
+
+
+class PostgresError(Exception):
+    """
+    Raised when the server returns an error.
+    """
+
+    def __init__(self, fields: Dict[str, str]):
+        super().__init__(fields.get("M", "Unknown error"))
+
+        #: The fields of the error, keyed by their one letter field type.
+        self.fields = fields
+
+        #: The SQLSTATE code of the error.
+        self.sqlstate = fields.get("C", "")
+
+
+class DecodeError(PostgresError):
+    """
+    Raised when a value sent by the server can't be decoded, such as an ``infinity`` timestamp.
+
+    This has the SQLSTATE of a data exception, and the rest of the result is still read, so the
+    connection stays usable.
+    """
+
+    def __init__(self, message: str):
+        super().__init__({"S": "ERROR", "C": "22000", "M": message})
+
+
+def _cstr(value: str) -> bytes:
+    return value.encode("utf-8") + b"\x00"
+
+
+def _message(kind: bytes, *parts: bytes) -> bytes:
+    body = b"".join(parts)
+    return kind + _INT32.pack(len(body) + 4) + body
+
+
+def _parse_fields(body: bytes) -> Dict[str, str]:
+    fields = {}
+    for field in body.split(b"\x00"):
+        if field:
+            fields[field[:1].decode()] = field[1:].decode("utf-8", errors="replace")
+
+    return fields
+
+
+SYNC = _message(b"S")
+TERMINATE = _message(b"X")
+
+
+# text format decoders, by type OID
+def _decode_bool(value: str) -> bool:
+    return value == "t"
+
+
+def _decode_bytea(value: str) -> bytes:
+    # connections always use the hex output format
+    return bytes.fromhex(value[2:])
+
+
+def _decode_date(value: str) -> datetime.date:
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def _decode_timestamp(value: str) -> datetime.datetime:
+    fmt = "%Y-%m-%d %H:%M:%S.%f" if "." in value else "%Y-%m-%d %H:%M:%S"
+    return datetime.datetime.strptime(value, fmt)
+
+
+def _decode_timestamptz(value: str) -> datetime.datetime:
+    # connections always use UTC, so the offset is always +00
+    return _decode_timestamp(value[:-3]).replace(tzinfo=datetime.timezone.utc)
+
+
+DECODERS = {
+    16: _decode_bool,
+    17: _decode_bytea,
+    20: int,
+    21: int,
+    23: int,
+    26: int,
+    700: float,
+    701: float,
+    1082: _decode_date,
+    1114: _decode_timestamp,
+    1184: _decode_timestamptz,
+    1700: decimal.Decimal,
+}
+
+
+def encode_param(value: Any) -> Optional[bytes]:
+    """
+    Encodes a query parameter in the text format.
+
+    Parameters are sent untyped, so the server infers their types from the query.
+    """
+    if value is None:
+        return None
+
+    if isinstance(value, bool):
+        return b"t" if value else b"f"
+
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return b"\\x" + bytes(value).hex().encode()
+
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat().encode()
+
+    return str(value).encode("utf-8")
+
+
+class ScramSHA256(object):
+    """
+    The client side of a SCRAM-SHA-256 exchange.
+    """
+
+    def __init__(self, password: str):
+        self.password = password.encode("utf-8")
+        self.nonce = base64.b64encode(os.urandom(18)).decode()
+
+        # the server takes the user name from the startup message, so it is left empty here
+        self.client_first_bare = f"n=,r={self.nonce}"
+        self.server_signature = None  # type: bytes
+
+    @staticmethod
+    def _attributes(message: bytes) -> Dict[str, str]:
+        return dict(item.split("=", 1) for item in message.decode().split(","))
+
+    def client_first(self) -> bytes:
+        return f"n,,{self.client_first_bare}".encode()
+
+    def client_final(self, server_first: bytes) -> bytes:
+        attributes = self._attributes(server_first)
+        nonce = attributes["r"]
+        if not nonce.startswith(self.nonce):
+            raise InterfaceError("The server sent an invalid SCRAM nonce")
+
+        salted = hashlib.pbkdf2_hmac("sha256", self.password, base64.b64decode(attributes["s"]),
+                                     int(attributes["i"]))
+        client_key = hmac.new(salted, b"Client Key", hashlib.sha256).digest()
+        stored_key = hashlib.sha256(client_key).digest()
+
+        final_bare = f"c=biws,r={nonce}"
+        auth_message = f"{self.client_first_bare},{server_first.decode()},{final_bare}".encode()
+        signature = hmac.new(stored_key, auth_message, hashlib.sha256).digest()
+        proof = bytes(a ^ b for (a, b) in zip(client_key, signature))
+
+        server_key = hmac.new(salted, b"Server Key", hashlib.sha256).digest()
+        self.server_signature = hmac.new(server_key, auth_message, hashlib.sha256).digest()
+        return f"{final_bare},p={base64.b64encode(proof).decode()}".encode()
+
+    def verify(self, server_final: bytes):
+        attributes = self._attributes(server_final)
+        if "e" in attributes:
+            raise InterfaceError(f"SCRAM authentication failed: {attributes['e']}")
+
+        if not hmac.compare_digest(base64.b64decode(attributes["v"]), self.server_signature):
+            raise InterfaceError("The server's SCRAM signature is invalid")
+
+
+#: The description of a result's columns, as (name, decoder).
+Description = List[Tuple[str, Optional[Callable[[str], Any]]]]
+
+
+@dataclass
+class PreparedStatement:
+    #: The name of the statement on the server.
+    name: str
+
+    #: The description of the statement's result columns.
+    description: Description
+
+
+class StatementCache(object):
+    """
+    An LRU of the prepared statements on one connection, keyed on their SQL text.
+    """
+
+    def __init__(self, max_size: int = 100, stats: collections.Counter = None):
+        """
+        :param max_size: The maximum number of statements to keep prepared.
+        :param stats: The counter to record hits, misses and evictions in. This can be shared
+            between connections.
+        """
+        self.max_size = max_size
+
+        #: The number of hits, misses and evictions.
+        self.stats = stats if stats is not None else collections.Counter()
+
+        self._statements = collections.OrderedDict()  # type: Dict[str, PreparedStatement]
+        self._names = 0
+
+    def __len__(self) -> int:
+        return len(self._statements)
+
+    def get(self, query: str) -> Optional[PreparedStatement]:
+        statement = self._statements.get(query)
+        if statement is None:
+            self.stats["misses"] += 1
+            return None
+
+        self._statements.move_to_end(query)
+        self.stats["hits"] += 1
+        return statement
+
+    def new_name(self) -> str:
+        self._names += 1
+        return f"joku_{self._names}"
+
+    def put(self, query: str, statement: PreparedStatement) -> List[str]:
+        """
+        Adds a statement.
+
+        :return: The names of the statements evicted to make room, which should be closed.
+        """
+        self._statements[query] = statement
+        evicted = []
+        while len(self._statements) > self.max_size:
+            _, old = self._statements.popitem(last=False)
+            evicted.append(old.name)
+
+        self.stats["evictions"] += len(evicted)
+        return evicted
+
+    def discard(self, query: str) -> Optional[PreparedStatement]:
+        return self._statements.pop(query, None)
+
+
+@dataclass
+class QueryResult:
+    #: The names of the columns.
+    columns: List[str]
+
+    #: The rows, as tuples of decoded values.
+    rows: List[tuple]
+
+    #: The command tag, e.g. ``INSERT 0 1``.
+    status: str
+
+
+class PostgresConnection(object):
+    """
+    A single connection to a PostgreSQL server.
+
+    A connection runs one query at a time. If a query is interrupted (e.g. cancelled or timed out)
+    the protocol state is unknown, so the connection is marked as broken and must be closed.
+    """
+
+    def __init__(self, sock: 'curio.io.Socket', statements: StatementCache):
+        self._sock = sock
+        self._stream = sock.as_stream()
+
+        #: The prepared statements on this connection.
+        self.statements = statements
+
+        # Close messages for evicted statements, sent with the next query
+        self._pending_closes = []  # type: List[bytes]
+
+        #: The run-time parameters reported by the server.
+        self.parameters = {}  # type: Dict[str, str]
+
+        #: The transaction status from the last ReadyForQuery; ``I``, ``T`` or ``E``.
+        self.transaction_status = b"I"
+
+        #: If this connection was interrupted mid-query.
+        self.broken = False
+
+        #: If this connection has been closed.
+        self.closed = False
+
+        self.process_id = None  # type: int
+        self.secret_key = None  # type: int
+
+    @classmethod
+    async def connect(cls, host: str = "127.0.0.1", port: int = 5432, user: str = "postgres",
+                      password: str = None, database: str = None, *,
+                      timeout: float = 10, statement_cache_size: int = 100,
+                      statement_stats: collections.Counter = None) -> 'PostgresConnection':
+        """
+        Connects and authenticates to a server.
+
+        :param host: The host to connect to. A path connects to a unix socket in that directory.
+        :param port: The port to connect to.
+        :param user: The user to log in as.
+        :param password: The password of the user, if the server asks for one.
+        :param database: The database to use. Defaults to the user name.
+        :param timeout: The number of seconds to wait for the connection to be ready.
+        :param statement_cache_size: The number of prepared statements to keep. 0 disables
+            preparing statements.
+        :param statement_stats: A counter to record statement cache statistics in.
+        """
+        async with curio.timeout_after(timeout):
+            if host.startswith("/"):
+                sock = await curio.open_unix_connection(os.path.join(host, f".s.PGSQL.{port}"))
+            else:
+                sock = await curio.open_connection(host, port)
+
+            connection = cls(sock, StatementCache(statement_cache_size, statement_stats))
+            try:
+                await connection._startup(user, password, database or user)
+            except BaseException:
+                await connection.close()
+                raise
+
+        return connection
+
+    async def _send(self, data: bytes):
+        await self._stream.write(data)
+
+    async def _read_message(self) -> Tuple[bytes, bytes]:
+        kind, length = _HEADER.unpack(await self._stream.read_exactly(5))
+        return kind, await self._stream.read_exactly(length - 4)
+
+    def _handle_async(self, kind: bytes, body: bytes):
+        if kind == b"S":
+            name, value = body.split(b"\x00")[:2]
+            self.parameters[name.decode()] = value.decode()
+        elif kind not in (b"N", b"A"):
+            # notices and notifications are ignored, anything else is a protocol error
+            self.broken = True
+            raise InterfaceError(f"Unexpected message {kind!r}")
+
+    async def _send_password(self, password: Optional[str], data: bytes):
+        if password is None:
+            raise InterfaceError("The server requires a password")
+
+        await self._send(_message(b"p", data))
+
+    async def _startup(self, user: str, password: Optional[str], database: str):
+        parameters = {
+            "user": user,
+            "database": database,
+            "application_name": "jokusoramame",
+            "client_encoding": "UTF8",
+            "DateStyle": "ISO",
+            "TimeZone": "UTC",
+            "bytea_output": "hex",
+        }
+        body = _INT32.pack(PROTOCOL_VERSION) \
+            + b"".join(_cstr(key) + _cstr(value) for (key, value) in parameters.items()) + b"\x00"
+        await self._send(_INT32.pack(len(body) + 4) + body)
+
+        scram = None
+        while True:
+            kind, body = await self._read_message()
+            if kind == b"R":
+                code = _INT32.unpack_from(body)[0]
+                if code == 0:
+                    continue
+                elif code == 3:
+                    await self._send_password(password, _cstr(password or ""))
+                elif code == 5:
+                    inner = hashlib.md5(f"{password}{user}".encode()).hexdigest().encode()
+                    digest = "md5" + hashlib.md5(inner + body[4:8]).hexdigest()
+                    await self._send_password(password, _cstr(digest))
+                elif code == 10:
+                    mechanisms = body[4:].split(b"\x00")
+                    if b"SCRAM-SHA-256" not in mechanisms:
+                        raise InterfaceError(f"Unsupported SASL mechanisms {mechanisms}")
+
+                    scram = ScramSHA256(password or "")
+                    first = scram.client_first()
+                    await self._send_password(password, _cstr("SCRAM-SHA-256")
+                                              + _INT32.pack(len(first)) + first)
+                elif code == 11:
+                    await self._send(_message(b"p", scram.client_final(body[4:])))
+                elif code == 12:
+                    scram.verify(body[4:])
+                else:
+                    raise InterfaceError(f"Unsupported authentication method {code}")
+            elif kind == b"K":
+                self.process_id, self.secret_key = struct.unpack("!ii", body)
+            elif kind == b"E":
+                raise PostgresError(_parse_fields(body))
+            elif kind == b"Z":
+                self.transaction_status = body[:1]
+                return
+            else:
+                self._handle_async(kind, body)
+
+    @staticmethod
+    def _parse_row_description(body: bytes) -> Description:
+        count = _INT16.unpack_from(body)[0]
+        columns = []
+        offset = 2
+        for _ in range(count):
+            end = body.index(b"\x00", offset)
+            name = body[offset:end].decode()
+            # skip the table OID and attribute number to get to the type OID
+            type_oid = _INT32.unpack_from(body, end + 7)[0]
+            columns.append((name, DECODERS.get(type_oid)))
+            offset = end + 19
+
+        return columns
+
+    @staticmethod
+    def _parse_data_row(body: bytes, decoders: List[Callable[[str], Any]]) -> tuple:
+        values = []
+        offset = 2
+        for decoder in decoders:
+            length = _INT32.unpack_from(body, offset)[0]
+            offset += 4
+            if length == -1:
+                values.append(None)
+                continue
+
+            value = body[offset:offset + length].decode("utf-8")
+            offset += length
+            values.append(decoder(value) if decoder is not None else value)
+
+        return tuple(values)
+
+    async def _read_result(self, description: Description = None) \
+            -> Tuple[QueryResult, Description]:
+        description = description or []
+        columns = [name for (name, _) in description]
+        decoders = [decoder for (_, decoder) in description]
+        rows = []
+        status = ""
+        error = None
+
+        while True:
+            kind, body = await self._read_message()
+            if kind == b"D":
+                if error is not None:
+                    continue
+
+                try:
+                    rows.append(self._parse_data_row(body, decoders))
+                except (ValueError, ArithmeticError) as e:
+                    error = DecodeError(f"Could not decode a value: {e}")
+            elif kind == b"T":
+                description = self._parse_row_description(body)
+                columns = [name for (name, _) in description]
+                decoders = [decoder for (_, decoder) in description]
+            elif kind == b"C":
+                status = body[:-1].decode()
+            elif kind == b"E":
+                # the server skips to the Sync after an error, so keep reading until then
+                error = PostgresError(_parse_fields(body))
+            elif kind == b"Z":
+                self.transaction_status = body[:1]
+                break
+            elif kind in (b"1", b"2", b"3", b"t", b"n", b"I", b"s"):
+                # ParseComplete, BindComplete, CloseComplete, ParameterDescription, NoData,
+                # EmptyQueryResponse, PortalSuspended
+                continue
+            else:
+                self._handle_async(kind, body)
+
+        if error is not None:
+            raise error
+
+        return QueryResult(columns, rows, status), description
+
+    async def _roundtrip(self, data: bytes, description: Description = None) \
+            -> Tuple[QueryResult, Description]:
+        if self.broken or self.closed:
+            raise InterfaceError("The connection is not usable")
+
+        # piggyback any pending closes on this query
+        if self._pending_closes:
+            data = b"".join(self._pending_closes) + data
+            self._pending_closes = []
+
+        try:
+            await self._send(data)
+            return await self._read_result(description)
+        except PostgresError:
+            # the server has already recovered by the time this is raised
+            raise
+        except BaseException:
+            self.broken = True
+            raise
+
+    @staticmethod
+    def _bind(statement: str, args: Sequence[Any]) -> bytes:
+        params = []
+        for arg in args:
+            encoded = encode_param(arg)
+            params.append(_NULL if encoded is None else _INT32.pack(len(encoded)) + encoded)
+
+        # an unnamed portal, text format parameters and results
+        return _message(b"B", b"\x00", _cstr(statement), _INT16.pack(0),
+                        _INT16.pack(len(params)), *params, _INT16.pack(0))
+
+    async def _execute_unnamed(self, query: str, args: Sequence[Any]) -> QueryResult:
+        data = b"".join((
+            _message(b"P", b"\x00", _cstr(query), _INT16.pack(0)),
+            self._bind("", args),
+            _message(b"D", b"P\x00"),
+            _message(b"E", b"\x00", _INT32.pack(0)),
+            SYNC,
+        ))
+        result, _ = await self._roundtrip(data)
+        return result
+
+    async def _prepare_and_execute(self, query: str, args: Sequence[Any]) -> QueryResult:
+        name = self.statements.new_name()
+        data = b"".join((
+            _message(b"P", _cstr(name), _cstr(query), _INT16.pack(0)),
+            _message(b"D", b"S", _cstr(name)),
+            self._bind(name, args),
+            _message(b"E", b"\x00", _INT32.pack(0)),
+            SYNC,
+        ))
+        try:
+            result, description = await self._roundtrip(data)
+        except PostgresError:
+            # the statement may have been parsed before the error, and closing a statement that
+            # doesn't exist isn't an error
+            self._pending_closes.append(_message(b"C", b"S", _cstr(name)))
+            raise
+
+        for evicted in self.statements.put(query, PreparedStatement(name, description)):
+            self._pending_closes.append(_message(b"C", b"S", _cstr(evicted)))
+
+        return result
+
+    async def _execute_prepared(self, statement: PreparedStatement,
+                                args: Sequence[Any]) -> QueryResult:
+        # no Parse or Describe; the server reuses the statement, and its plan
+        data = b"".join((
+            self._bind(statement.name, args),
+            _message(b"E", b"\x00", _INT32.pack(0)),
+            SYNC,
+        ))
+        result, _ = await self._roundtrip(data, statement.description)
+        return result
+
+    async def execute(self, query: str, args: Sequence[Any] = ()) -> QueryResult:
+        """
+        Runs a query with the extended query protocol.
+
+        The query is prepared the first time it is run on this connection, and later runs only
+        bind and execute the prepared statement.
+
+        :param query: The query, with ``$n`` placeholders.
+        :param args: The parameters of the query.
+        """
+        if self.statements.max_size <= 0:
+            return await self._execute_unnamed(query, args)
+
+        statement = self.statements.get(query)
+        if statement is None:
+            return await self._prepare_and_execute(query, args)
+
+        try:
+            return await self._execute_prepared(statement, args)
+        except PostgresError as e:
+            # feature_not_supported ("cached plan must not change result type") or
+            # invalid_sql_statement_name; the statement is stale, so prepare it again next time
+            if e.sqlstate in ("0A000", "26000"):
+                self.statements.discard(query)
+                self._pending_closes.append(_message(b"C", b"S", _cstr(statement.name)))
+
+            raise
+
+    async def simple_query(self, query: str) -> QueryResult:
+        """
+        Runs a query with the simple query protocol. This is used for transaction control.
+        """
+        result, _ = await self._roundtrip(_message(b"Q", _cstr(query)))
+        return result
+
+    async def close(self):
+        """
+        Closes this connection.
+        """
+        if self.closed:
+            return
+
+        self.closed = True
+        try:
+            if not self.broken:
+                await self._send(TERMINATE)
+        except OSError:
+            pass
+        finally:
+            await self._sock.close()
+
+
+class ConnectionPool(object):
+    """
+    A pool of :class:`.PostgresConnection`.
+
+    Idle connections are reused most recently released first, so that a quiet bot keeps a few
+    warm connections instead of cycling through all of them.
+    """
+
+    def __init__(self, connect: Callable[[], Awaitable[PostgresConnection]], *,
+                 max_size: int = 50):
+        """
+        :param connect: A coroutine function that opens a new connection.
+        :param max_size: The maximum number of connections.
+        """
+        self._connect = connect
+        self.max_size = max_size
+
+        self._idle = []  # type: List[PostgresConnection]
+        self._slots = curio.Semaphore(max_size)
+        self._closed = False
+
+        #: The number of connections opened by this pool.
+        self.connections_made = 0
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    async def acquire(self) -> PostgresConnection:
+        """
+        Acquires a connection, opening one if there are no idle connections.
+        """
+        if self._closed:
+            raise InterfaceError("The pool is closed")
+
+        await self._slots.acquire()
+        try:
+            while self._idle:
+                connection = self._idle.pop()
+                if not connection.closed:
+                    return connection
+
+            connection = await self._connect()
+            self.connections_made += 1
+            return connection
+        except BaseException:
+            await self._slots.release()
+            raise
+
+    async def release(self, connection: PostgresConnection):
+        """
+        Releases a connection back to the pool.
+
+        Connections that are broken, or were left inside a transaction, are closed instead.
+        """
+        try:
+            if self._closed or connection.broken or connection.transaction_status != b"I":
+                await connection.close()
+            else:
+                self._idle.append(connection)
+        finally:
+            await self._slots.release()
+
+    async def close(self):
+        """
+        Closes this pool, and every idle connection in it.
+        """
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            await connection.close()
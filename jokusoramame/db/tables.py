@@ -96,3 +96,17 @@ class UserBalance(Table, table_name="user_balance"):
 
     #: The amount of money this user has.
     money = Column(Integer(), unique=False, nullable=False, default=0)
+
+
+class GeocodeCacheEntry(Table, table_name="geocode_cache"):
+    """
+    Represents a cached geocoding result.
+    """
+    #: The normalized query text, or the rounded lat/long of a reverse lookup.
+    query = Column(Text(), primary_key=True)
+
+    #: The JSON-encoded result.
+    result = Column(Text(), nullable=False)
+
+    #: When this result was cached, as a UNIX timestamp.
+    cached_at = Column(BigInt(), nullable=False)
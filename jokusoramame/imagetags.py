@@ -0,0 +1,246 @@
+"""
+Image tagging, with caching of the results.
+"""
+import hashlib
+import statistics
+from io import BytesIO
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import curio
+from PIL import Image
+from lru import LRU
+
+from jokusoramame.sessions import SessionPool
+
+
+def dhash(data: bytes, size: int = 8, min_stddev: float = 8.0) -> Optional[int]:
+    """
+    Gets the difference hash of an image.
+
+    The image is shrunk to (size + 1, size) greyscale pixels, and each bit of the hash is set if a
+    pixel is brighter than its right neighbour. Re-encoded or resized copies of an image will have
+    the same, or a very close, hash.
+
+    Nearly flat images, such as blank ones, have no hash, as the bits of their hash only depend on
+    noise and would match any other flat image.
+
+    :param data: The encoded image.
+    :param size: The width and height of the hash grid.
+    :param min_stddev: The minimum standard deviation of the shrunk pixels to hash an image.
+    :return: The hash, or None if the data is not a readable image or is too flat.
+    """
+    try:
+        image = Image.open(BytesIO(data))
+        image = image.convert("L").resize((size + 1, size), Image.LANCZOS)
+    except (IOError, ValueError):
+        return None
+
+    pixels = list(image.getdata())
+    if statistics.pstdev(pixels) < min_stddev:
+        return None
+
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+
+    return value
+
+
+def fingerprint_image(data: bytes) -> Tuple[str, Optional[int]]:
+    """
+    Gets the content digest and perceptual hash of an image.
+    """
+    return hashlib.sha256(data).hexdigest(), dhash(data)
+
+
+class ImageTagCache(object):
+    """
+    A cache of image tagging results.
+
+    Results are looked up by URL first, then by the exact content digest, and finally by a
+    perceptual hash within a small hamming distance, so that re-uploads of the same image are
+    tagged only once.
+    """
+
+    def __init__(self, max_items: int = 1024, max_distance: int = 4):
+        """
+        :param max_items: The maximum number of results to keep for each kind of key.
+        :param max_distance: The maximum hamming distance for two perceptual hashes to match.
+        """
+        self.max_distance = max_distance
+
+        self.by_url = LRU(max_items)
+        self.by_digest = LRU(max_items)
+        self.by_phash = LRU(max_items)
+
+        #: The number of lookups that were hits.
+        self.hits = 0
+
+        #: The number of lookups that were misses.
+        self.misses = 0
+
+    def get_url(self, url: str) -> Optional[dict]:
+        """
+        Gets a cached result by the URL of an image.
+        """
+        result = self.by_url.get(url)
+        if result is not None:
+            self.hits += 1
+
+        return result
+
+    def get_content(self, digest: str, phash: Optional[int]) -> Optional[dict]:
+        """
+        Gets a cached result by the content of an image.
+
+        :param digest: The content digest of the image.
+        :param phash: The perceptual hash of the image.
+        """
+        result = self.by_digest.get(digest)
+        if result is None and phash is not None:
+            result = self.by_phash.get(phash)
+            if result is None:
+                # near-duplicates, such as re-compressed re-uploads
+                for other, other_result in self.by_phash.items():
+                    if bin(phash ^ other).count("1") <= self.max_distance:
+                        result = other_result
+                        break
+
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return result
+
+    def put(self, result: dict, *, url: str = None, digest: str = None,
+            phash: Optional[int] = None):
+        """
+        Caches a result under all of the keys provided.
+        """
+        if url is not None:
+            self.by_url[url] = result
+
+        if digest is not None:
+            self.by_digest[digest] = result
+
+        if phash is not None:
+            self.by_phash[phash] = result
+
+
+class ImageDownloadError(Exception):
+    """
+    Raised when an image can't be downloaded for tagging.
+    """
+
+    def __init__(self, url: str, reason: str):
+        super().__init__(f"{url}: {reason}")
+
+        #: The URL of the image.
+        self.url = url
+
+        #: Why the image could not be downloaded.
+        self.reason = reason
+
+
+class ImageTagger(object):
+    """
+    Tags images with an external model, in one batched request for every image that isn't
+    already cached.
+
+    Images are downloaded concurrently, and only successful responses up to a maximum size are
+    used, so that error pages are never fingerprinted or sent to the model.
+    """
+
+    def __init__(self, sessions: SessionPool,
+                 predict: Callable[[List[bytes]], Awaitable[List[dict]]],
+                 cache: ImageTagCache = None, *, max_bytes: int = 10 * 1024 ** 2):
+        """
+        :param sessions: The :class:`.SessionPool` to download images with.
+        :param predict: A coroutine function that tags a list of encoded images, returning the
+            output for each image in the same order.
+        :param cache: The :class:`.ImageTagCache` to use.
+        :param max_bytes: The maximum size of an image to download.
+        """
+        self.sessions = sessions
+        self.predict = predict
+        self.cache = cache or ImageTagCache()
+        self.max_bytes = max_bytes
+
+    async def download(self, url: str) -> bytes:
+        """
+        Downloads an image.
+
+        :raises ImageDownloadError: If the response was not successful, or the image is too big.
+        """
+        response = await self.sessions.get(url, stream=True)
+        try:
+            if response.status_code != 200:
+                raise ImageDownloadError(url, f"got HTTP {response.status_code}")
+
+            length = response.headers.get("content-length")
+            if length is not None and int(length) > self.max_bytes:
+                raise ImageDownloadError(url, "the image is too big")
+
+            buf = bytearray()
+            async for chunk in response.body:
+                buf += chunk
+                if len(buf) > self.max_bytes:
+                    raise ImageDownloadError(url, "the image is too big")
+
+            return bytes(buf)
+        finally:
+            await response.body.close()
+
+    async def _fingerprint(self, url: str) -> Tuple[bytes, str, Optional[int]]:
+        data = await self.download(url)
+        digest, phash = await curio.run_in_thread(fingerprint_image, data)
+        return data, digest, phash
+
+    async def tag(self, urls: List[str]) -> List[dict]:
+        """
+        Tags some images, using cached results where possible.
+
+        :param urls: The URLs of the images to tag.
+        :return: The output for each image, in the same order.
+        :raises ImageDownloadError: If any of the images could not be downloaded.
+        """
+        outputs = [self.cache.get_url(url) for url in urls]
+        missing = [i for i, output in enumerate(outputs) if output is None]
+
+        fingerprints, errors = {}, []
+
+        async def fingerprint(index: int):
+            try:
+                fingerprints[index] = await self._fingerprint(urls[index])
+            except Exception as e:
+                errors.append(e)
+
+        async with curio.TaskGroup() as group:
+            for i in missing:
+                await group.spawn(fingerprint, i)
+
+        if errors:
+            raise errors[0]
+
+        pending = []
+        for i in missing:
+            data, digest, phash = fingerprints[i]
+            output = self.cache.get_content(digest, phash)
+            if output is not None:
+                self.cache.put(output, url=urls[i])
+                outputs[i] = output
+                continue
+
+            pending.append((i, digest, phash, data))
+
+        if pending:
+            predicted = await self.predict([p[3] for p in pending])
+            for (i, digest, phash, _), output in zip(pending, predicted):
+                self.cache.put(output, url=urls[i], digest=digest, phash=phash)
+                outputs[i] = output
+
+        return outputs
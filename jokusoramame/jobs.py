@@ -0,0 +1,343 @@
+"""
+Background jobs for long-running work.
+"""
+import json
+import time
+import traceback
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import curio
+import logbook
+from curio.thread import async_thread
+from curious import Channel, Embed, Guild, Member
+from curious.exc import CuriousError
+from dataclasses import dataclass
+
+from jokusoramame.redis import RedisInterface
+
+logger = logbook.Logger("Jokusoramame.jobs")
+
+
+@dataclass
+class JobResult:
+    #: The text content of the result.
+    content: str = None
+
+    #: An embed to post with the result. This is not stored.
+    embed: Embed = None
+
+    #: A file to upload with the result.
+    file: bytes = None
+
+    #: The filename of the file.
+    filename: str = None
+
+    #: If the result should be sent to the author privately.
+    dm: bool = False
+
+
+class Job(object):
+    """
+    Represents a queued background job.
+    """
+
+    def __init__(self, manager: 'JobManager', job_id: str, data: dict):
+        self.manager = manager
+
+        #: The ID of this job.
+        self.id = job_id
+
+        #: The name of the job handler.
+        self.name = data["name"]
+
+        #: The guild, channel and author IDs for this job.
+        self.guild_id = int(data["guild_id"])
+        self.channel_id = int(data["channel_id"])
+        self.author_id = int(data["author_id"])
+
+        #: The arguments for this job.
+        self.args = json.loads(data.get("args", "{}"))
+
+        #: The state of this job.
+        self.state = data.get("state", "queued")
+
+        #: The progress of this job, as a string.
+        self.progress = data.get("progress", "")
+
+        #: When this job was created.
+        self.created = float(data.get("created", 0))
+
+        self._last_progress = 0.0
+
+    @property
+    def guild(self) -> Optional[Guild]:
+        return self.manager.client.guilds.get(self.guild_id)
+
+    @property
+    def channel(self) -> Optional[Channel]:
+        guild = self.guild
+        return guild.channels.get(self.channel_id) if guild is not None else None
+
+    @property
+    def author(self) -> Optional[Member]:
+        guild = self.guild
+        return guild.members.get(self.author_id) if guild is not None else None
+
+    async def report_progress(self, done: int, total: int):
+        """
+        Reports the progress of this job. Updates are throttled to one a second.
+        """
+        now = time.monotonic()
+        if now - self._last_progress < 1 and done != total:
+            return
+
+        self._last_progress = now
+        self.progress = f"{done}/{total}"
+        await self.manager.set_fields(self.id, progress=self.progress)
+
+
+JobHandler = Callable[[Job], Awaitable[JobResult]]
+
+
+class JobManager(object):
+    """
+    Runs background jobs from a persistent queue in Redis.
+
+    Jobs are run by a pool of worker tasks inside the bot, so they are not tied to the command
+    invocation that queued them. Jobs that were running when the bot stopped are requeued when the
+    workers start.
+    """
+    QUEUE_KEY = "jobs_queue"
+    RUNNING_KEY = "jobs_running"
+
+    def __init__(self, client, redis: RedisInterface, *, workers: int = 2,
+                 result_ttl: int = 86_400, poll_interval: float = 1.0):
+        """
+        :param client: The bot instance.
+        :param redis: The :class:`.RedisInterface` to store jobs in.
+        :param workers: The number of jobs that can run at once.
+        :param result_ttl: The number of seconds to keep jobs and their results for.
+        :param poll_interval: The number of seconds between polls of an empty queue.
+        """
+        self.client = client
+        self.redis = redis.redis
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+
+        self.handlers = {}  # type: Dict[str, JobHandler]
+        self._tasks = []  # type: List[curio.Task]
+
+    def register(self, name: str, handler: JobHandler):
+        """
+        Registers a job handler. Handlers are only called while the guild of the job is available,
+        so :attr:`.Job.guild` is never None inside one.
+
+        :param name: The name of the job.
+        :param handler: A coroutine function that takes a :class:`.Job` and returns a
+            :class:`.JobResult`.
+        """
+        self.handlers[name] = handler
+
+    @async_thread
+    def _enqueue(self, job_id: str, data: dict):
+        pipeline = self.redis.pipeline()
+        with pipeline:
+            pipeline.hmset(f"job_{job_id}", data)
+            pipeline.expire(f"job_{job_id}", self.result_ttl)
+            pipeline.lpush(f"jobs_guild_{data['guild_id']}", job_id)
+            pipeline.ltrim(f"jobs_guild_{data['guild_id']}", 0, 19)
+            pipeline.lpush(self.QUEUE_KEY, job_id)
+            pipeline.execute()
+
+    async def enqueue(self, name: str, channel: Channel, author: Member, **args) -> str:
+        """
+        Queues a job.
+
+        :param name: The name of the job handler.
+        :param channel: The channel to post the result in.
+        :param author: The member that requested the job.
+        :param args: JSON-serializable arguments for the job.
+        :return: The ID of the job.
+        """
+        if name not in self.handlers:
+            raise KeyError(f"Unknown job {name}")
+
+        job_id = uuid.uuid4().hex[:8]
+        data = {
+            "name": name,
+            "guild_id": channel.guild_id,
+            "channel_id": channel.id,
+            "author_id": author.id,
+            "args": json.dumps(args),
+            "state": "queued",
+            "progress": "",
+            "created": time.time(),
+        }
+        await self._enqueue(job_id, data)
+        return job_id
+
+    @async_thread
+    def set_fields(self, job_id: str, **fields):
+        """
+        Updates the stored fields of a job.
+        """
+        self.redis.hmset(f"job_{job_id}", fields)
+
+    @async_thread
+    def get_job(self, job_id: str) -> Optional[Job]:
+        """
+        Gets a job by ID.
+        """
+        data = self.redis.hgetall(f"job_{job_id}")
+        if not data:
+            return None
+
+        data = {k.decode(): v.decode() for (k, v) in data.items()}
+        return Job(self, job_id, data)
+
+    @async_thread
+    def get_guild_job_ids(self, guild: Guild) -> List[str]:
+        """
+        Gets the IDs of the most recent jobs in a guild.
+        """
+        return [i.decode() for i in self.redis.lrange(f"jobs_guild_{guild.id}", 0, 19)]
+
+    @async_thread
+    def get_result(self, job_id: str) -> Optional[JobResult]:
+        """
+        Gets the stored result of a finished job.
+        """
+        data = self.redis.hgetall(f"job_result_{job_id}")
+        if not data:
+            return None
+
+        content = data.get(b"content")
+        filename = data.get(b"filename")
+        return JobResult(content=content.decode() if content else None,
+                         file=data.get(b"file"),
+                         filename=filename.decode() if filename else None,
+                         dm=data.get(b"dm") == b"1")
+
+    @async_thread
+    def _store_result(self, job_id: str, result: JobResult):
+        fields = {"dm": "1" if result.dm else "0"}
+        if result.content is not None:
+            fields["content"] = result.content
+        if result.file is not None:
+            fields["file"] = result.file
+            fields["filename"] = result.filename
+
+        key = f"job_result_{job_id}"
+        pipeline = self.redis.pipeline()
+        with pipeline:
+            pipeline.hmset(key, fields)
+            pipeline.expire(key, self.result_ttl)
+            pipeline.hset(f"job_{job_id}", "state", "done")
+            pipeline.execute()
+
+    @async_thread
+    def _pop(self) -> Optional[str]:
+        job_id = self.redis.rpoplpush(self.QUEUE_KEY, self.RUNNING_KEY)
+        return job_id.decode() if job_id is not None else None
+
+    @async_thread
+    def _finish(self, job_id: str):
+        self.redis.lrem(self.RUNNING_KEY, 0, job_id)
+
+    @async_thread
+    def _requeue_running(self) -> int:
+        count = 0
+        while self.redis.rpoplpush(self.RUNNING_KEY, self.QUEUE_KEY) is not None:
+            count += 1
+
+        return count
+
+    async def post_result(self, job: Job, result: JobResult):
+        """
+        Posts the result of a job.
+        """
+        channel = job.channel
+        if result.dm:
+            author = job.author
+            if author is None:
+                return
+
+            channel = await author.user.open_private_channel()
+
+        if channel is None:
+            return
+
+        if result.content is not None or result.embed is not None:
+            await channel.messages.send(result.content, embed=result.embed)
+
+        if result.file is not None:
+            await channel.messages.upload(fp=result.file, filename=result.filename)
+
+    async def _run_job(self, job_id: str):
+        job = await self.get_job(job_id)
+        if job is None:
+            # expired
+            return
+
+        handler = self.handlers.get(job.name)
+        if handler is None:
+            logger.warning(f"No handler for job {job.name}, dropping it")
+            await self.set_fields(job_id, state="failed", progress="no handler")
+            return
+
+        if job.guild is None:
+            # the bot left the guild, or it is unavailable; there is nothing to run against
+            logger.warning(f"Guild {job.guild_id} of job {job_id} is unavailable, dropping it")
+            await self.set_fields(job_id, state="failed", progress="guild unavailable")
+            return
+
+        await self.set_fields(job_id, state="running")
+        try:
+            result = await handler(job)
+        except Exception as e:
+            traceback.print_exception(None, e, e.__traceback__)
+            await self.set_fields(job_id, state="failed", progress=repr(e))
+            channel = job.channel
+            if channel is not None:
+                await channel.messages.send(f":x: Job `{job_id}` ({job.name}) failed.")
+            return
+
+        await self._store_result(job_id, result)
+        await self.post_result(job, result)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._pop()
+            if job_id is None:
+                await curio.sleep(self.poll_interval)
+                continue
+
+            try:
+                await self._run_job(job_id)
+            except CuriousError:
+                logger.exception(f"Failed to post the result of job {job_id}")
+            except Exception:
+                # anything else would kill this worker, and the pool with it over time
+                logger.exception(f"Failed to run job {job_id}")
+                try:
+                    await self.set_fields(job_id, state="failed")
+                except Exception:
+                    logger.exception(f"Failed to mark job {job_id} as failed")
+            finally:
+                await self._finish(job_id)
+
+    async def start(self):
+        """
+        Requeues any interrupted jobs, and starts the workers.
+        """
+        if self._tasks:
+            return
+
+        requeued = await self._requeue_running()
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted job(s).")
+
+        for _ in range(self.workers):
+            self._tasks.append(await curio.spawn(self._worker, daemon=True))
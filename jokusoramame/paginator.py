@@ -0,0 +1,130 @@
+"""
+Lazily rendered reaction paginators.
+"""
+import inspect
+import math
+from typing import Any, Awaitable, Callable, Sequence, Union
+
+from curious import Channel, Embed, Member, User
+from curious.ext.paginator import ReactionsPaginator
+from lru import LRU
+
+#: A page; either an embed, or text to put in one.
+Page = Union[str, Embed]
+
+
+class PageSource(object):
+    """
+    Produces the pages of a :class:`.LazyPaginator` on demand.
+    """
+
+    def __len__(self) -> int:
+        """
+        :return: The number of pages.
+        """
+        raise NotImplementedError
+
+    async def render(self, page: int) -> Page:
+        """
+        Renders a page.
+
+        :param page: The index of the page, from 0.
+        """
+        raise NotImplementedError
+
+
+class ListPageSource(PageSource):
+    """
+    Pages through a list of entries, rendering each page from its slice of the entries.
+    """
+
+    def __init__(self, entries: Sequence[Any],
+                 formatter: Callable[[Sequence[Any], int], Union[Page, Awaitable[Page]]], *,
+                 per_page: int = 1):
+        """
+        :param entries: The entries to page through.
+        :param formatter: A callable that takes the entries on a page and the index of the page,
+            and returns the page. This can be a coroutine function.
+        :param per_page: The number of entries on each page.
+        """
+        self.entries = entries
+        self.formatter = formatter
+        self.per_page = per_page
+
+    def __len__(self) -> int:
+        return math.ceil(len(self.entries) / self.per_page)
+
+    async def render(self, page: int) -> Page:
+        start = page * self.per_page
+        result = self.formatter(self.entries[start:start + self.per_page], page)
+        if inspect.isawaitable(result):
+            result = await result
+
+        return result
+
+
+class LazyPaginator(ReactionsPaginator):
+    """
+    A :class:`.ReactionsPaginator` that only renders a page when it is navigated to.
+
+    Rendered pages are kept in a small LRU, so flipping back and forth doesn't render them again.
+    """
+
+    def __init__(self, source: PageSource, channel: Channel, respond_to: Union[Member, User], *,
+                 title: str = None, cache_size: int = 8):
+        """
+        :param source: The :class:`.PageSource` to get pages from.
+        :param channel: The channel to send the pages to.
+        :param respond_to: The member to respond to.
+        :param title: The title to put above the embed.
+        :param cache_size: The number of rendered pages to keep.
+        """
+        super().__init__([], channel, respond_to, title=title)
+
+        #: The source of the pages.
+        self.source = source
+
+        #: The number of pages rendered so far.
+        self.renders = 0
+
+        # the base class only uses this to count the pages
+        self._message_chunks = range(len(source))
+        self._rendered = LRU(cache_size)
+
+    async def get_page(self, page: int) -> Embed:
+        """
+        Gets a page as an embed, rendering it if needed.
+        """
+        try:
+            return self._rendered[page]
+        except KeyError:
+            pass
+
+        chunk = await self.source.render(page)
+        if isinstance(chunk, Embed):
+            embed = chunk
+        else:
+            embed = Embed(description=chunk)
+            embed.set_footer(text=f"Page {page + 1}/{len(self.source)}")
+
+        self.renders += 1
+        self._rendered[page] = embed
+        return embed
+
+    async def send_current_page(self):
+        embed = await self.get_page(self.page)
+        if self._message is None:
+            self._message = await self.channel.messages.send(content=self.title, embed=embed)
+        else:
+            await self._message.edit(new_content=self.title, embed=embed)
+
+    async def paginate(self):
+        """
+        Starts paginating.
+
+        A single page is just sent, without any buttons.
+        """
+        if len(self.source) == 1:
+            return await self.send_current_page()
+
+        return await super().paginate()
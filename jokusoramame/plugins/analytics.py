@@ -3,30 +3,81 @@ Analytical work.
 """
 import entropy
 
-import asks
 import base64
 import curio
 import datetime
+import functools
+import json
 import matplotlib.pyplot as plt
 import numpy as np
 import random
 import seaborn as sns
 import string
 import tabulate
+import time
 from asks.response_objects import Response
-from clarifai.rest import ApiError, ClarifaiApp
-from curio.thread import AWAIT, async_thread
+from clarifai.rest import ApiError, ClarifaiApp, Image as ClImage
+from curio.thread import async_thread
 from curious import Embed, EventContext, Guild, Member, Message, event
 from curious.commands import Context, Plugin
 from curious.commands.decorators import command, ratelimit
 from curious.commands.ratelimit import BucketNamer
-from curious.ext.paginator import ReactionsPaginator
 from io import BytesIO
 from matplotlib.axes import Axes
-from typing import Awaitable, Dict, Tuple
+from typing import AsyncIterator, Awaitable, Dict, List, Optional, Tuple
 
 from jokusoramame import USER_AGENT
-from jokusoramame.utils import get_apikeys
+from jokusoramame.imagetags import ImageDownloadError, ImageTagger
+from jokusoramame.jobs import Job, JobResult
+from jokusoramame.paginator import LazyPaginator, ListPageSource
+from jokusoramame.sampling import SampleSizer, format_interval, mean_interval, \
+    reservoir_sample, total_interval
+from jokusoramame.sketch import KLLSketch
+from jokusoramame.snapshots import GuildSnapshot
+from jokusoramame.utils import display_time, get_apikeys, parse_flags, timesliced
+
+
+async def build_content_items(messages: AsyncIterator[dict], *, max_words: int,
+                              max_bytes: int) -> Tuple[bytes, int]:
+    """
+    Builds a JSON ``contentItems`` request body out of some messages.
+
+    Items are encoded one at a time, and building stops as soon as either budget would be exceeded,
+    so only as many messages as fit are read.
+
+    :param messages: An async iterator of stored messages, newest first.
+    :param max_words: The maximum number of words to include.
+    :param max_bytes: The maximum size of the encoded body.
+    :return: A tuple of (encoded body, number of items in the body).
+    """
+    buf = BytesIO()
+    buf.write(b'{"contentItems":[')
+    # the closing brackets
+    size = buf.tell() + 2
+    words = 0
+    count = 0
+
+    async for message in messages:
+        content = message["c"]
+        if not content:
+            continue
+
+        item = json.dumps({"content": content}).encode("utf-8")
+        item_words = len(content.split())
+        item_size = len(item) + (1 if count else 0)
+        if words + item_words > max_words or size + item_size > max_bytes:
+            break
+
+        if count:
+            buf.write(b",")
+        buf.write(item)
+
+        words += item_words
+        size += item_size
+        count += 1
+
+    buf.write(b"]}")
+    return buf.getvalue(), count
 
 
 class Analytics(Plugin):
@@ -36,6 +87,13 @@ class Analytics(Plugin):
         "neutral": "Neutral"
     }
 
+    #: The number of messages per member analysed in approximate mode.
+    approx_messages = 250
+
+    #: The member aggregates stored in snapshots.
+    snapshot_fields = ("message_count", "message_total", "total_entropy", "total_length",
+                       "average_entropy", "average_length", "capitals")
+
     def __init__(self, client):
         super().__init__(client)
 
@@ -64,10 +122,32 @@ class Analytics(Plugin):
         clarifai_keys = get_apikeys("clarifai")
         # hot-patch
         self.clarifai = ClarifaiApp(api_key=clarifai_keys.key)
+        self.image_tagger = ImageTagger(client.sessions, self.call_clarifai,
+                                        **client.config.get("imagetag", {}))
+
+        self.sample_sizer = SampleSizer(**client.config.get("approx", {}))
+
+        client.jobs.register("analyse_server", self.job_analyse_server)
+        client.jobs.register("server_distribution", self.job_server_distribution)
+        client.snapshots.register("members", self.build_snapshot)
+
+    @staticmethod
+    def message_metrics(content: str) -> Dict[str, float]:
+        """
+        Gets the sketched metrics of a message.
+        """
+        capitals = sum(char in string.ascii_uppercase for char in content)
+        return {
+            "entropy": entropy.shannon_entropy(content),
+            "length": len(content),
+            "capitals": (capitals / len(content)) * 100
+        }
 
     @event("message_create")
     async def add_to_analytics(self, ctx: EventContext, message: Message):
-        await ctx.bot.redis.add_message(message)
+        stored = await ctx.bot.redis.add_message(message)
+        if stored and message.content:
+            await ctx.bot.sketches.update(message.guild_id, self.message_metrics(message.content))
 
     async def make_commentanalyzer_request(self, model: str, message: str):
         """
@@ -89,7 +169,10 @@ class Analytics(Plugin):
             }
         }
         params = {"key": self.perspective.key}
-        response: Response = await asks.post(uri=url, json=body, params=params)
+        request = functools.partial(self.client.sessions.post, uri=url, json=body, params=params,
+                                    coalesce=True, upstream="perspective")
+        response: Response = await self.client.response_cache.fetch("perspective", model, message,
+                                                                    request)
 
         return response
 
@@ -138,7 +221,11 @@ class Analytics(Plugin):
         body = {"text": message, "mode": "tweet"}
 
         async with ctx.channel.typing:
-            response: Response = await asks.post(uri=url, data=body, headers=self.aylien_headers)
+            request = functools.partial(ctx.bot.sessions.post, uri=url, data=body,
+                                        headers=self.aylien_headers, coalesce=True,
+                                        upstream="aylien")
+            response: Response = await ctx.bot.response_cache.fetch("aylien.sentiment", "tweet",
+                                                                    message, request)
 
         if response.status_code != 200:
             return await ctx.channel.messages.send(f":x: API returned error: {response.text}")
@@ -174,8 +261,11 @@ class Analytics(Plugin):
         body = {"phrase": phrase}
 
         async with ctx.channel.typing:
-            response: Response = await asks.post(uri=url, data=body,
-                                                 headers=self.aylien_headers)
+            request = functools.partial(ctx.bot.sessions.post, uri=url, data=body,
+                                        headers=self.aylien_headers, coalesce=True,
+                                        upstream="aylien")
+            response: Response = await ctx.bot.response_cache.fetch("aylien.related", "related",
+                                                                    phrase, request)
 
         if response.status_code != 200:
             return await ctx.channel.messages.send(f":x: API returned error: {response.text}")
@@ -193,69 +283,58 @@ class Analytics(Plugin):
 
         await ctx.channel.messages.send(message)
 
-    async def make_personality_request(self, target: Member):
+    async def make_personality_request(self, target: Member) -> Optional[Response]:
         """
         Makes a personality analysis API request.
+
+        :return: The response, or None if there were no messages to analyse.
         """
         url = "https://gateway.watsonplatform.net/personality-insights/api/v3/profile"
-        messages = await self.client.redis.get_messages(target.user)
-        body = {
-            "contentItems": [{"content": message["c"]} for message in messages]
-        }
+        budget = self.client.config.get("personality", {})
+        messages = self.client.redis.iter_messages(target.user)
+        body, count = await build_content_items(messages,
+                                                max_words=budget.get("max_words", 6000),
+                                                max_bytes=budget.get("max_bytes", 256_000))
+        if count == 0:
+            return None
+
         # incredibly bad
         params = {
             "version": "2017-10-13"
         }
-        response: Response = await asks.post(uri=url, json=body,
-                                             params=params,
-                                             headers=self.watson_headers)
+        request = functools.partial(self.client.sessions.post, uri=url, data=body,
+                                    params=params, headers=self.watson_headers,
+                                    upstream="watson")
+        response: Response = await self.client.response_cache.fetch("watson.personality",
+                                                                    params["version"],
+                                                                    body.decode("utf-8"), request)
 
         return response
 
-    @staticmethod
-    def get_core_personality_embeds(target: Member, response_data: dict) \
-            -> Tuple[Embed, Embed, Embed]:
-        """
-        Gets the three core personality embeds.
-        """
-        sections = ["Personality", "Needs", "Values"]
-
-        def _format_trait(d: dict) -> str:
-            return format(d['percentile'] * 100, '.2f')
-
-        # make the personality one
-        p_embed = Embed()
-        personality = response_data.get("personality", [])
-        for core_trait in personality:
-            p_embed.add_field(name=core_trait['name'],
-                              value=_format_trait(core_trait))
-
-        n_embed = Embed()
-        needs = response_data.get("needs", [])
-        for need in needs:
-            n_embed.add_field(name=need['name'],
-                              value=_format_trait(need))
+    #: The sections of a personality analysis, as (response key, title).
+    personality_sections = (("personality", "Personality"), ("needs", "Needs"),
+                            ("values", "Values"))
 
-        v_embed = Embed()
-        values = response_data.get("values", [])
-        for value in values:
-            v_embed.add_field(name=value['name'],
-                              value=_format_trait(value))
-
-        embeds = (p_embed, n_embed, v_embed)
-        colour = random.randint(0, 0xffffff)
-        # tweak embeds
-        for i, embed in enumerate(embeds):
-            embed.description = f"Personality anaylsis for {target.user.mention}"
-            embed.set_thumbnail(url=str(target.user.avatar_url))
-            embed.colour = colour
-            embed.set_author(
-                name="Joku Analytics",
-                url="https://pbs.twimg.com/profile_images/938480103541141504/ieI9rd0G_400x400.jpg"
-            )
-            embed.title = f"Personality Analysis (section: {sections[i]})"
-
-        return embeds
+    @staticmethod
+    def get_personality_embed(target: Member, response_data: dict, section: str, title: str,
+                              colour: int) -> Embed:
+        """
+        Gets the embed for one section of a personality analysis.
+        """
+        embed = Embed()
+        for trait in response_data.get(section, []):
+            embed.add_field(name=trait['name'],
+                            value=format(trait['percentile'] * 100, '.2f'))
+
+        embed.description = f"Personality anaylsis for {target.user.mention}"
+        embed.set_thumbnail(url=str(target.user.avatar_url))
+        embed.colour = colour
+        embed.set_author(
+            name="Joku Analytics",
+            url="https://pbs.twimg.com/profile_images/938480103541141504/ieI9rd0G_400x400.jpg"
+        )
+        embed.title = f"Personality Analysis (section: {title})"
+        return embed
 
     @command()
     @ratelimit(limit=1, time=60, bucket_namer=BucketNamer.AUTHOR)
@@ -267,55 +346,85 @@ class Analytics(Plugin):
 
         async with ctx.channel.typing:
             request = await self.make_personality_request(target)
+            if request is None:
+                return await ctx.channel.messages.send(":x: There are no analytics available for "
+                                                       "this user.")
+
             if request.status_code != 200:
                 return await ctx.channel.messages.send(f":x: API returned error: "
                                                        f"`{request.json()}`")
 
-            embeds = list(self.get_core_personality_embeds(target, request.json()))
+            response_data = request.json()
+
+        colour = random.randint(0, 0xffffff)
+        sections = self.personality_sections
 
-        for i, embed in enumerate(embeds):
-            embed.set_footer(text=f"Page {i + 1}/{len(embeds)}")
+        def make_page(page_sections: List[Tuple[str, str]], i: int) -> Embed:
+            section, title = page_sections[0]
+            embed = self.get_personality_embed(target, response_data, section, title, colour)
+            embed.set_footer(text=f"Page {i + 1}/{len(sections)}")
             embed.timestamp = datetime.datetime.utcnow()
+            return embed
 
-        paginator = ReactionsPaginator(content=embeds, channel=ctx.channel,
-                                       respond_to=ctx.author)
+        paginator = LazyPaginator(ListPageSource(sections, make_page), channel=ctx.channel,
+                                  respond_to=ctx.author)
         await paginator.paginate()
 
+    def predict_images(self, images: List[bytes]) -> List[dict]:
+        """
+        Predicts the concepts of some images with Clarifai, in one batched request.
+
+        :return: The output for each image, in the same order.
+        """
+        model = self.clarifai.models.get("general-v1.3")
+        result = model.predict([ClImage(file_obj=BytesIO(image)) for image in images])
+        return result['outputs']
+
+    async def call_clarifai(self, images: List[bytes]) -> List[dict]:
+        """
+        Predicts the concepts of some images through the Clarifai circuit breaker.
+        """
+        breaker = self.client.breakers.get("clarifai")
+        return await breaker.call_in_thread(self.predict_images, images, ignore=(ApiError,))
+
     @command()
-    @async_thread()
-    def imagetag(self, ctx: Context, *, url: str = None):
+    async def imagetag(self, ctx: Context, *, url: str = None):
         """
-        Gets information about an image.
+        Gets information about an image, or all images attached to the message.
         """
         # return ":x: Temporarily disabled"
 
         if url is None:
-            try:
-                attachment = ctx.message.attachments[0]
-            except IndexError:
-                return AWAIT(ctx.channel.messages.send(":x: Could not find any file to tag."))
-            url = attachment.proxy_url
+            urls = [attachment.proxy_url for attachment in ctx.message.attachments]
+            if not urls:
+                return await ctx.channel.messages.send(":x: Could not find any file to tag.")
+        else:
+            urls = [url]
 
-        model = self.clarifai.models.get("general-v1.3")
         try:
-            result = model.predict_by_url(url)
+            async with ctx.channel.typing:
+                outputs = await self.image_tagger.tag(urls)
+        except ImageDownloadError as e:
+            return await ctx.channel.messages.send(f":x: Could not download <{e.url}>: "
+                                                   f"{e.reason}.")
         except ApiError as e:
-            return AWAIT(ctx.channel.messages.send(f":x: API error: {e.error_desc}"))
+            return await ctx.channel.messages.send(f":x: API error: {e.error_desc}")
 
-        data = result['outputs'][0]['data']
+        for url, output in zip(urls, outputs):
+            data = output['data']
 
-        em = Embed()
-        em.title = "Image Tag Results"
-        em.set_thumbnail(url=url)
-        em.description = "Top 10 concepts (name/probability):"
+            em = Embed()
+            em.title = "Image Tag Results"
+            em.set_thumbnail(url=url)
+            em.description = "Top 10 concepts (name/probability):"
 
-        for concept in data['concepts'][:10]:
-            em.add_field(name=concept['name'], value=f"{concept['value'] * 100:.2f}%")
+            for concept in data['concepts'][:10]:
+                em.add_field(name=concept['name'], value=f"{concept['value'] * 100:.2f}%")
 
-        em.set_footer(text=f"Using model {result['outputs'][0]['model']['name']}")
-        em.colour = random.randint(0x000000, 0xffffff)
-        em.timestamp = datetime.datetime.utcnow()
-        AWAIT(ctx.channel.messages.send(embed=em))
+            em.set_footer(text=f"Using model {output['model']['name']}")
+            em.colour = random.randint(0x000000, 0xffffff)
+            em.timestamp = datetime.datetime.utcnow()
+            await ctx.channel.messages.send(embed=em)
 
     @command()
     async def entropy(self, ctx: Context, *, message: str = None):
@@ -330,7 +439,7 @@ class Analytics(Plugin):
                 return await ctx.channel.send(":x: You must provide a message or attach a file.")
 
             async with ctx.channel.typing:
-                r: Response = await asks.get(f.url)
+                r: Response = await ctx.bot.sessions.get(f.url)
             message = r.content
         else:
             message = message.encode('utf-8', errors='ignore')
@@ -377,17 +486,26 @@ class Analytics(Plugin):
         enabled = await ctx.bot.redis.toggle_analytics(guild)
         await ctx.channel.messages.send(f":heavy_check_mark: Analytics status: {enabled}")
 
-    async def analyse_member(self, member: Member) -> dict:
+    async def analyse_member(self, member: Member, *, sample: int = None,
+                             seed: int = None) -> dict:
         """
         Analyses a member's messages, returning a dictionary of statistics.
+
+        :param sample: If provided, only a sample of this many messages is analysed. Totals are
+            scaled up to all of the messages, and the averages have confidence intervals.
+        :param seed: The seed for the sample.
         """
         messages = await self.client.redis.get_messages(member.user)
         if len(messages) == 0:
             return {}
 
+        message_total = len(messages)
+        if sample is not None and message_total > sample:
+            messages = reservoir_sample(messages, sample, seed)
+
         # do some processing
-        total_entropy = 0
-        total_length = 0
+        entropies = np.zeros(len(messages), dtype=np.float64)
+        lengths = np.zeros(len(messages), dtype=np.float64)
 
         # count capitals vs lowercase
         capitals = 0
@@ -395,31 +513,34 @@ class Analytics(Plugin):
         # track number of used messages
         used_messages = 0
 
-        for message in messages:
+        for i, message in enumerate(messages):
             content = message["c"]
             if not content:
                 continue
 
             used_messages += 1
 
-            total_entropy += entropy.shannon_entropy(content)
-            total_length += len(content)
+            entropies[i] = entropy.shannon_entropy(content)
+            lengths[i] = len(content)
             capitals += sum(char in string.ascii_uppercase for char in content)
 
-        # calculate averages
-        avg_entropy = total_entropy / len(messages)
-        avg_message_length = sum(len(m["c"]) for m in messages) / len(messages)
-
-        return {
-            "message_count": used_messages,
-            "message_total": len(messages),
-            "total_entropy": total_entropy,
-            "total_length": total_length,
-            "average_entropy": avg_entropy,
-            "average_length": avg_message_length,
-            "capitals": capitals
+        scale = message_total / len(messages)
+        processed = {
+            "message_count": int(round(used_messages * scale)),
+            "message_total": message_total,
+            "total_entropy": float(entropies.sum()) * scale,
+            "total_length": int(round(lengths.sum() * scale)),
+            "average_entropy": float(entropies.mean()),
+            "average_length": float(lengths.mean()),
+            "capitals": int(round(capitals * scale))
         }
 
+        if len(messages) < message_total:
+            processed["average_entropy_error"] = mean_interval(entropies, message_total)[1]
+            processed["average_length_error"] = mean_interval(lengths, message_total)[1]
+
+        return processed
+
     @analyse.subcommand(name="member")
     async def _analyse_member(self, ctx: Context, *, victim: Member = None):
         """
@@ -455,38 +576,93 @@ class Analytics(Plugin):
 
         await ctx.channel.messages.send(embed=em)
 
-    async def get_combined_member_data(self, guild: Guild) -> Dict[Member, dict]:
+    async def get_combined_member_data(self, guild: Guild, progress=None) \
+            -> Dict[Member, dict]:
         """
         Gets the combined member data for a guild.
+
+        :param progress: A coroutine function called with (done, total) as members are analysed.
         """
-        member_data = {member: await self.analyse_member(member)
-                       for member in guild.members.values() if not member.user.bot}
-        member_data = {member: data for (member, data) in member_data.items()
-                       if data}
+        # the member cache has no stable order, so sort it for the seed to mean anything
+        members = sorted((member for member in guild.members.values() if not member.user.bot),
+                         key=lambda member: member.id)
+        member_data = {}
+        async for i, member in timesliced(enumerate(members), name="analytics"):
+            data = await self.analyse_member(member)
+            if data:
+                member_data[member] = data
+
+            if progress is not None:
+                await progress(i + 1, len(members))
 
         return member_data
 
-    @analyse.subcommand(name="server")
-    async def _analyse_server(self, ctx: Context):
+    async def build_snapshot(self, guild: Guild) -> Dict[str, np.ndarray]:
         """
-        Analyses the current server.
+        Builds the member aggregates for a guild's snapshot.
         """
-        async with ctx.channel.typing:
-            member_data = await self.get_combined_member_data(ctx.guild)
+        member_data = await self.get_combined_member_data(guild)
+        arrays = {"ids": np.fromiter((member.id for member in member_data), dtype=np.int64,
+                                     count=len(member_data))}
+        for key in self.snapshot_fields:
+            arrays[key] = np.fromiter((data[key] for data in member_data.values()),
+                                      dtype=np.float64, count=len(member_data))
+
+        return arrays
+
+    def member_data_from_snapshot(self, guild: Guild, snapshot: GuildSnapshot) \
+            -> Optional[Dict[Member, dict]]:
+        """
+        Gets the combined member data for a guild from a snapshot.
+
+        Members that have left since the snapshot was built are skipped.
+
+        :return: The member data, or None if the snapshot has no member aggregates.
+        """
+        if "members.ids" not in snapshot:
+            return None
+
+        columns = [snapshot[f"members.{key}"] for key in self.snapshot_fields]
+        member_data = {}
+        for i, member_id in enumerate(snapshot["members.ids"].tolist()):
+            member = guild.members.get(member_id)
+            if member is None:
+                continue
+
+            member_data[member] = {key: column[i].item()
+                                   for (key, column) in zip(self.snapshot_fields, columns)}
 
+        return member_data
+
+    async def get_snapshot_member_data(self, guild: Guild) \
+            -> Tuple[Optional[Dict[Member, dict]], Optional[GuildSnapshot]]:
+        """
+        Gets the combined member data for a guild from its latest snapshot, if there is one.
+        """
+        snapshot = await self.client.snapshots.get(guild)
+        if snapshot is None:
+            return None, None
+
+        return self.member_data_from_snapshot(guild, snapshot), snapshot
+
+    @staticmethod
+    def make_server_embed(guild: Guild, member_data: Dict[Member, dict]) -> Embed:
+        """
+        Makes the embed for a server analysis.
+        """
         def sum_data(key: str) -> int:
             return sum(x[key] for x in member_data.values())
 
-        message_count = sum_data('message_count')
-        message_total = sum_data('message_total')
+        message_count = int(sum_data('message_count'))
+        message_total = int(sum_data('message_total'))
         average_entropy = sum_data('average_entropy') / len(member_data)
         average_length = sum_data('average_length') / len(member_data)
-        total_length = sum_data('total_length')
+        total_length = int(sum_data('total_length'))
         capitals = sum_data('capitals')
 
         em = Embed()
         em.title = "GHCQ Analysis Department"
-        em.description = f"Analysis for {ctx.guild.name} used {message_count} messages " \
+        em.description = f"Analysis for {guild.name} used {message_count} messages " \
                          f"({message_total - message_count} messages skipped) " \
                          f"from {len(member_data)} members"
         em.add_field(name="Avg. entropy",
@@ -496,10 +672,117 @@ class Analytics(Plugin):
         em.add_field(name="Total message length", value=f"{total_length} chars")
         em.add_field(name="% capital letters",
                      value=format((capitals / total_length) * 100, '.2f'))
-        em.set_thumbnail(url=ctx.guild.icon_url)
-        em.colour = ctx.guild.owner.colour
+        em.set_thumbnail(url=guild.icon_url)
+        em.colour = guild.owner.colour
+        return em
 
-        await ctx.channel.messages.send(embed=em)
+    async def job_analyse_server(self, job: Job) -> JobResult:
+        """
+        Analyses a server in the background.
+        """
+        guild = job.guild
+        member_data = await self.get_combined_member_data(guild, job.report_progress)
+        if not member_data:
+            return JobResult(content=":x: There are no analytics available for this server.")
+
+        em = self.make_server_embed(guild, member_data)
+        # the embed isn't stored, so keep a plain summary for ``j!jobs result``
+        return JobResult(content=f"<@{job.author_id}> {em.description}.", embed=em)
+
+    async def get_sampled_member_data(self, guild: Guild) -> Tuple[Dict[Member, dict], int]:
+        """
+        Analyses a reservoir sample of the members of a guild, and a sample of their messages.
+
+        The sample size is chosen to meet the approximate mode latency target, so it can change
+        between runs. The sample is seeded by the guild ID, and is only reproducible for a given
+        sample size.
+
+        :return: A tuple of (member data of every sampled member, number of members sampled from).
+            Members without data have an empty dict.
+        """
+        # the member cache has no stable order, so sort it for the seed to mean anything
+        members = sorted((member for member in guild.members.values() if not member.user.bot),
+                         key=lambda member: member.id)
+        sample = reservoir_sample(members, self.sample_sizer.size(), seed=guild.id)
+
+        before = time.monotonic()
+        member_data = {}
+        async for member in timesliced(sample, name="analytics"):
+            member_data[member] = await self.analyse_member(member, sample=self.approx_messages,
+                                                            seed=member.id)
+
+        self.sample_sizer.observe(len(sample), time.monotonic() - before)
+        return member_data, len(members)
+
+    @staticmethod
+    def make_approx_server_embed(guild: Guild, member_data: Dict[Member, dict],
+                                 population: int) -> Embed:
+        """
+        Makes the embed for an approximate server analysis.
+        """
+        def column(key: str, with_data: bool = False) -> np.ndarray:
+            return np.asarray([data.get(key, 0) for data in member_data.values()
+                               if data or not with_data], dtype=np.float64)
+
+        message_count, message_count_error = total_interval(column("message_count"), population)
+        message_total, _ = total_interval(column("message_total"), population)
+        total_length, total_length_error = total_interval(column("total_length"), population)
+        capitals, _ = total_interval(column("capitals"), population)
+        average_entropy, average_entropy_error = mean_interval(column("average_entropy", True))
+        average_length, average_length_error = mean_interval(column("average_length", True))
+
+        em = Embed()
+        em.title = "GHCQ Analysis Department (approximate)"
+        em.description = f"Approximate analysis for {guild.name}, from a sample of " \
+                         f"{len(member_data)} of {population} members. About " \
+                         f"{format_interval(message_count, message_count_error, '.0f')} " \
+                         f"messages were used ({message_total - message_count:.0f} skipped). " \
+                         f"Values are shown with 95% confidence intervals."
+        em.add_field(name="Avg. entropy",
+                     value=format_interval(average_entropy, average_entropy_error, '.4f'))
+        em.add_field(name="Avg. message length",
+                     value=f"{format_interval(average_length, average_length_error)} chars")
+        em.add_field(name="Total message length",
+                     value=f"{format_interval(total_length, total_length_error, '.0f')} chars")
+        if total_length:
+            em.add_field(name="% capital letters",
+                         value=format((capitals / total_length) * 100, '.2f'))
+        em.set_thumbnail(url=guild.icon_url)
+        em.colour = guild.owner.colour
+        return em
+
+    @analyse.subcommand(name="server")
+    async def _analyse_server(self, ctx: Context, *, options: str = ""):
+        """
+        Analyses the current server.
+
+        Answers from the latest nightly snapshot, unless `--fresh` is passed. Pass `--approx` for
+        a quick approximate answer from a sample of members.
+        """
+        _, flags = parse_flags(options)
+        if "approx" in flags:
+            async with ctx.channel.typing:
+                member_data, population = await self.get_sampled_member_data(ctx.guild)
+
+            if not any(member_data.values()):
+                return await ctx.channel.messages.send(":x: There are no analytics available "
+                                                       "for this server.")
+
+            em = self.make_approx_server_embed(ctx.guild, member_data, population)
+            return await ctx.channel.messages.send(embed=em)
+
+        if "fresh" not in flags:
+            member_data, snapshot = await self.get_snapshot_member_data(ctx.guild)
+            if member_data:
+                em = self.make_server_embed(ctx.guild, member_data)
+                age = display_time(int(snapshot.age)) or "a moment"
+                em.set_footer(text=f"From a snapshot taken {age} ago. "
+                                   f"Use --fresh to recompute.")
+                return await ctx.channel.messages.send(embed=em)
+
+        job_id = await ctx.bot.jobs.enqueue("analyse_server", ctx.channel, ctx.author)
+        await ctx.channel.messages.send(f":hourglass: Queued job `{job_id}`. I'll post the result "
+                                        f"here when it's done.")
 
     async def get_sorted_items(self, guild: Guild, sort_key: str = "average_entropy"):
         """
@@ -516,7 +799,12 @@ class Analytics(Plugin):
         """
         Shows the top 10 people in the server by a field, where field is one of
         `[entropy, length, capitals]`.
+
+        Pass `--approx` to rank a sample of members, using a sample of their messages.
         """
+        words, flags = parse_flags(sort_by)
+        sort_by = words[0] if words else "entropy"
+        approx = "approx" in flags
 
         sort_key = "average_entropy"
         if sort_by == "length":
@@ -526,7 +814,12 @@ class Analytics(Plugin):
 
         # sort by key, get the top 10
         async with ctx.channel.typing:
-            member_data = (await self.get_sorted_items(ctx.guild, sort_key))[:10]
+            if approx:
+                sampled, population = await self.get_sampled_member_data(ctx.guild)
+                member_data = sorted([item for item in sampled.items() if item[1]],
+                                     key=lambda i: i[1][sort_key], reverse=True)[:10]
+            else:
+                member_data = (await self.get_sorted_items(ctx.guild, sort_key))[:10]
 
         headers = ["POS", "Name", "Entropy", "Avg. Length", "Capitals"]
         rows = []
@@ -537,21 +830,106 @@ class Analytics(Plugin):
                 .decode("ascii", errors="replace")
             current_row.append(name)
 
-            current_row.append(format(stats['average_entropy'], '.3f'))
-            current_row.append(format(stats['average_length'], '.2f') + ' chars')
+            current_row.append(format_interval(stats['average_entropy'],
+                                               stats.get('average_entropy_error', 0), '.3f'))
+            current_row.append(format_interval(stats['average_length'],
+                                               stats.get('average_length_error', 0)) + ' chars')
             capitals = (stats['capitals'] / stats['total_length']) * 100
             current_row.append(format(capitals, '.2f') + '%')
             rows.append(current_row)
 
         table = tabulate.tabulate(rows, headers, tablefmt='orgtbl')
+        if approx:
+            table += f"\n\nApproximate: from a sample of {len(sampled)} of {population} members, " \
+                     f"with 95% confidence intervals."
+
         await ctx.channel.messages.send(f"```\n{table}```")
 
+    @async_thread()
+    def plot_distribution(self, member_data: Dict[Member, dict], item: str,
+                          item_key: str) -> Awaitable[BytesIO]:
+        """
+        Plots a distribution plot of some member data.
+        """
+        with self.client._plot_lock:
+            array = np.asarray([m[item_key] for m in member_data.values()])
+
+            axes: Axes = sns.boxplot(array)
+            axes.set_xlabel(item.capitalize())
+            axes.set_xbound(0, np.max(array))
+            plt.title("Distribution")
+            plt.tight_layout()
+            #sns.despine()
+
+            # write to the main buffer
+            buf = BytesIO()
+            plt.savefig(buf, format='png')
+            buf.seek(0)
+
+            # cleanup after ourselves
+            plt.clf()
+            plt.cla()
+
+            return buf
+
+    @async_thread()
+    def plot_sketch(self, sketch: KLLSketch, item: str) -> Awaitable[BytesIO]:
+        """
+        Plots a distribution plot of a quantile sketch.
+
+        Whiskers extend to 1.5 IQR, clipped to the smallest and largest values seen.
+        """
+        q1, median, q3 = sketch.quantiles([0.25, 0.5, 0.75])
+        iqr = q3 - q1
+        stats = {
+            "label": item.capitalize(),
+            "med": median,
+            "q1": q1,
+            "q3": q3,
+            "whislo": max(sketch.min, q1 - 1.5 * iqr),
+            "whishi": min(sketch.max, q3 + 1.5 * iqr),
+            "fliers": [],
+        }
+
+        with self.client._plot_lock:
+            axes: Axes = plt.gca()
+            axes.bxp([stats], vert=False, showfliers=False)
+            axes.set_xlabel(f"{item.capitalize()} (per message)")
+            plt.title(f"Distribution ({sketch.n} messages)")
+            plt.tight_layout()
+
+            buf = BytesIO()
+            plt.savefig(buf, format='png')
+            buf.seek(0)
+
+            plt.clf()
+            plt.cla()
+
+            return buf
+
+    async def job_server_distribution(self, job: Job) -> JobResult:
+        """
+        Plots a distribution plot for a server in the background.
+        """
+        fetched_data = await self.get_combined_member_data(job.guild, job.report_progress)
+        if not fetched_data:
+            return JobResult(content=":x: There are no analytics available for this server.")
+
+        # wait for the plotter to lock and plot
+        buf = await self.plot_distribution(fetched_data, job.args["item"], job.args["item_key"])
+        return JobResult(file=buf.read(), filename="plot.png")
+
     @_analyse_server.subcommand(name="distribution")
     @ratelimit(limit=1, time=60, bucket_namer=BucketNamer.GUILD)
     async def _server_distribution(self, ctx: Context, *, item: str = "entropy"):
         """
         Plots a distribution plot for the specified item.
+
+        Plots the distribution over messages from the server's quantile sketch, or the distribution
+        over members from the latest nightly snapshot. Pass `--fresh` to recompute it over members.
         """
+        words, flags = parse_flags(item)
+        item = words[0] if words else "entropy"
 
         item_key = "average_entropy"
         if item == "length":
@@ -559,38 +937,25 @@ class Analytics(Plugin):
         elif item == "capitals":
             item_key = "capitals"
 
-        @async_thread()
-        def plotter(member_data) -> Awaitable[BytesIO]:
-            """
-            The main plotter function.
-            """
-            with ctx.bot._plot_lock:
-                array = np.asarray([m[item_key] for m in member_data.values()])
-
-                axes: Axes = sns.boxplot(array)
-                axes.set_xlabel(item.capitalize())
-                axes.set_xbound(0, np.max(array))
-                plt.title("Distribution")
-                plt.tight_layout()
-                #sns.despine()
+        if "fresh" not in flags:
+            metric = item if item in ("length", "capitals") else "entropy"
+            sketch = await ctx.bot.sketches.get(ctx.guild.id, metric)
+            if len(sketch) > 0:
+                if ctx.bot._plot_lock.locked():
+                    await ctx.channel.send("Waiting for plot lock...")
 
-                # write to the main buffer
-                buf = BytesIO()
-                plt.savefig(buf, format='png')
-                buf.seek(0)
-
-                # cleanup after ourselves
-                plt.clf()
-                plt.cla()
-
-                return buf
-
-        async with ctx.channel.typing:
-            fetched_data = await self.get_combined_member_data(ctx.guild)
+                buf = await self.plot_sketch(sketch, item)
+                return await ctx.channel.messages.upload(buf.read(), filename="plot.png")
 
-            if ctx.bot._plot_lock.locked():
-                await ctx.channel.send("Waiting for plot lock...")
+            member_data, _ = await self.get_snapshot_member_data(ctx.guild)
+            if member_data:
+                if ctx.bot._plot_lock.locked():
+                    await ctx.channel.send("Waiting for plot lock...")
 
-            buf = await plotter(fetched_data)  # wait for the plotter to lock and plot
+                buf = await self.plot_distribution(member_data, item, item_key)
+                return await ctx.channel.messages.upload(buf.read(), filename="plot.png")
 
-        await ctx.channel.messages.upload(buf.read(), filename="plot.png")
+        job_id = await ctx.bot.jobs.enqueue("server_distribution", ctx.channel, ctx.author,
+                                            item=item, item_key=item_key)
+        await ctx.channel.messages.send(f":hourglass: Queued job `{job_id}`. I'll post the plot "
+                                        f"here when it's done.")
@@ -1,26 +1,30 @@
 """
 Autoprune functionality.
 """
-import collections
+import curio
 import datetime
+import matplotlib.pyplot as plt
 import numpy as np
 import random
-from curious import Embed, Guild, Member
+import seaborn as sns
+import tabulate
+import time
+from curio.thread import async_thread
+from curious import Channel, Embed, EventContext, Guild, Member, Message, event
 from curious.commands import Context, Plugin, command, condition
-from dataclasses import dataclass
-from io import StringIO
-from typing import Dict
-
+from io import BytesIO, StringIO
+from matplotlib.axes import Axes
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from jokusoramame.activity import ActivityResult, ActivityTable, GRANULARITIES, WEEKDAYS, \
+    bin_counts, bin_keys, bin_labels, bin_timestamps, heatmap_array
+from jokusoramame.bulk import BulkAction, BulkEngine, BulkOperation
+from jokusoramame.cache import make_key
+from jokusoramame.jobs import Job, JobResult
 from jokusoramame.redis import RedisInterface
-
-
-@dataclass
-class ActivityReport:
-    active: bool
-    algo_result: float
-    post_count: int
-    last_message: datetime.datetime
-    days_inactive: int = 0
+from jokusoramame.sampling import SampleSizer, format_interval, reservoir_sample, total_interval
+from jokusoramame.singleflight import SingleFlight
+from jokusoramame.utils import display_time, parse_flags, timesliced
 
 
 def prune_condition(ctx: Context):
@@ -34,65 +38,193 @@ class Autoprune(Plugin):
     Handles better automatic pruning.
     """
 
+    def __init__(self, client):
+        super().__init__(client)
+
+        self.sample_sizer = SampleSizer(**client.config.get("approx", {}))
+        self.backfills = SingleFlight()
+
+        client.jobs.register("activity_report", self.job_report)
+        client.snapshots.register("activity", self.build_snapshot)
+
+    @event("message_create")
+    async def update_activity(self, ctx: EventContext, message: Message):
+        if message.author is None or message.author.user.bot:
+            return
+
+        await ctx.bot.redis.update_activity(message)
+
+    async def get_member_timestamps(self, members: List[Member]) -> List[Optional[np.ndarray]]:
+        """
+        Gets the timestamps of the stored messages of some members.
+
+        :return: A list of timestamp arrays, in the same order as the members. Flagged members
+            have None.
+        """
+        timestamps = []
+        async for member in timesliced(members, name="activity"):
+            messages = await self.client.redis.get_messages(member.user)
+            if messages == self.client.redis.FLAGGED:
+                timestamps.append(None)
+                continue
+
+            timestamps.append(np.fromiter((message["dt"] for message in messages),
+                                          dtype=np.float64, count=len(messages)))
+
+        return timestamps
+
+    async def get_activity_timestamps(self, guild: Guild) -> Tuple[np.ndarray, int, int]:
+        """
+        Gets the timestamps of the stored messages of every member of a guild.
+
+        :return: A tuple of (timestamps, members analysed, members skipped).
+        """
+        member_timestamps = await self.get_member_timestamps(list(guild.members.values()))
+        # skip any flagged members
+        skipped = sum(timestamps is None for timestamps in member_timestamps)
+        used = [timestamps for timestamps in member_timestamps
+                if timestamps is not None and len(timestamps)]
+
+        if not used:
+            return np.empty(0, dtype=np.float64), 0, skipped
+
+        return np.concatenate(used), len(used), skipped
+
+    async def build_snapshot(self, guild: Guild) -> Dict[str, np.ndarray]:
+        """
+        Builds the activity histogram for a guild's snapshot.
+
+        Messages are binned by hour, which is fine enough for every granularity.
+        """
+        timestamps, analysed, skipped = await self.get_activity_timestamps(guild)
+        hours, counts = np.unique(timestamps.astype(np.int64) // 3600, return_counts=True)
+        return {"hours": hours, "counts": counts, "analysed": np.int64(analysed),
+                "skipped": np.int64(skipped)}
+
+    async def approximate_activity(self, guild: Guild, granularity: str) \
+            -> Tuple[List[str], np.ndarray, Callable[[int], float], Tuple[float, float], int]:
+        """
+        Estimates the activity histogram of a guild from a reservoir sample of its members.
+
+        :return: A tuple of (bin labels, estimated counts per bin, a function that gets the error
+            of the count of a bin, the estimated message count and its error, sample size).
+        """
+        members = list(guild.members.values())
+        sample = reservoir_sample(members, self.sample_sizer.size(), seed=guild.id)
+
+        before = time.monotonic()
+        member_timestamps = await self.get_member_timestamps(sample)
+        self.sample_sizer.observe(len(sample), time.monotonic() - before)
+
+        # flagged members are counted as having no messages, as they are in the exact histogram
+        member_keys = [bin_keys(timestamps, granularity) if timestamps is not None
+                       else np.empty(0, dtype=np.int64) for timestamps in member_timestamps]
+        keys, counts = bin_counts(np.concatenate(member_keys), granularity)
+        scale = len(members) / len(sample)
+
+        def error(index: int) -> float:
+            per_member = np.asarray([np.count_nonzero(member == keys[index])
+                                     for member in member_keys], dtype=np.float64)
+            return total_interval(per_member, len(members))[1]
+
+        totals = np.asarray([len(member) for member in member_keys], dtype=np.float64)
+        return (bin_labels(keys, granularity), counts * scale, error,
+                total_interval(totals, len(members)), len(sample))
+
     @command()
-    async def activity(self, ctx: Context):
+    async def activity(self, ctx: Context, *, options: str = ""):
         """
         Shows activity statistics for this server. Analytics must be enabled.
+
+        The granularity can be one of `[day, hour, weekday]`. This answers from the latest nightly
+        snapshot, unless `--fresh` is passed. Pass `--approx` for a quick approximate answer from
+        a sample of members.
         """
-        skipped = 0
-        analysed = 0
-        time_bins = collections.Counter()
-        message_count = 0
+        words, flags = parse_flags(options)
+        granularity = words[0].lower() if words else "day"
+        if granularity not in GRANULARITIES:
+            return await ctx.channel.messages.send(f":x: Granularity must be one of "
+                                                   f"{', '.join(GRANULARITIES)}.")
+
         members = ctx.guild.members.values()
+        snapshot = None
 
-        async with ctx.channel.typing:
-            for member in members:
-                messages = await ctx.bot.redis.get_messages(member.user)
-                # skip any flagged members
-                if messages == ctx.bot.redis.FLAGGED:
-                    skipped += 1
-                    continue
-
-                if len(messages) == 0:
-                    continue
-
-                analysed += 1
-                for message in messages:
-                    creation_time = datetime.datetime.fromtimestamp(message["dt"])
-                    time_bins[creation_time.date().isoformat()] += 1
-                    message_count += 1
-
-        if len(time_bins) < 2:
+        def error(index: int) -> float:
+            # exact histograms have no error
+            return 0
+
+        if "approx" in flags:
+            async with ctx.channel.typing:
+                labels, counts, error, (message_count, message_error), sampled = \
+                    await self.approximate_activity(ctx.guild, granularity)
+
+            description = f"Approximate activity from a sample of {sampled} members out of " \
+                          f"{len(members)}. Counts are shown with 95% confidence intervals."
+        else:
+            if "fresh" not in flags:
+                snapshot = await ctx.bot.snapshots.get(ctx.guild)
+                if snapshot is not None and "activity.hours" not in snapshot:
+                    snapshot = None
+
+            if snapshot is not None:
+                # each hour is binned once, weighted by its message count
+                hourly_counts = snapshot["activity.counts"]
+                keys = bin_keys(snapshot["activity.hours"] * 3600, granularity)
+                keys, counts = bin_counts(keys, granularity, weights=hourly_counts)
+                labels = bin_labels(keys, granularity)
+                message_count = int(hourly_counts.sum())
+                analysed = int(snapshot["activity.analysed"])
+                skipped = int(snapshot["activity.skipped"])
+            else:
+                async with ctx.channel.typing:
+                    timestamps, analysed, skipped = await self.get_activity_timestamps(ctx.guild)
+
+                labels, counts = bin_timestamps(timestamps, granularity)
+                message_count = len(timestamps)
+
+            message_error = 0
+            description = f"Tracked {analysed} members out of {len(members)} " \
+                          f"(skipped {skipped})."
+
+        used = np.flatnonzero(counts)
+        if len(used) < 2:
             return await ctx.channel.messages.send(":x: Not enough data.")
 
+        name = granularity.capitalize()
         embed = Embed(title="GCHQ")
         embed.colour = random.randint(0, 0xffffff)
         embed.set_thumbnail(url=ctx.guild.icon_url)
-        embed.description = f"Tracked {analysed} members out of {len(members)} (skipped {skipped})."
-        embed.add_field(name="Message Count", value=str(message_count), inline=False)
-        most_active = time_bins.most_common(1)[0]
-        embed.add_field(name="Most Active Day", value=str(most_active[0]))
-        embed.add_field(name="Most Active Day (msgs)", value=str(most_active[1]))
+        embed.description = description
+        embed.add_field(name="Message Count",
+                        value=format_interval(message_count, message_error, ".0f"), inline=False)
+
+        most_active = used[np.argmax(counts[used])]
+        embed.add_field(name=f"Most Active {name}", value=labels[most_active])
+        embed.add_field(name=f"Most Active {name} (msgs)",
+                        value=format_interval(counts[most_active], error(most_active), ".0f"))
+
         # special logic to ensure the least active is not flagged as today
-        least_actives = time_bins.most_common()
-        least_actives = [least_actives[-1], least_actives[-2]]
-        if least_actives[0][0] == datetime.datetime.utcnow().date().isoformat():
-            least_active = least_actives[1]
-        else:
-            least_active = least_actives[0]
+        today = datetime.datetime.utcnow().date().isoformat()
+        if granularity == "day" and labels[used[-1]] == today:
+            used = used[:-1]
+
+        least_active = used[np.argmin(counts[used])]
+        embed.add_field(name=f"Least Active {name}", value=labels[least_active])
+        embed.add_field(name=f"Least Active {name} (msgs)",
+                        value=format_interval(counts[least_active], error(least_active), ".0f"))
+
+        if snapshot is not None:
+            age = display_time(int(snapshot.age)) or "a moment"
+            embed.set_footer(text=f"From a snapshot taken {age} ago. "
+                                  f"Use --fresh to recompute.")
 
-        embed.add_field(name="Least Active Day", value=(str(least_active[0])))
-        embed.add_field(name="Least Active Day (msgs)", value=str(least_active[1]))
         return await ctx.channel.messages.send(embed=embed)
 
-    async def get_member_activity_data(self, guild: Guild) \
-            -> Dict[Member, ActivityReport]:
+    async def get_member_activity_data(self, guild: Guild) -> ActivityResult:
         """
         Gets member activity data.
         """
-        members = guild.members.values()
         redis: RedisInterface = self.client.redis
-        activity_data = collections.OrderedDict()
 
         # Kaelin 🏀 - Today at 01:12
         # Okay, I think I have a "post total to beat" for someone to dodge the prune:
@@ -106,52 +238,85 @@ class Autoprune(Plugin):
         # users.  PostCount capped at 5000 to protect the bot's sanity. if (1.8 * 1.09 ^
         # DaysSinceLastPost - 26) > PostCount then [return inactive]; return active;
 
+        # skip protected users
+        members = [member async for member in timesliced(list(guild.members.values()),
+                                                         name="activity")
+                   if not member.user.bot]
+        flagged = await redis.get_flagged([member.id for member in members])
+        if not await redis.is_activity_index_complete(guild):
+            user_ids = [member.id for member in members if member.id not in flagged]
+            await self.backfills.do(guild.id, redis.backfill_activity_index, guild, user_ids)
+
+        index = await redis.get_activity_index(guild)
+
+        table = await ActivityTable.from_members(members, index, flagged)
         # make it fair by pre-computing the date
-        now = datetime.datetime.utcnow()
-        for member in members:
-            # skip protected users
-            if member.user.bot:
-                continue
+        return table.score(time.time())
 
-            messages = await redis.get_messages(member.user)
-            # ignore flagged members
-            if messages == redis.FLAGGED:
-                activity_data[member] = None
-                continue
+    @activity.subcommand()
+    async def channels(self, ctx: Context):
+        """
+        Shows the most active channels in this server, and their busiest hours.
+        """
+        channel_ids, counts = heatmap_array(await ctx.bot.redis.get_heatmap(ctx.guild))
+        totals = counts.sum(axis=1)
+        if not totals.sum():
+            return await ctx.channel.messages.send(":x: Not enough data.")
 
-            days_joined = (now - member.joined_at).days
+        headers = ["Channel", "Messages", "Share", "Busiest Hour (UTC)"]
+        rows = []
+        for row in np.argsort(totals, kind="mergesort")[::-1][:10]:
+            channel = ctx.guild.channels.get(int(channel_ids[row]))
+            name = f"#{channel.name}" if channel is not None else str(channel_ids[row])
+            day, hour = divmod(int(np.argmax(counts[row])), 24)
+            rows.append([name, int(totals[row]), f"{totals[row] / totals.sum() * 100:.1f}%",
+                         f"{WEEKDAYS[day]} {hour:02d}:00"])
 
-            messages = sorted(messages, key=lambda m: m['dt'], reverse=True)
-            try:
-                first_message = messages[0]
-            except IndexError:
-                # no messages
-                active = days_joined < 7
-                activity_data[member] = ActivityReport(active=active, algo_result=0.0,
-                                                       post_count=0, last_message=None)
-                continue
+        table = tabulate.tabulate(rows, headers, tablefmt="orgtbl")
+        await ctx.channel.messages.send(f"```\n{table}```")
 
-            last_post = datetime.datetime.fromtimestamp(first_message['dt'])
-            days_inactive = (now - last_post).days
-            algorithm = (1.8 * np.math.pow(1.09, days_inactive) - 26)
-            # print(member.name, len(messages), algorithm, last_post.isoformat())
-            report = ActivityReport(active=len(messages) > algorithm,
-                                    algo_result=algorithm, post_count=len(messages),
-                                    last_message=last_post,
-                                    days_inactive=days_inactive)
+    @activity.subcommand()
+    async def heatmap(self, ctx: Context, *, channel: Channel = None):
+        """
+        Shows a heatmap of activity by hour of the week, for the server or a channel.
+        """
+        channel_ids, counts = heatmap_array(await ctx.bot.redis.get_heatmap(ctx.guild))
+        if channel is not None:
+            rows = np.flatnonzero(channel_ids == channel.id)
+            counts = counts[rows]
+
+        grid = counts.sum(axis=0).reshape(7, 24)
+        if not grid.sum():
+            return await ctx.channel.messages.send(":x: Not enough data.")
+
+        title = f"Activity in #{channel.name}" if channel is not None else "Activity"
+        cache = ctx.bot.render_cache
+        key = make_key("heatmap", title, grid.tobytes())
 
-            # forcibly flip the activity bool
-            if member.guild_permissions.kick_members:
-                report.active = True
+        @async_thread
+        def plot_heatmap() -> Awaitable[bytes]:
+            data = cache.get(key)
+            if data is not None:
+                return data
 
-            if (now - member.joined_at).days < 3:
-                report.active = True
+            with ctx.bot._plot_lock:
+                axes: Axes = sns.heatmap(grid, cmap="magma", yticklabels=WEEKDAYS,
+                                         xticklabels=[f"{hour:02d}" for hour in range(24)])
+                axes.set_xlabel("Hour (UTC)")
+                plt.title(title)
+                plt.tight_layout()
 
-            activity_data[member] = report
+                buf = BytesIO()
+                plt.savefig(buf, format="png")
 
-        items = list(activity_data.items())
-        items = sorted(items, key=lambda i: getattr(i[1], "days_inactive", 0))
-        return collections.OrderedDict(items)
+                plt.clf()
+                plt.cla()
+
+            data = buf.getvalue()
+            cache.put(key, data)
+            return data
+
+        await ctx.channel.messages.upload(await plot_heatmap(), filename="heatmap.png")
 
     @activity.subcommand(name="members")
     async def activity_members(self, ctx: Context):
@@ -165,43 +330,42 @@ class Autoprune(Plugin):
             activity_data = await self.get_member_activity_data(ctx.guild)
 
         em = Embed(title="Activity Report")
-        skipped = sum(x is None for x in activity_data.values())
-        active = sum(x.active for x in activity_data.values() if x is not None)
         em.description = f"Evaluated {len(members)} members. For privacy reasons, I cannot " \
-                         f"determine the activity of {skipped} member(s)."
+                         f"determine the activity of {activity_data.skipped_count} member(s)."
         em.set_thumbnail(url=ctx.guild.icon_url)
-        em.add_field(name="Active Count", value=str(active))
-        em.add_field(name="Inactive Count", value=str(len(activity_data) - active))
+        em.add_field(name="Active Count", value=str(activity_data.active_count))
+        em.add_field(name="Inactive Count", value=str(activity_data.inactive_count))
         em.set_footer(text="This is accurate to two weeks.")
         em.timestamp = now
         em.colour = random.randint(0, 0xffffff)
         await ctx.channel.messages.send(embed=em)
 
-    @activity.subcommand()
-    @condition(prune_condition)
-    async def report(self, ctx: Context):
+    async def job_report(self, job: Job) -> JobResult:
         """
-        Produces a membership activity report.
+        Produces a membership activity report in the background.
         """
-        async with ctx.channel.typing:
-            activity_data = await self.get_member_activity_data(ctx.guild)
+        guild = job.guild
+        activity_data = await self.get_member_activity_data(guild)
 
         active_buf = StringIO()
         inactive_buf = StringIO()
-        for member, report in activity_data.items():
-            if report is None:
+        rows = timesliced(enumerate(activity_data.rows()), name="activity report")
+        async for i, (member_id, active, score, post_count, last_post, days_inactive) in rows:
+            await job.report_progress(i + 1, len(activity_data))
+            member = guild.members.get(member_id)
+            if member is None:
                 continue
 
-            if report.last_message is None:
+            if last_post is None:
                 s = f"{member.name} ({member.user.username}#{member.user.discriminator}) - no data"
                 s += '\n'
             else:
                 s = (f"{member.name} ({member.user.username}#{member.user.discriminator}) - "
-                     f"score: {report.algo_result} - last post: {report.last_message.isoformat()} -"
-                     f" post count: {report.post_count} - days inactive: {report.days_inactive}")
+                     f"score: {score} - last post: {last_post.isoformat()} -"
+                     f" post count: {post_count} - days inactive: {days_inactive}")
                 s += '\n'
 
-            if report is None or report.active:
+            if active:
                 buf = active_buf
             else:
                 buf = inactive_buf
@@ -216,8 +380,65 @@ class Autoprune(Plugin):
         message_buf.write("Inactive users:\n\n")
         inactive_buf.seek(0)
         message_buf.write(inactive_buf.read())
-        message_buf.seek(0)
-        await ctx.channel.messages.send("DMing you the activity report. Please ensure you have "
-                                        "DMs enabled for this server.")
-        channel = await ctx.author.user.open_private_channel()
-        await channel.messages.upload(fp=message_buf, filename="activity_report.txt")
+        return JobResult(file=message_buf.getvalue().encode("utf-8"),
+                         filename="activity_report.txt", dm=True)
+
+    @activity.subcommand()
+    @condition(prune_condition)
+    async def report(self, ctx: Context):
+        """
+        Produces a membership activity report.
+        """
+        job_id = await ctx.bot.jobs.enqueue("activity_report", ctx.channel, ctx.author)
+        await ctx.channel.messages.send(f":hourglass: Queued job `{job_id}`. I'll DM you the "
+                                        f"activity report when it's done. Please ensure you have "
+                                        f"DMs enabled for this server.")
+
+    @activity.subcommand()
+    @condition(prune_condition)
+    async def prune(self, ctx: Context, *, options: str = ""):
+        """
+        Kicks inactive members.
+
+        This is a dry run that only counts the members that would be kicked, unless `--execute` is
+        passed.
+        """
+        _, flags = parse_flags(options)
+        execute = "execute" in flags
+
+        async with ctx.channel.typing:
+            activity_data = await self.get_member_activity_data(ctx.guild)
+
+        if execute and not await ctx.bot.redis.is_activity_index_complete(ctx.guild):
+            return await ctx.channel.messages.send(":x: The activity index for this server is "
+                                                   "still being built. Try again later.")
+
+        # never kick ourselves or the owner, no matter what the scores say
+        exempt = {ctx.bot.user.id, ctx.guild.owner_id}
+        member_ids = [member_id for member_id in activity_data.inactive_ids()
+                      if member_id not in exempt]
+        if not member_ids:
+            return await ctx.channel.messages.send(":x: There are no inactive members to prune.")
+
+        if execute:
+            await ctx.channel.messages.send(f"Are you sure you want to kick {len(member_ids)} "
+                                            f"inactive members [Y/N]?")
+
+            try:
+                async with curio.timeout_after(30):
+                    result: Message = await ctx.bot.events.wait_for(
+                        "message_create",
+                        predicate=lambda m: m.author == ctx.author and m.channel == ctx.channel
+                    )
+            except curio.TaskTimeout:
+                return await ctx.channel.messages.send("Cancelled.")
+
+            if result.content.lower() != "y":
+                return await ctx.channel.messages.send("Cancelled.")
+
+        operations = [BulkOperation(member_id, BulkAction.KICK) for member_id in member_ids]
+        job_id = make_key("prune", ctx.guild.id)
+        progress = await ctx.channel.messages.send(f"Pruning {len(operations)} members...")
+        engine = BulkEngine(ctx.bot.redis, ctx.guild, job_id, operations, dry_run=not execute,
+                            progress_message=progress)
+        await engine.run()
@@ -5,7 +5,6 @@ import sys
 import time
 from itertools import cycle
 
-import asks
 import asyncqlio
 import contextlib
 import curio
@@ -30,7 +29,18 @@ from curious.exc import HTTPException, PermissionsError
 from io import BytesIO, StringIO
 
 from jokusoramame.bot import Jokusoramame
-from jokusoramame.utils import display_time, is_owner, rgbize
+from jokusoramame.cache import make_key
+from jokusoramame.utils import display_time, is_owner, rgbize, slice_stats
+
+
+def round_significant(value: int, digits: int) -> int:
+    """
+    Rounds an integer to a number of significant digits.
+    """
+    if value == 0:
+        return 0
+
+    return round(value, digits - len(str(abs(value))))
 
 
 class Core(Plugin):
@@ -200,8 +210,7 @@ class Core(Plugin):
         """
         Changes the name of the bot.
         """
-        sess = asks.Session()
-        resp: Response = await sess.get(link)
+        resp: Response = await ctx.bot.sessions.get(link)
         if resp.status_code != 200:
             await ctx.channel.messages.send(f":x: Failed to download avatar. "
                                             f"(code: {resp.status_code})")
@@ -270,10 +279,19 @@ class Core(Plugin):
         palette = [0xabcdef, 0xbcdefa, 0xcdefab, 0xdefabc, 0xefabcd, 0xfabcde]
         palette = cycle(palette)
 
+        # counts are rounded to the precision the plot can show, so that a re-render is only
+        # needed when it would actually look different
+        events = [(name, round_significant(count, 2))
+                  for (name, count) in ctx.bot.events_handled.most_common()]
+        key = make_key("stats", events)
+        data = ctx.bot.render_cache.get(key)
+        if data is not None:
+            return await ctx.channel.messages.upload(data, filename="stats.png")
+
         async with ctx.channel.typing, spawn_thread():
             with ctx.bot._plot_lock:
                 names, values = [], []
-                for name, value in ctx.bot.events_handled.most_common():
+                for name, value in events:
                     names.append(name)
                     values.append(value)
 
@@ -292,10 +310,157 @@ class Core(Plugin):
                 plt.cla()
                 plt.clf()
 
-        buf.seek(0)
-        data = buf.read()
+        data = buf.getvalue()
+        ctx.bot.render_cache.put(key, data)
         await ctx.channel.messages.upload(data, filename="stats.png")
 
+    @stats.subcommand()
+    async def caches(self, ctx: Context):
+        """
+        Shows cache statistics.
+        """
+        render_cache = ctx.bot.render_cache
+        response_cache = ctx.bot.response_cache
+
+        rows = [
+            ["renders", render_cache.hits, render_cache.misses, len(render_cache),
+             f"{render_cache.size / 1024:.1f} KiB"],
+        ]
+        endpoints = sorted(set(response_cache.hits) | set(response_cache.misses))
+        for endpoint in endpoints:
+            rows.append([endpoint, response_cache.hits[endpoint], response_cache.misses[endpoint],
+                         "", ""])
+
+        rows.append(["responses (memory)", response_cache.tier_hits["memory"], "",
+                     len(response_cache.memory), f"{response_cache.memory.size / 1024:.1f} KiB"])
+        if response_cache.redis is not None:
+            rows.append(["responses (redis)", response_cache.tier_hits["redis"], "", "", ""])
+
+        headers = ["Cache", "Hits", "Misses", "Items", "Size"]
+        table = tabulate.tabulate(rows, headers, tablefmt="orgtbl")
+        await ctx.channel.messages.send(f"```\n{table}```")
+
+    @stats.subcommand()
+    async def http(self, ctx: Context):
+        """
+        Shows connection reuse statistics for outbound HTTP requests.
+        """
+        rows = []
+        for host, host_stats in sorted(ctx.bot.sessions.get_stats().items()):
+            requests = host_stats["requests"]
+            reuse = (host_stats["reused"] / requests) * 100 if requests else 0.0
+            rows.append([host, requests, host_stats["connections"], f"{reuse:.1f}%",
+                         host_stats["errors"]])
+
+        if not rows:
+            return await ctx.channel.messages.send(":x: No outbound requests have been made.")
+
+        headers = ["Host", "Requests", "Connections", "Reused", "Errors"]
+        table = tabulate.tabulate(rows, headers, tablefmt="orgtbl")
+        coalesced = ctx.bot.sessions.flights.coalesced
+        await ctx.channel.messages.send(f"```\n{table}\n\nCoalesced requests: {coalesced}```")
+
+    @stats.subcommand()
+    async def upstreams(self, ctx: Context):
+        """
+        Shows the circuit breaker state and latency of external APIs.
+        """
+        rows = []
+        for breaker in ctx.bot.breakers:
+            p50 = breaker.latency_percentile(50) * 1000
+            p99 = breaker.latency_percentile(99) * 1000
+            rows.append([breaker.name, breaker.state.value, len(breaker.samples),
+                         f"{breaker.error_rate * 100:.1f}%", f"{p50:.0f}ms", f"{p99:.0f}ms"])
+
+        if not rows:
+            return await ctx.channel.messages.send(":x: No external APIs have been called.")
+
+        headers = ["Upstream", "State", "Calls", "Errors", "p50", "p99"]
+        table = tabulate.tabulate(rows, headers, tablefmt="orgtbl")
+        await ctx.channel.messages.send(f"```\n{table}```")
+
+    @stats.subcommand()
+    async def slices(self, ctx: Context):
+        """
+        Shows how long time-sliced loops held the event loop for.
+        """
+        rows = []
+        for name, stats in sorted(slice_stats.items()):
+            rows.append([name, stats.slices, stats.items, f"{stats.percentile(50) / 1000:.2f}ms",
+                         f"{stats.percentile(99) / 1000:.2f}ms", f"{stats.longest / 1000:.2f}ms"])
+
+        if not rows:
+            return await ctx.channel.messages.send(":x: No time-sliced loops have run.")
+
+        headers = ["Loop", "Slices", "Items", "p50", "p99", "Longest"]
+        table = tabulate.tabulate(rows, headers, tablefmt="orgtbl")
+        await ctx.channel.messages.send(f"```\n{table}```")
+
+    @stats.subcommand()
+    async def database(self, ctx: Context):
+        """
+        Shows prepared statement cache statistics for the database connections.
+        """
+        connector = ctx.bot.db.connector
+        stats = getattr(connector, "statement_stats", None)
+        if stats is None:
+            return await ctx.channel.messages.send(":x: This database connector doesn't report "
+                                                   "statement cache statistics.")
+
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = (stats["hits"] / lookups) * 100 if lookups else 0.0
+        rows = [[stats["hits"], stats["misses"], f"{hit_rate:.1f}%", stats["evictions"],
+                 connector.pool.connections_made, connector.pool.idle]]
+
+        headers = ["Hits", "Misses", "Hit rate", "Evictions", "Connections", "Idle"]
+        table = tabulate.tabulate(rows, headers, tablefmt="orgtbl")
+        await ctx.channel.messages.send(f"```\n{table}```")
+
+    @command()
+    async def jobs(self, ctx: Context):
+        """
+        Shows the recent background jobs in this server.
+        """
+        rows = []
+        for job_id in await ctx.bot.jobs.get_guild_job_ids(ctx.guild):
+            job = await ctx.bot.jobs.get_job(job_id)
+            if job is None:
+                continue
+
+            author = job.author
+            age = display_time(int(time.time() - job.created)) or "just now"
+            rows.append([job.id, job.name, author.name if author else job.author_id,
+                         job.state, job.progress, age])
+
+        if not rows:
+            return await ctx.channel.messages.send(":x: There are no recent jobs.")
+
+        headers = ["ID", "Job", "Author", "State", "Progress", "Age"]
+        table = tabulate.tabulate(rows, headers, tablefmt="orgtbl")
+        await ctx.channel.messages.send(f"```\n{table}```")
+
+    @jobs.subcommand()
+    async def result(self, ctx: Context, *, job_id: str):
+        """
+        Re-posts the result of a finished job.
+        """
+        job = await ctx.bot.jobs.get_job(job_id)
+        if job is None or job.guild_id != ctx.guild.id:
+            return await ctx.channel.messages.send(":x: That job does not exist, or has expired.")
+
+        if job.state != "done":
+            return await ctx.channel.messages.send(f":x: That job is {job.state}.")
+
+        result = await ctx.bot.jobs.get_result(job_id)
+        if result is None:
+            return await ctx.channel.messages.send(":x: The result of that job has expired.")
+
+        if result.dm and ctx.author.id != job.author_id:
+            return await ctx.channel.messages.send(":x: That result is private.")
+
+        # private results go back to the author privately
+        await ctx.bot.jobs.post_result(job, result)
+
     @command()
     @is_owner()
     async def reload(self, ctx: Context, *, module_name: str):
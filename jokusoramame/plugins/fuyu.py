@@ -1,5 +1,3 @@
-import asks
-import curio
 import logging
 import random
 import re
@@ -9,7 +7,10 @@ from curious.commands import Context, Plugin, command
 from fractions import Fraction
 
 from jokusoramame import USER_AGENT
-from jokusoramame.utils import get_apikeys, is_owner
+from jokusoramame.breakers import UpstreamError
+from jokusoramame.bulk import BulkAction, BulkEngine, BulkOperation
+from jokusoramame.cache import make_key
+from jokusoramame.utils import get_apikeys, is_owner, timesliced
 
 ISSUE_REGEXP = re.compile(r"(\S+)/(\S+)#([0-9]+)")
 logger = logging.getLogger(__file__)
@@ -89,21 +90,20 @@ class Fuyu(Plugin):
     @command()
     @is_owner()  # Good enough for now...
     async def massnick(self, ctx: Context, prefix: str = '', suffix: str = ''):
-        good = 0
-        bad = 0
-
-        for member in ctx.guild.members.values():
-            task = await curio.spawn(member.nickname.set(prefix + member.user.username + suffix),
-                                     report_crash=False)
-            try:
-                await task.join()
-            except curio.TaskError:
-                bad += 1
-            else:
-                good += 1
-
-        await ctx.channel.messages.send(f"Tried changing {good + bad} nicknames. "
-                                        f"({good} successful, {bad} failed.)")
+        members = list(ctx.guild.members.values())
+        operations = [BulkOperation(member.id, BulkAction.NICKNAME,
+                                    prefix + member.user.username + suffix)
+                      async for member in timesliced(members, name="massnick")]
+
+        job_id = make_key("massnick", ctx.guild.id, prefix, suffix)
+        progress = await ctx.channel.messages.send(f"Changing {len(operations)} nicknames...")
+        engine = BulkEngine(ctx.bot.redis, ctx.guild, job_id, operations,
+                            progress_message=progress)
+        result = await engine.run()
+
+        await ctx.channel.messages.send(f"Tried changing {result.total} nicknames. "
+                                        f"({result.succeeded} successful, {result.failed} failed, "
+                                        f"{result.skipped} skipped.)")
 
     @event("message_create")
     async def annoy(self, ctx: EventContext, message: Message):
@@ -139,7 +139,11 @@ class Fuyu(Plugin):
 
         owner, repo, issue = match.groups()
         url = self.API_URL + f"/repos/{owner}/{repo}/issues/{issue}"
-        request: Response = await asks.get(headers=headers, uri=url)
+        try:
+            request: Response = await ctx.bot.sessions.get(headers=headers, uri=url,
+                                                           upstream="github")
+        except UpstreamError:
+            return
         if request.status_code == 429:  # rate-limit
             return
 
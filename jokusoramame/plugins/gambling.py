@@ -12,11 +12,10 @@ import tabulate
 from curious import Embed, Guild, Member
 from curious.commands import Context, Plugin, command
 from curious.commands.decorators import ratelimit
-from curious.ext.paginator import ReactionsPaginator
 from typing import List
 
 from jokusoramame.db.tables import UserBalance
-from jokusoramame.utils import chunked
+from jokusoramame.paginator import LazyPaginator, ListPageSource
 
 BAD_RESPONSES = [
     '\N{FIRE} Your bank account went up in flames and you lost **{0} :̶.̶|̶:̶;̶**.',
@@ -58,7 +57,7 @@ class Gambling(Plugin):
 
             return balance
 
-    async def construct_leaderboard(self, guild: Guild, *, mode: str) -> List[str]:
+    async def construct_leaderboard(self, guild: Guild, *, mode: str) -> ListPageSource:
         """
         Query the database for the balance of each member in a guild, and sort it appropriately.
 
@@ -67,11 +66,11 @@ class Gambling(Plugin):
         |-------+---------+---------|
         |     1 | name    |       0 |
 
-        Each table contains 10 entries.
+        Each table contains 10 entries, and is only formatted when its page is viewed.
 
         :param guild: The guild to construct the leaderboard for.
         :param mode: Tells if the results should be ordered in ascending or descending order.
-        :return: A list of formatted tables.
+        :return: A :class:`.ListPageSource` of formatted tables.
         """
         order_by = {
             'top': UserBalance.money.desc(),
@@ -86,26 +85,21 @@ class Gambling(Plugin):
             rows = await query.all()
             rows = await rows.flatten()
 
-        pages = []
-        pos = 0
-
-        for chunk in chunked(rows, 10):
-            rows = []
-
-            for row in chunk:
-                pos += 1
+        def make_page(chunk: List[UserBalance], page: int) -> str:
+            entries = []
 
+            for pos, row in enumerate(chunk, start=page * 10 + 1):
                 member = guild.members.get(row.user_id)
                 name = member.user.name if member else str(row.user_id)
 
                 # Strips unicode
                 name = name.encode('ascii', errors='replace').decode()
-                rows.append(self.entry(pos, name, row.money))
+                entries.append(self.entry(pos, name, row.money))
 
-            tab = tabulate.tabulate(rows, headers='POS User Money'.split(), tablefmt='orgtbl')
-            pages.append('```' + tab + '```')
+            tab = tabulate.tabulate(entries, headers='POS User Money'.split(), tablefmt='orgtbl')
+            return '```' + tab + '```'
 
-        return pages
+        return ListPageSource(rows, make_page, per_page=10)
 
     async def update_balance(self, member: Member, amount: int):
         """
@@ -187,7 +181,7 @@ class Gambling(Plugin):
                 '\N{CROSS MARK} No entries found for this guild.'
             )
 
-        paginator = ReactionsPaginator(content=pages, channel=ctx.channel, respond_to=ctx.author)
+        paginator = LazyPaginator(pages, channel=ctx.channel, respond_to=ctx.author)
         await paginator.paginate()
 
     @command()
@@ -202,7 +196,7 @@ class Gambling(Plugin):
                 '\N{CROSS MARK} No entries found for this guild.'
             )
 
-        paginator = ReactionsPaginator(content=pages, channel=ctx.channel, respond_to=ctx.author)
+        paginator = LazyPaginator(pages, channel=ctx.channel, respond_to=ctx.author)
         await paginator.paginate()
 
     @command()
@@ -1,7 +1,6 @@
 from array import array
 from itertools import chain
 
-import asks
 import curio
 import wave
 from PIL import Image
@@ -58,7 +57,7 @@ class Imaging(Plugin):
         if target is None:
             target = ctx.author
 
-        r: Response = await asks.get(target.user.static_avatar_url)
+        r: Response = await ctx.bot.sessions.get(target.user.static_avatar_url)
         async with curio.spawn_thread():
             wav_data = self._do_sstv(r.raw)
 
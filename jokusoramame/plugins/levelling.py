@@ -7,13 +7,12 @@ from asyncqlio import Session
 from curious import Embed, EventContext, Member, Message, event
 from curious.commands import Context, Plugin, command
 from curious.exc import Forbidden, PermissionsError
-from curious.ext.paginator import ReactionsPaginator
 from numpy.ma import floor
 from numpy.polynomial import Polynomial as P
 from typing import List
 
 from jokusoramame.db.tables import UserXP
-from jokusoramame.utils import chunked
+from jokusoramame.paginator import LazyPaginator, ListPageSource
 
 INCREASING_FACTOR = 75
 
@@ -210,34 +209,31 @@ class Levelling(Plugin):
             rows = await query.all()
             rows: List[UserXP] = await rows.flatten()
 
-        # paginate into chunks
-        messages = []
-        position = 0
-        for chunk in chunked(rows, 10):
-            rows = []
+        # pages are only rendered when they're viewed
+        def make_page(chunk: List[UserXP], page: int) -> str:
+            table = []
 
-            for row in chunk:
-                position += 1
+            for position, row in enumerate(chunk, start=page * 10 + 1):
                 member = ctx.guild.members.get(row.user_id)
                 name = member.user.name if member is not None else str(row.user_id)
                 # no unicode tyvm
                 name = name.encode("ascii", errors="replace").decode("ascii", errors="replace")
-                rows.append((str(position), name, row.xp, row.level))
+                table.append((str(position), name, row.xp, row.level))
 
-            tbl = tabulate.tabulate(rows, headers=["POS", "User", "XP", "Level"],
+            tbl = tabulate.tabulate(table, headers=["POS", "User", "XP", "Level"],
                                     tablefmt="orgtbl")
 
-            messages.append(f"```\n{tbl}```")
+            return f"```\n{tbl}```"
 
-        if len(messages) == 1:
-            return await ctx.channel.send(messages[0])
+        source = ListPageSource(rows, make_page, per_page=10)
+        if len(source) <= 1:
+            return await ctx.channel.send(await source.render(0) if rows else "No entries.")
 
         if not ctx.channel.me_permissions.add_reactions:
-            for message in messages:
-                await ctx.channel.messages.send(message)
+            for page in range(len(source)):
+                await ctx.channel.messages.send(await source.render(page))
         else:
-            paginator = ReactionsPaginator(content=messages, channel=ctx.channel,
-                                           respond_to=ctx.author)
+            paginator = LazyPaginator(source, channel=ctx.channel, respond_to=ctx.author)
             await paginator.paginate()
 
     @level.subcommand(name="next")
@@ -0,0 +1,514 @@
+import datetime
+import random
+import re
+from asks.response_objects import Response
+from curious import Embed
+from curious.commands import Context, Plugin
+from curious.commands.decorators import autoplugin
+from typing import List, Optional, Sequence, Tuple
+
+from jokusoramame import USER_AGENT
+from jokusoramame.bot import Jokusoramame
+from jokusoramame.breakers import UpstreamError
+from jokusoramame.cache import make_key
+from jokusoramame.paginator import LazyPaginator, ListPageSource
+from jokusoramame.plugins.location.geocache import GeocodeCache, normalize_query, reverse_key
+from jokusoramame.plugins.location.maps import GeocodingClient, GeocodingError, \
+    gather_with_deadline
+from jokusoramame.plugins.location.stops import BUS_STOP, RAIL_STATION, StopIndex, \
+    normalize_name, stop_to_dict
+from jokusoramame.plugins.location.timetable import TimetableManager
+from jokusoramame.plugins.location.transport import DailyQuota, DepartureCache
+from jokusoramame.singleflight import SingleFlight
+from jokusoramame.utils import get_apikeys
+
+
+def truncate(s: str) -> str:
+    if len(s) <= 26:
+        return s
+
+    return s[:23] + "..."
+
+
+bearing_map = {
+    "S": "South",
+    "N": "North",
+    "E": "East",
+    "W": "West",
+    "NE": "Northeast",
+    "NW": "Northwest",
+    "SE": "Southeast",
+    "SW": "Southwest"
+}
+
+BUS_REGEX = re.compile(r"[0-9]+[a-zA-Z]")
+
+
+@autoplugin
+class Location(Plugin):
+    """
+    Location utilities.
+    """
+    URL_PREFIX = "https://transportapi.com/v3/uk"
+
+    def __init__(self, client: Jokusoramame):
+        super().__init__(client)
+
+        self.mapskey = get_apikeys("googlemaps")
+        self.transportkey = get_apikeys("transport")
+
+        self.maps = GeocodingClient(client.sessions, self.mapskey.key)
+
+        #: The offline stop index, if it has been imported.
+        location_config = client.config.get("location", {})
+        self.stops = StopIndex.load(location_config.get("data_path", "data/location"))
+
+        #: The offline GTFS timetable, used when live departures are unavailable.
+        self.timetables = TimetableManager(client.sessions, **location_config.get("gtfs", {}))
+
+        self.geocache = GeocodeCache(client.db, **client.config.get("geocode_cache", {}))
+
+        transport_config = client.config.get("transportapi", {})
+        #: The daily TransportAPI call budget.
+        self.quota = DailyQuota(client.redis, "transportapi", **transport_config.get("quota", {}))
+
+        #: The cache of live departure boards.
+        self.departures = DepartureCache(**transport_config.get("departures", {}))
+        self.transport_flights = SingleFlight()
+
+    async def load(self):
+        await self.timetables.start()
+
+    async def get_geocode(self, location: str) -> List[dict]:
+        """
+        Gets the geocode of a location.
+        """
+        return await self.geocache.get(normalize_query(location), self.maps.geocode, location)
+
+    async def get_geocodes(self, locations: Sequence[str], *,
+                           deadline: float = 5.0) -> List[Optional[List[dict]]]:
+        """
+        Gets the geocodes of several locations concurrently, under one deadline.
+
+        :return: The geocodes, in the same order as the locations. Lookups that failed or did not
+            finish in time are None.
+        """
+        return await gather_with_deadline(self.get_geocode, locations, deadline=deadline,
+                                          ignore=(GeocodingError, UpstreamError))
+
+    async def get_geodecode(self, latitude: int, longitude: int) -> List[dict]:
+        """
+        Gets the geodecode of a lat/long pair.
+        """
+        return await self.geocache.get(reverse_key(latitude, longitude),
+                                       self.maps.reverse_geocode, latitude, longitude)
+
+    async def get_lat_long(self, location: str) -> Tuple[float, float]:
+        """
+        Gets the latitude/longitude of a location.
+        """
+        geocode = await self.get_geocode(location)
+        if len(geocode) == 0:
+            raise ValueError("Invalid geocode")
+
+        latlong = geocode[0]['geometry']['location']
+        return latlong['lat'], latlong['lng']
+
+    async def make_transport_api_request(self, route: str, params: dict) -> Response:
+        """
+        Makes a TransportAPI request.
+
+        Identical concurrent requests share one real request, and only real requests are counted
+        against the daily quota.
+        """
+        key = make_key(route, sorted(params.items()))
+        return await self.transport_flights.do(key, self._transport_api_request, route, params)
+
+    async def _transport_api_request(self, route: str, params: dict) -> Response:
+        await self.quota.spend()
+        params = {
+            "app_id": self.transportkey.id_,
+            "app_key": self.transportkey.key,
+            **params
+        }
+        headers = {
+            "User-Agent": USER_AGENT
+        }
+
+        uri = self.URL_PREFIX + route
+        result = await self.client.sessions.get(uri=uri, params=params, headers=headers,
+                                                upstream="transportapi")
+        return result
+
+    async def get_live_departures(self, route: str, params: dict) -> Optional[dict]:
+        """
+        Gets a live departure board from TransportAPI.
+
+        :return: The response body, or None if TransportAPI is unavailable (down, slow, or over
+            its rate limit).
+        """
+        try:
+            response = await self.make_transport_api_request(route, params)
+        except UpstreamError:
+            return None
+
+        if response.status_code in (403, 429) or response.status_code >= 500:
+            return None
+
+        return response.json()
+
+    async def get_departure_footer(self, age: float) -> str:
+        """
+        Gets the footer of a live departure board.
+
+        :param age: The age of the board, in seconds.
+        """
+        footer = "Powered by TransportAPI"
+        if age >= 1:
+            footer += f" | Updated {int(age)}s ago"
+
+        if await self.quota.is_low():
+            footer += " | Running low on API calls today"
+
+        return footer
+
+    async def send_scheduled_departures(self, ctx: Context, code: str, *, live: bool = False):
+        """
+        Sends the scheduled departures from a stop, from the offline timetable.
+
+        :param code: The GTFS stop ID or code of the stop.
+        :param live: If this is standing in for live departures.
+        """
+        timetable = self.timetables.timetable
+        row = timetable.find_stop(code) if timetable is not None else None
+        if row is None:
+            if live:
+                return await ctx.channel.messages.send(":x: Live departures are unavailable "
+                                                       "right now. Try again later.")
+
+            return await ctx.channel.messages.send(":x: This stop is not in the timetable.")
+
+        departures = timetable.departures(row, datetime.datetime.utcnow())
+
+        embed = Embed()
+        embed.title = f"Scheduled Departures for {timetable.stop_name(row)}"
+        if live:
+            embed.description = "Live departures are unavailable right now, so these are the " \
+                                "scheduled times."
+
+        if len(departures) == 0:
+            embed.description = "There are no scheduled departures from this stop."
+        else:
+            for departure in departures:
+                embed.add_field(name="Route", value=departure.route)
+                embed.add_field(name="Towards", value=truncate(departure.headsign) or "??")
+                embed.add_field(name="Leaving at", value=departure.departs.strftime("%H:%M"))
+
+        embed.set_footer(text="From the offline timetable")
+        embed.timestamp = datetime.datetime.utcnow()
+        embed.colour = random.randint(0, 0xffffff)
+        await ctx.channel.messages.send(embed=embed)
+
+    async def get_atco(self, location: str) -> dict:
+        """
+        Gets the atco(s) of a location.
+
+        Uses the offline stop index if it has been imported, otherwise TransportAPI.
+        """
+        lat, long = await self.get_lat_long(location)
+        if self.stops is not None:
+            nearest = self.stops.nearest(lat, long, BUS_STOP, k=10)
+            return {"stops": [stop_to_dict(stop, distance) for (stop, distance) in nearest]}
+
+        route = "/bus/stops/near.json"
+        result = await self.make_transport_api_request(
+            route=route,
+            params={"lat": lat, "lon": long},
+        )
+        return result.json()
+
+    async def command_geocode(self, ctx: Context, *, location: str):
+        """
+        Geocodes a location, getting it's latitude/longitude.
+
+        Several locations can be separated with `;`.
+        """
+        locations = [part.strip() for part in location.split(";") if part.strip()]
+        if len(locations) <= 1:
+            lat, long = await self.get_lat_long(location)
+            return await ctx.channel.messages.send(f"**Lat/long:** {lat} {long}")
+
+        async with ctx.channel.typing:
+            geocodes = await self.get_geocodes(locations[:10])
+
+        lines = []
+        for name, geocode in zip(locations, geocodes):
+            if not geocode:
+                lines.append(f"**{name}:** not found")
+                continue
+
+            latlong = geocode[0]['geometry']['location']
+            lines.append(f"**{name}:** {latlong['lat']} {latlong['lng']}")
+
+        await ctx.channel.messages.send("\n".join(lines))
+
+    async def command_geocode_stats(self, ctx: Context):
+        """
+        Shows the geocode cache hit rate.
+        """
+        stats = self.geocache.stats
+        await ctx.channel.messages.send(f"**Geocode cache:** {self.geocache.hit_rate * 100:.1f}% "
+                                        f"hit rate ({stats['memory']} memory, "
+                                        f"{stats['database']} database, {stats['miss']} misses, "
+                                        f"{len(self.geocache.memory)} in memory).")
+
+    async def command_transport(self, ctx: Context):
+        """
+        Shows TransportAPI usage and the departure cache hit rate.
+        """
+        stats = self.departures.stats
+        await ctx.channel.messages.send(f"**TransportAPI:** {await self.quota.used()}/"
+                                        f"{self.quota.limit} calls today.\n"
+                                        f"**Departure cache:** "
+                                        f"{self.departures.hit_rate * 100:.1f}% hit rate "
+                                        f"({stats['fresh']} fresh, {stats['stale']} stale, "
+                                        f"{stats['miss']} misses).")
+
+    async def command_geodecode(self, ctx: Context, latitude: float, longitude: float):
+        """
+        Geodecodes a location, turning a lat/long pair into a location name.
+        """
+        geodecode = await self.get_geodecode(latitude, longitude)
+        first = geodecode[0]['formatted_address']
+        await ctx.channel.messages.send(f"**Geodecoded result:** {first}")
+
+    async def command_buses(self, ctx: Context, *, stop: str):
+        """
+        Gets the bus schedule for a specified UK bus stop.
+
+        Note that the stop might not be the one you specified; it is the closest one in the range of
+        the area you specify.
+        """
+        if not BUS_REGEX.match(stop):
+            async with ctx.channel.typing:
+                try:
+                    atcos = await self.get_atco(stop)
+                except ValueError:
+                    return await ctx.channel.messages.send(":x: Could not find ATCO for this stop.")
+
+                if len(atcos['stops']) == 0:
+                    return await ctx.channel.messages.send(":x: Could not find this stop.")
+
+            stop = atcos['stops'][0]
+            atco = stop['atcocode']
+        else:
+            atco = stop
+
+        return await self.command_buses_departures(ctx, atco=atco)
+
+    async def command_buses_atco(self, ctx: Context, *, location: str):
+        """
+        Gets the ATCO code of a bus stop.
+        """
+        async with ctx.channel.typing:
+            try:
+                response = await self.get_atco(location)
+            except ValueError as e:
+                return await ctx.channel.messages.send(f":x: {''.join(e.args)}.")
+
+        if len(response['stops']) == 0:
+            return await ctx.channel.messages.send(":x: Could not find any stops here.")
+
+        def make_page(stops: List[dict], page: int) -> Embed:
+            stop = stops[0]
+            em = Embed()
+            em.title = "Stop Search Results"
+            em.description = f"Full name: {stop['name']}"
+            em.add_field(name="ATCO", value=stop['atcocode'], inline=False)
+
+            bearing = stop['bearing']
+            if bearing:
+                bearing = bearing_map[bearing]
+            else:
+                bearing = "??"
+            em.add_field(name="Direction", value=bearing)
+            em.add_field(name="Indicator", value=stop['indicator'])
+            em.add_field(name="Locality", value=stop['locality'])
+            em.set_footer(text="Powered by TransportAPI")
+            em.timestamp = datetime.datetime.utcnow()
+            em.colour = random.randint(0, 0xffffff)
+            return em
+
+        source = ListPageSource(response['stops'], make_page)
+        paginator = LazyPaginator(source, ctx.channel, ctx.author)
+        await paginator.paginate()
+
+    async def command_buses_departures(self, ctx: Context, *, atco: str):
+        """
+        Gets the live departures for a specified bus stop.
+        """
+        atco = atco.upper()
+
+        async with ctx.channel.typing:
+            url = f"/bus/stop/{atco}/live.json"
+            js, age = await self.departures.get(f"bus:{atco}", self.get_live_departures, url, {
+                "group": "route",
+                "nextbuses": "no"
+            })
+            if js is None:
+                return await self.send_scheduled_departures(ctx, atco, live=True)
+
+            if 'error' in js:
+                return await ctx.channel.messages.send(f":x: API returned error: `{js['error']}`")
+
+        embed = Embed()
+        embed.title = f"Bus Departures for {js['name']}"
+        embed.description = "This only lists the next bus arriving."
+
+        if len(js['departures']) == 0:
+            embed.description = "There are no buses departing this station currently."
+        else:
+            for line, departure_list in js.get('departures', {}).items():
+                departure = departure_list[0]
+                embed.add_field(name="Route", value=str(line))
+                direction = departure['direction']
+                if len(direction) >= 27:
+                    direction = direction[:24] + "..."
+
+                embed.add_field(name="Towards", value=direction)
+                departure_time = departure['aimed_departure_time']
+                if departure_time is None:
+                    departure_time = "EOTL"
+
+                embed.add_field(name="Leaving at", value=departure_time)
+
+        embed.set_footer(text=await self.get_departure_footer(age))
+        embed.timestamp = datetime.datetime.utcnow()
+        colour = random.randint(0, 0xffffff)
+        embed.colour = colour
+
+        await ctx.channel.messages.send(embed=embed)
+
+    async def command_buses_timetable(self, ctx: Context, *, atco: str):
+        """
+        Gets the scheduled departures for a specified bus stop, from the offline timetable.
+        """
+        return await self.send_scheduled_departures(ctx, atco)
+
+    async def try_find_crs(self, station: str):
+        """
+        Tries to find a CRS code for the specified station.
+        """
+        if self.stops is not None:
+            # by name first, as that needs no geocode; exact matches sort first, and a prefix match
+            # could be a different station entirely, so only an exact one is taken
+            found = self.stops.search(station, RAIL_STATION, limit=1)
+            if found:
+                name = found[0]["name"].decode("utf-8", errors="replace")
+                if normalize_name(name) == normalize_name(station):
+                    return found[0]["code"].decode()
+
+        lat, long = await self.get_lat_long(station)
+        if self.stops is not None:
+            nearest = self.stops.nearest(lat, long, RAIL_STATION, k=1)
+            return nearest[0][0]["code"].decode() if nearest else None
+
+        # about 5km either way
+        maxlat = lat + 0.05
+        maxlong = long + 0.05
+        minlat = lat - 0.05
+        minlong = long - 0.05
+
+        url = f"/train/stations/bbox.json"
+        params = {
+            "maxlat": maxlat,
+            "maxlon": maxlong,
+            "minlat": minlat,
+            "minlon": minlong
+        }
+        result = await self.make_transport_api_request(url, params)
+        result = result.json()
+
+        station_results = result.get("stations", [])
+        for r_station in result.get("stations", []):
+            if r_station['name'].lower() == station.lower():
+                return r_station['station_code']
+        else:
+            if len(station_results) > 0:
+                return station_results[0]['station_code']
+
+    async def command_trains(self, ctx: Context, *, station: str):
+        """
+        Shows information about the trains at a UK Train station.
+        """
+        if len(station) != 3:
+            found_station = await self.try_find_crs(station)
+            if found_station is None:
+                # if all else fails, we can try a tiploc code
+                station = f"tiploc:{station}"
+            else:
+                station = found_station
+
+        return await self.command_trains_departures(ctx, station=station)
+
+    async def command_trains_departures(self, ctx: Context, *, station: str):
+        """
+        Shows the train departures from the specified UK train station.
+        """
+        route = f"/train/station/{station}/live.json"
+        params = {
+            "station_detail": "origin,destination,calling_at,called_at",
+            "type": "departure"
+        }
+        data, age = await self.departures.get(f"train:{station.upper()}",
+                                              self.get_live_departures, route, params)
+        if data is None:
+            return await self.send_scheduled_departures(ctx, station.split(":")[-1], live=True)
+
+        if 'error' in data:
+            return await ctx.channel.messages.send(f":x: API gave error: {data['error']}")
+
+        departures = data['departures']['all']
+        if len(departures) == 0:
+            em = Embed(title=f"Departures from {data['station_name']}")
+            em.description = "There are currently no departures from this station."
+            em.colour = random.randint(0, 0xffffff)
+            return await ctx.channel.messages.send(embed=em)
+
+        footer = await self.get_departure_footer(age)
+
+        def make_page(page_departures: List[dict], i: int) -> Embed:
+            departure = page_departures[0]
+            dest = departure['destination_name']
+            dest_station = departure['station_detail']['destination']
+
+            em = Embed()
+            em.title = f"Departures from {data['station_name']}"
+            em.description = f"A {departure['operator_name']} service towards " \
+                             f"{departure['destination_name']}.\n" \
+                             f"This train is currently {departure['status'].lower()}"
+            em.add_field(name="Origin", value=departure['origin_name'])
+            em.add_field(name="Destination", value=dest)
+            em.add_field(name="Expected arrival", value=departure['expected_arrival_time'])
+            em.add_field(name="Expected departure", value=departure['expected_departure_time'])
+            em.add_field(name="Platform at destination",
+                         value=f"Platform {dest_station['platform']}")
+            em.add_field(name="Arriving at destination",
+                         value=f"{dest_station['aimed_arrival_time']}")
+            em.set_footer(text=f"{i+1}/{len(departures)} trains | {footer}")
+            em.colour = random.randint(0, 0xffffff)
+            return em
+
+        source = ListPageSource(departures, make_page)
+        paginator = LazyPaginator(source, ctx.channel, ctx.author)
+        await paginator.paginate()
+
+    async def command_trains_timetable(self, ctx: Context, *, station: str):
+        """
+        Shows the scheduled train departures from the specified UK train station, from the offline
+        timetable.
+        """
+        if len(station) != 3:
+            station = await self.try_find_crs(station) or station
+
+        return await self.send_scheduled_departures(ctx, station)
@@ -0,0 +1,119 @@
+"""
+Geocoding result cache.
+"""
+import json
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Optional
+
+from asyncqlio import DatabaseInterface
+from lru import LRU
+
+from jokusoramame.db.tables import GeocodeCacheEntry
+from jokusoramame.singleflight import SingleFlight
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a geocoding query, so that trivially different spellings share a cache entry.
+    """
+    return " ".join(query.casefold().replace(",", " ").split())
+
+
+def reverse_key(latitude: float, longitude: float, places: int = 4) -> str:
+    """
+    Gets the cache key of a reverse geocoding lookup.
+
+    Coordinates are rounded, to about 11 metres at 4 decimal places.
+    """
+    return f"reverse:{round(latitude, places):.{places}f},{round(longitude, places):.{places}f}"
+
+
+class GeocodeCache(object):
+    """
+    A two-tier cache of geocoding results.
+
+    Results are kept in an in-memory LRU, backed by the ``geocode_cache`` table. Places don't move,
+    so entries live for a long time.
+    """
+
+    def __init__(self, db: DatabaseInterface, *, max_items: int = 4096,
+                 ttl: int = 90 * 86_400):
+        """
+        :param db: The database to store results in.
+        :param max_items: The maximum number of results to keep in memory.
+        :param ttl: The number of seconds to keep a result for.
+        """
+        self.db = db
+        self.ttl = ttl
+        self.memory = LRU(max_items)
+        self.flights = SingleFlight()
+
+        #: The number of lookups answered by each tier, or missed.
+        self.stats = Counter()
+
+    def _fresh(self, cached_at: float) -> bool:
+        return time.time() - cached_at < self.ttl
+
+    async def _get_db(self, key: str) -> Optional[Any]:
+        async with self.db.get_session() as sess:
+            entry = await sess.select(GeocodeCacheEntry) \
+                .where(GeocodeCacheEntry.query.eq(key)) \
+                .first()
+
+        if entry is None or not self._fresh(entry.cached_at):
+            return None
+
+        result = json.loads(entry.result)
+        self.memory[key] = (entry.cached_at, result)
+        return result
+
+    async def _put_db(self, key: str, result: Any, cached_at: int):
+        async with self.db.get_session() as sess:
+            await sess.execute("""
+            INSERT INTO geocode_cache (query, result, cached_at)
+            VALUES ({query}, {result}, {cached_at})
+            ON CONFLICT (query) DO UPDATE SET result = EXCLUDED.result,
+                                              cached_at = EXCLUDED.cached_at;
+            """, {"query": key, "result": json.dumps(result), "cached_at": cached_at})
+
+    async def _lookup(self, key: str, func: Callable[..., Awaitable[Any]], *args) -> Any:
+        result = await self._get_db(key)
+        if result is not None:
+            self.stats["database"] += 1
+            return result
+
+        self.stats["miss"] += 1
+        result = await func(*args)
+        cached_at = int(time.time())
+        self.memory[key] = (cached_at, result)
+        await self._put_db(key, result, cached_at)
+        return result
+
+    async def get(self, key: str, func: Callable[..., Awaitable[Any]], *args) -> Any:
+        """
+        Gets a cached result, or looks it up and caches it.
+
+        Concurrent lookups of the same key share one lookup.
+
+        :param key: The cache key, from :func:`.normalize_query` or :func:`.reverse_key`.
+        :param func: A coroutine function that looks the result up.
+        :param args: The arguments to the function.
+        """
+        cached = self.memory.get(key)
+        if cached is not None and self._fresh(cached[0]):
+            self.stats["memory"] += 1
+            return cached[1]
+
+        return await self.flights.do(key, self._lookup, key, func, *args)
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        :return: The fraction of lookups answered by either tier.
+        """
+        total = sum(self.stats.values())
+        if not total:
+            return 0.0
+
+        return (self.stats["memory"] + self.stats["database"]) / total
@@ -0,0 +1,112 @@
+"""
+An async client for the Google Maps Geocoding API.
+"""
+from typing import Any, Awaitable, Callable, List, Optional, Sequence, Tuple, Type
+
+import curio
+from asks.response_objects import Response
+
+from jokusoramame import USER_AGENT
+from jokusoramame.breakers import UpstreamError
+from jokusoramame.sessions import SessionPool
+
+
+class GeocodingError(Exception):
+    """
+    Raised when the Geocoding API returns an error status.
+    """
+
+    def __init__(self, status: str, message: str = None):
+        self.status = status
+        self.message = message
+        super().__init__(f"{status}: {message}" if message else status)
+
+
+async def gather_with_deadline(func: Callable[[Any], Awaitable[Any]], items: Sequence[Any], *,
+                               deadline: float,
+                               ignore: Tuple[Type[Exception], ...] = ()) -> List[Any]:
+    """
+    Calls a coroutine function on several items concurrently, under one deadline.
+
+    :param func: The coroutine function to call on each item.
+    :param items: The items.
+    :param deadline: The number of seconds to wait for all of the calls.
+    :param ignore: Exceptions that just leave the result of their item as None.
+    :return: The results, in the same order as the items. Calls that did not finish in time are
+        None.
+    """
+    results = [None] * len(items)
+
+    async def call(index: int, item: Any):
+        try:
+            results[index] = await func(item)
+        except ignore:
+            pass
+
+    async with curio.ignore_after(deadline):
+        async with curio.TaskGroup() as group:
+            for index, item in enumerate(items):
+                await group.spawn(call, index, item)
+
+    return results
+
+
+class GeocodingClient(object):
+    """
+    Speaks the Geocoding REST API over the bot's pooled sessions.
+
+    Results have the same shape as those of ``googlemaps.Client``; a list of result dicts, which is
+    empty if nothing was found.
+    """
+    URL = "https://maps.googleapis.com/maps/api/geocode/json"
+
+    def __init__(self, sessions: SessionPool, key: str):
+        """
+        :param sessions: The :class:`.SessionPool` to make requests with.
+        :param key: The Google Maps API key.
+        """
+        self.sessions = sessions
+        self.key = key
+
+    async def _request(self, params: dict) -> List[dict]:
+        response: Response = await self.sessions.get(
+            self.URL, params={"key": self.key, **params}, headers={"User-Agent": USER_AGENT},
+            coalesce=True, upstream="googlemaps"
+        )
+        if response.status_code != 200:
+            raise GeocodingError(str(response.status_code))
+
+        body = response.json()
+        status = body["status"]
+        if status == "ZERO_RESULTS":
+            return []
+
+        if status != "OK":
+            raise GeocodingError(status, body.get("error_message"))
+
+        return body["results"]
+
+    async def geocode(self, address: str) -> List[dict]:
+        """
+        Geocodes an address.
+        """
+        return await self._request({"address": address})
+
+    async def reverse_geocode(self, latitude: float, longitude: float) -> List[dict]:
+        """
+        Reverse geocodes a lat/long pair.
+        """
+        return await self._request({"latlng": f"{latitude},{longitude}"})
+
+    async def geocode_many(self, addresses: Sequence[str], *,
+                           deadline: float = 5.0) -> List[Optional[List[dict]]]:
+        """
+        Geocodes several addresses concurrently, under one deadline.
+
+        :param addresses: The addresses to geocode.
+        :param deadline: The number of seconds to wait for all of the lookups.
+        :return: The results, in the same order as the addresses. Lookups that failed or did not
+            finish in time are None.
+        """
+        return await gather_with_deadline(self.geocode, addresses, deadline=deadline,
+                                          ignore=(GeocodingError, UpstreamError))
@@ -0,0 +1,230 @@
+"""
+An offline index of UK bus stops and rail stations.
+
+The index is built from the NaPTAN ``Stops.csv`` and ``RailReferences.csv`` files with::
+
+    python -m jokusoramame.plugins.location.stops import-naptan Stops.csv RailReferences.csv
+"""
+import csv
+import os
+from typing import List, Optional, Tuple
+
+import click
+import numpy as np
+from scipy.spatial import cKDTree
+
+#: The mean radius of the earth, in metres.
+EARTH_RADIUS = 6_371_000
+
+#: The kinds of stop.
+BUS_STOP = 0
+RAIL_STATION = 1
+
+#: The NaPTAN stop types that are bus stops.
+BUS_STOP_TYPES = {"BCT", "BCS", "BCQ"}
+
+STOP_DTYPE = np.dtype([
+    ("code", "S12"),
+    ("kind", "u1"),
+    ("name", "S64"),
+    ("locality", "S48"),
+    ("indicator", "S16"),
+    ("bearing", "S2"),
+    ("lat", "f8"),
+    ("lon", "f8"),
+])
+
+
+def normalize_name(name: str) -> bytes:
+    """
+    Normalizes a stop name for the name index.
+    """
+    name = name.casefold().replace("railway station", "").replace("rail station", "")
+    return " ".join(name.split()).encode("utf-8")[:64]
+
+
+def to_unit_vectors(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """
+    Converts latitudes and longitudes into points on the unit sphere.
+
+    Nearest neighbours by straight-line distance between these are nearest neighbours by great
+    circle distance, so a k-d tree over them works anywhere.
+    """
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+
+def chord_to_metres(chord: np.ndarray) -> np.ndarray:
+    """
+    Converts a distance between unit vectors into a great circle distance, in metres.
+    """
+    return 2 * EARTH_RADIUS * np.arcsin(np.minimum(chord / 2, 1))
+
+
+class StopIndex(object):
+    """
+    A memory-mapped index of stops.
+
+    Stops are looked up by position with a k-d tree per kind of stop, and by name with a sorted
+    array of normalized names keyed by kind. A binary search over it answers the same prefix
+    queries as a trie.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: The directory containing the index files.
+        """
+        #: The stops, as a memory-mapped structured array.
+        self.stops = np.load(os.path.join(path, "stops.npy"), mmap_mode="r")
+
+        self._names = np.load(os.path.join(path, "stop_names.npy"), mmap_mode="r")
+        self._name_order = np.load(os.path.join(path, "stop_name_order.npy"), mmap_mode="r")
+        self._code_order = np.argsort(self.stops["code"], kind="mergesort")
+
+        self._trees = {}
+        for kind in (BUS_STOP, RAIL_STATION):
+            rows = np.flatnonzero(self.stops["kind"] == kind)
+            points = to_unit_vectors(self.stops["lat"][rows], self.stops["lon"][rows])
+            self._trees[kind] = (rows, cKDTree(points))
+
+    @classmethod
+    def load(cls, path: str) -> Optional['StopIndex']:
+        """
+        Loads an index, if it has been imported.
+        """
+        if not os.path.exists(os.path.join(path, "stops.npy")):
+            return None
+
+        return cls(path)
+
+    def __len__(self) -> int:
+        return len(self.stops)
+
+    def nearest(self, lat: float, lon: float, kind: int, k: int = 5) \
+            -> List[Tuple[np.void, float]]:
+        """
+        Finds the stops nearest to a point.
+
+        :param kind: The kind of stop to find.
+        :param k: The number of stops to find.
+        :return: A list of (stop, distance in metres), nearest first.
+        """
+        rows, tree = self._trees[kind]
+        if not len(rows):
+            return []
+
+        k = min(k, len(rows))
+        chords, indexes = tree.query(to_unit_vectors(np.asarray([lat]), np.asarray([lon]))[0],
+                                     k=k)
+        chords = np.atleast_1d(chords)
+        indexes = np.atleast_1d(indexes)
+        distances = chord_to_metres(chords)
+        return [(self.stops[rows[index]], float(distance))
+                for (index, distance) in zip(indexes, distances)]
+
+    def search(self, name: str, kind: int = None, limit: int = 10) -> List[np.void]:
+        """
+        Finds stops by name. Exact matches come first, followed by names starting with the query.
+        """
+        if kind is None:
+            stations = self.search(name, RAIL_STATION, limit)
+            return (stations + self.search(name, BUS_STOP, limit))[:limit]
+
+        # names are keyed by kind, then name, so every match is in one contiguous range
+        prefix = b"%d" % kind + normalize_name(name)
+        start = np.searchsorted(self._names, prefix, side="left")
+        stop = min(np.searchsorted(self._names, prefix + b"\xff", side="left"), start + limit)
+        return [self.stops[self._name_order[position]] for position in range(start, stop)]
+
+    def get(self, code: str) -> Optional[np.void]:
+        """
+        Gets a stop by its ATCO or CRS code.
+        """
+        code = code.upper().encode()
+        codes = self.stops["code"]
+        position = np.searchsorted(codes, code, sorter=self._code_order)
+        if position < len(codes) and codes[self._code_order[position]] == code:
+            return self.stops[self._code_order[position]]
+
+        return None
+
+
+def stop_to_dict(stop: np.void, distance: float = None) -> dict:
+    """
+    Converts a stop into the shape of a TransportAPI stop result.
+    """
+    result = {
+        "atcocode": stop["code"].decode(),
+        "name": stop["name"].decode("utf-8", errors="replace"),
+        "locality": stop["locality"].decode("utf-8", errors="replace"),
+        "indicator": stop["indicator"].decode("utf-8", errors="replace"),
+        "bearing": stop["bearing"].decode() or None,
+        "latitude": float(stop["lat"]),
+        "longitude": float(stop["lon"]),
+    }
+    if distance is not None:
+        result["distance"] = int(distance)
+
+    return result
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command(name="import-naptan")
+@click.argument("stops_csv", type=click.Path(exists=True, dir_okay=False))
+@click.argument("rail_csv", type=click.Path(exists=True, dir_okay=False))
+@click.option("--output", default="data/location", help="The directory to write the index to.")
+def import_naptan(stops_csv: str, rail_csv: str, output: str):
+    """
+    Imports the NaPTAN Stops.csv and RailReferences.csv files.
+    """
+    # RailReferences has no lat/long, so stations are positioned from their entry in Stops
+    crs_codes = {}
+    with open(rail_csv, encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            if row.get("CrsCode"):
+                crs_codes[row["AtcoCode"]] = (row["CrsCode"], row["StationName"])
+
+    rows = []
+    with open(stops_csv, encoding="utf-8-sig", errors="replace") as f:
+        for row in csv.DictReader(f):
+            if row.get("Status", "act").lower().startswith("del"):
+                continue
+
+            try:
+                lat, lon = float(row["Latitude"]), float(row["Longitude"])
+            except (KeyError, ValueError):
+                continue
+
+            atco = row["ATCOCode"]
+            if atco in crs_codes:
+                code, name = crs_codes.pop(atco)
+                rows.append((code.encode(), RAIL_STATION, name.encode("utf-8")[:64],
+                             row["LocalityName"].encode("utf-8")[:48], b"", b"", lat, lon))
+            elif row["StopType"] in BUS_STOP_TYPES:
+                rows.append((atco.encode(), BUS_STOP, row["CommonName"].encode("utf-8")[:64],
+                             row["LocalityName"].encode("utf-8")[:48],
+                             row["Indicator"].encode("utf-8")[:16],
+                             row["Bearing"].encode("utf-8")[:2], lat, lon))
+
+    stops = np.array(rows, dtype=STOP_DTYPE)
+    names = np.array([b"%d" % stop["kind"] + normalize_name(stop["name"].decode("utf-8",
+                                                                                errors="replace"))
+                      for stop in stops], dtype="S65")
+    name_order = np.argsort(names, kind="mergesort")
+
+    os.makedirs(output, exist_ok=True)
+    np.save(os.path.join(output, "stops.npy"), stops)
+    np.save(os.path.join(output, "stop_names.npy"), names[name_order])
+    np.save(os.path.join(output, "stop_name_order.npy"), name_order)
+
+    stations = int(np.count_nonzero(stops["kind"] == RAIL_STATION))
+    click.echo(f"Imported {len(stops) - stations} bus stops and {stations} stations.")
+
+
+if __name__ == "__main__":
+    cli()
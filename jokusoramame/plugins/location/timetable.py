@@ -0,0 +1,474 @@
+"""
+An offline timetable of scheduled departures, imported from a GTFS feed.
+
+A feed is imported with::
+
+    python -m jokusoramame.plugins.location.timetable import-gtfs feed.zip
+
+The stop times are stored as memory-mapped columns, sorted by stop and then by departure time, so
+the next departures from a stop are a binary search away.
+"""
+import array
+import csv
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import click
+import curio
+import logbook
+import numpy as np
+from curio.thread import async_thread
+from lru import LRU
+
+from jokusoramame.sessions import SessionPool
+
+logger = logbook.Logger("Jokusoramame.timetable")
+
+#: The columns of an imported timetable.
+COLUMNS = (
+    "stop_keys", "stop_key_rows", "stop_names", "stop_offsets",
+    "departure_times", "departure_trips",
+    "trip_routes", "trip_services", "trip_headsigns",
+    "route_names",
+    "service_days", "service_starts", "service_ends",
+    "exception_dates", "exception_services", "exception_types",
+)
+
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+
+def parse_gtfs_time(value: str) -> int:
+    """
+    Parses a GTFS time into seconds after the start of the service day.
+
+    GTFS times can go past 24:00:00, for services that run past midnight.
+    """
+    hours, minutes, seconds = value.strip().split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def date_to_int(date: datetime.date) -> int:
+    """
+    Converts a date into the integer form of a GTFS date, e.g. 20180131.
+    """
+    return date.year * 10000 + date.month * 100 + date.day
+
+
+def _last_sunday(year: int, month: int) -> datetime.datetime:
+    # the last day of the month, walked back to a sunday
+    day = datetime.datetime(year, month + 1, 1) - datetime.timedelta(days=1)
+    return day - datetime.timedelta(days=(day.weekday() + 1) % 7)
+
+
+def uk_local_time(utc: datetime.datetime) -> datetime.datetime:
+    """
+    Converts a naive UTC time into naive UK local time.
+
+    British Summer Time runs from 01:00 UTC on the last Sunday of March to 01:00 UTC on the last
+    Sunday of October.
+    """
+    start = _last_sunday(utc.year, 3).replace(hour=1)
+    end = _last_sunday(utc.year, 10).replace(hour=1)
+    if start <= utc < end:
+        return utc + datetime.timedelta(hours=1)
+
+    return utc
+
+
+@dataclass
+class ScheduledDeparture:
+    #: The name of the route.
+    route: str
+
+    #: Where the service is heading.
+    headsign: str
+
+    #: The scheduled departure time, in UK local time.
+    departs: datetime.datetime
+
+
+class Timetable(object):
+    """
+    A memory-mapped GTFS timetable.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: The directory containing the timetable files.
+        """
+        for column in COLUMNS:
+            setattr(self, column, np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r"))
+
+        with open(os.path.join(path, "feed.json")) as f:
+            #: Information about the imported feed.
+            self.feed = json.load(f)
+
+        self._active = LRU(8)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['Timetable']:
+        """
+        Loads a timetable, if one has been imported.
+        """
+        if not os.path.exists(os.path.join(path, "feed.json")):
+            return None
+
+        return cls(path)
+
+    @property
+    def imported(self) -> float:
+        """
+        :return: When this timetable was imported.
+        """
+        return self.feed["imported"]
+
+    def find_stop(self, code: str) -> Optional[int]:
+        """
+        Finds the row of a stop by its GTFS stop ID or stop code (usually an ATCO or CRS code).
+        """
+        code = code.upper().encode()
+        position = np.searchsorted(self.stop_keys, code)
+        if position < len(self.stop_keys) and self.stop_keys[position] == code:
+            return int(self.stop_key_rows[position])
+
+        return None
+
+    def stop_name(self, row: int) -> str:
+        return self.stop_names[row].decode("utf-8", errors="replace")
+
+    def active_services(self, date: datetime.date) -> np.ndarray:
+        """
+        Gets which services run on a date.
+
+        :return: A boolean array, indexed by service.
+        """
+        try:
+            return self._active[date]
+        except KeyError:
+            pass
+
+        day = date_to_int(date)
+        active = ((self.service_days & (1 << date.weekday())) != 0) \
+            & (self.service_starts <= day) & (day <= self.service_ends)
+
+        # calendar_dates entries for this day override the weekly pattern
+        start = np.searchsorted(self.exception_dates, day, side="left")
+        stop = np.searchsorted(self.exception_dates, day, side="right")
+        services = self.exception_services[start:stop]
+        types = self.exception_types[start:stop]
+        active[services[types == 1]] = True
+        active[services[types == 2]] = False
+
+        self._active[date] = active
+        return active
+
+    def departures(self, row: int, when: datetime.datetime,
+                   limit: int = 10) -> List[ScheduledDeparture]:
+        """
+        Gets the next scheduled departures from a stop.
+
+        :param row: The row of the stop, from :meth:`.find_stop`.
+        :param when: The UTC time to get departures after.
+        :param limit: The maximum number of departures to get.
+        """
+        start, stop = int(self.stop_offsets[row]), int(self.stop_offsets[row + 1])
+        times = self.departure_times[start:stop]
+        trips = self.departure_trips[start:stop]
+
+        now = uk_local_time(when)
+        found = []
+        # yesterday's service day, for services running past midnight, then today's
+        for days_ago in (1, 0):
+            service_date = now.date() - datetime.timedelta(days=days_ago)
+            midnight = datetime.datetime.combine(service_date, datetime.time())
+            seconds = (now - midnight).total_seconds()
+
+            first = np.searchsorted(times, seconds, side="left")
+            last = np.searchsorted(times, seconds + 86400, side="left")
+            candidates = trips[first:last]
+            running = self.active_services(service_date)[self.trip_services[candidates]]
+            for offset in np.flatnonzero(running)[:limit]:
+                trip = int(candidates[offset])
+                found.append(ScheduledDeparture(
+                    route=self.route_names[self.trip_routes[trip]].decode("utf-8", "replace"),
+                    headsign=self.trip_headsigns[trip].decode("utf-8", "replace"),
+                    departs=midnight + datetime.timedelta(seconds=int(times[first + offset])),
+                ))
+
+        found.sort(key=lambda departure: departure.departs)
+        return found[:limit]
+
+
+def _read_csv(feed: zipfile.ZipFile, name: str):
+    if name not in feed.namelist():
+        return
+
+    with feed.open(name) as f:
+        yield from csv.DictReader(io.TextIOWrapper(f, encoding="utf-8-sig", errors="replace"))
+
+
+def import_feed(feed_path: str, output: str) -> dict:
+    """
+    Imports a GTFS feed into a timetable directory.
+
+    :param feed_path: The path to the feed's zip file.
+    :param output: The directory to write the timetable to.
+    :return: Information about the imported feed.
+    """
+    with zipfile.ZipFile(feed_path) as feed:
+        stop_rows = {}
+        stop_names = []
+        stop_keys = {}
+        for row in _read_csv(feed, "stops.txt"):
+            stop_rows[row["stop_id"]] = len(stop_names)
+            stop_names.append(row.get("stop_name", "").encode("utf-8")[:64])
+            for key in (row["stop_id"], row.get("stop_code")):
+                if key:
+                    stop_keys.setdefault(key.upper().encode()[:16], stop_rows[row["stop_id"]])
+
+        route_rows = {}
+        route_names = []
+        for row in _read_csv(feed, "routes.txt"):
+            route_rows[row["route_id"]] = len(route_names)
+            name = row.get("route_short_name") or row.get("route_long_name") or row["route_id"]
+            route_names.append(name.encode("utf-8")[:16])
+
+        service_rows = {}
+        service_days = []
+        service_starts = []
+        service_ends = []
+
+        def service_row(service_id: str) -> int:
+            if service_id not in service_rows:
+                # services only defined by calendar_dates never run on a weekly pattern
+                service_rows[service_id] = len(service_days)
+                service_days.append(0)
+                service_starts.append(0)
+                service_ends.append(0)
+
+            return service_rows[service_id]
+
+        for row in _read_csv(feed, "calendar.txt"):
+            service = service_row(row["service_id"])
+            service_days[service] = sum(1 << index for (index, day) in enumerate(WEEKDAYS)
+                                        if row[day] == "1")
+            service_starts[service] = int(row["start_date"])
+            service_ends[service] = int(row["end_date"])
+
+        exceptions = [(int(row["date"]), service_row(row["service_id"]),
+                       int(row["exception_type"]))
+                      for row in _read_csv(feed, "calendar_dates.txt")]
+
+        trip_rows = {}
+        trip_routes = array.array("I")
+        trip_services = array.array("I")
+        trip_headsigns = []
+        for row in _read_csv(feed, "trips.txt"):
+            trip_rows[row["trip_id"]] = len(trip_routes)
+            trip_routes.append(route_rows[row["route_id"]])
+            trip_services.append(service_row(row["service_id"]))
+            trip_headsigns.append(row.get("trip_headsign", "").encode("utf-8")[:48])
+
+        # stop_times is by far the largest file, so it's read straight into typed columns
+        stops = array.array("I")
+        times = array.array("i")
+        trips = array.array("I")
+        sequences = array.array("I")
+        no_pickup = array.array("B")
+        for row in _read_csv(feed, "stop_times.txt"):
+            departure = row.get("departure_time") or row.get("arrival_time")
+            if not departure:
+                # untimed stops are interpolated by consumers; we can't show a time for them
+                continue
+
+            stops.append(stop_rows[row["stop_id"]])
+            times.append(parse_gtfs_time(departure))
+            trips.append(trip_rows[row["trip_id"]])
+            sequences.append(int(row["stop_sequence"]))
+            no_pickup.append(row.get("pickup_type") == "1")
+
+    stops = np.frombuffer(stops, dtype=np.uint32)
+    times = np.frombuffer(times, dtype=np.int32)
+    trips = np.frombuffer(trips, dtype=np.uint32)
+    sequences = np.frombuffer(sequences, dtype=np.uint32)
+    no_pickup = np.frombuffer(no_pickup, dtype=np.uint8).astype(bool)
+
+    # the last stop of a trip is an arrival, not a departure, and names the trip's destination
+    order = np.lexsort((sequences, trips))
+    is_last = np.ones(len(order), dtype=bool)
+    is_last[:-1] = trips[order][1:] != trips[order][:-1]
+    terminus = np.zeros(len(order), dtype=bool)
+    terminus[order[is_last]] = True
+    for trip, stop in zip(trips[order[is_last]], stops[order[is_last]]):
+        if not trip_headsigns[trip]:
+            trip_headsigns[trip] = stop_names[stop][:48]
+
+    keep = ~(terminus | no_pickup)
+    stops, times, trips = stops[keep], times[keep], trips[keep]
+
+    order = np.lexsort((times, stops))
+    stops, times, trips = stops[order], times[order], trips[order]
+    offsets = np.searchsorted(stops, np.arange(len(stop_names) + 1), side="left")
+
+    key_items = sorted(stop_keys.items())
+    exceptions.sort()
+    columns = {
+        "stop_keys": np.array([key for (key, _) in key_items], dtype="S16"),
+        "stop_key_rows": np.array([row for (_, row) in key_items], dtype=np.uint32),
+        "stop_names": np.array(stop_names, dtype="S64"),
+        "stop_offsets": offsets.astype(np.int64),
+        "departure_times": times,
+        "departure_trips": trips,
+        "trip_routes": np.frombuffer(trip_routes, dtype=np.uint32),
+        "trip_services": np.frombuffer(trip_services, dtype=np.uint32),
+        "trip_headsigns": np.array(trip_headsigns, dtype="S48"),
+        "route_names": np.array(route_names, dtype="S16"),
+        "service_days": np.array(service_days, dtype=np.uint8),
+        "service_starts": np.array(service_starts, dtype=np.int32),
+        "service_ends": np.array(service_ends, dtype=np.int32),
+        "exception_dates": np.array([date for (date, _, _) in exceptions], dtype=np.int32),
+        "exception_services": np.array([service for (_, service, _) in exceptions],
+                                       dtype=np.uint32),
+        "exception_types": np.array([kind for (_, _, kind) in exceptions], dtype=np.uint8),
+    }
+
+    os.makedirs(output, exist_ok=True)
+    for name, column in columns.items():
+        np.save(os.path.join(output, f"{name}.npy"), column)
+
+    info = {"imported": time.time(), "stops": len(stop_names), "trips": len(trip_routes),
+            "departures": len(times)}
+    with open(os.path.join(output, "feed.json"), "w") as f:
+        json.dump(info, f)
+
+    return info
+
+
+class TimetableManager(object):
+    """
+    Holds the current offline timetable, and re-imports it from its feed once a day.
+    """
+
+    def __init__(self, sessions: SessionPool, *, path: str = "data/location/gtfs",
+                 url: str = None, hour: int = 3):
+        """
+        :param sessions: The :class:`.SessionPool` to download feeds with.
+        :param path: The directory of the timetable.
+        :param url: The URL of the GTFS feed to refresh from. If this is None, the timetable is
+            never refreshed.
+        :param hour: The hour of the day (UTC) to refresh the timetable at.
+        """
+        self.sessions = sessions
+        self.path = path
+        self.url = url
+        self.hour = hour
+
+        #: The current timetable, if one has been imported.
+        self.timetable = Timetable.load(path)
+
+        self._task = None  # type: curio.Task
+
+    async def _download(self, destination: str):
+        response = await self.sessions.get(self.url, stream=True, timeout=600)
+        if response.status_code != 200:
+            raise ValueError(f"Feed download failed with HTTP {response.status_code}")
+
+        async with curio.aopen(destination, "wb") as f:
+            async with response.body:
+                async for chunk in response.body:
+                    await f.write(chunk)
+
+    @async_thread
+    def _import(self, feed_path: str) -> Dict[str, int]:
+        parent = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=parent, prefix=".gtfs-")
+        try:
+            info = import_feed(feed_path, staging)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        # swap the new timetable in; the old files stay mapped until nothing references them
+        old = None
+        if os.path.exists(self.path):
+            old = staging + ".old"
+            os.rename(self.path, old)
+        os.rename(staging, self.path)
+        if old is not None:
+            shutil.rmtree(old, ignore_errors=True)
+
+        return info
+
+    async def refresh(self) -> Dict[str, int]:
+        """
+        Downloads and imports the feed, replacing the current timetable.
+        """
+        fd, feed_path = tempfile.mkstemp(suffix=".zip")
+        os.close(fd)
+        try:
+            await self._download(feed_path)
+            info = await self._import(feed_path)
+        finally:
+            os.remove(feed_path)
+
+        self.timetable = Timetable.load(self.path)
+        logger.info(f"Imported a timetable with {info['departures']} departures.")
+        return info
+
+    def seconds_until_next_run(self, now: datetime.datetime) -> float:
+        """
+        Gets the number of seconds until the timetable is next refreshed.
+
+        :param now: The current UTC time.
+        """
+        next_run = now.replace(hour=self.hour, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += datetime.timedelta(days=1)
+
+        return (next_run - now).total_seconds()
+
+    async def _run(self):
+        while True:
+            await curio.sleep(self.seconds_until_next_run(datetime.datetime.utcnow()))
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh the timetable")
+
+    async def start(self):
+        """
+        Starts refreshing the timetable, if there is a feed URL.
+        """
+        if self.url is not None and self._task is None:
+            self._task = await curio.spawn(self._run, daemon=True)
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command(name="import-gtfs")
+@click.argument("feed", type=click.Path(exists=True, dir_okay=False))
+@click.option("--output", default="data/location/gtfs",
+              help="The directory to write the timetable to.")
+def import_gtfs(feed: str, output: str):
+    """
+    Imports a GTFS feed zip file.
+    """
+    info = import_feed(feed, output)
+    click.echo(f"Imported {info['departures']} departures from {info['stops']} stops on "
+               f"{info['trips']} trips.")
+
+
+if __name__ == "__main__":
+    cli()
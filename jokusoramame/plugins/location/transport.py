@@ -0,0 +1,160 @@
+"""
+TransportAPI quota tracking and live departure caching.
+"""
+import datetime
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+import curio
+import logbook
+from lru import LRU
+
+from jokusoramame.breakers import UpstreamError
+from jokusoramame.redis import RedisInterface
+from jokusoramame.singleflight import SingleFlight
+
+logger = logbook.Logger("Jokusoramame.transport")
+
+
+class QuotaExhausted(UpstreamError):
+    """
+    Raised when a call would go over the daily quota of an API.
+    """
+
+    def __init__(self, upstream: str, quota: int):
+        super().__init__(upstream, f"The daily {upstream} quota is used up, try again tomorrow")
+
+        #: The daily quota.
+        self.quota = quota
+
+
+class DailyQuota(object):
+    """
+    Tracks the calls made to an API against its daily quota, in Redis.
+
+    Calls are counted per UTC day, so every process shares one budget.
+    """
+
+    def __init__(self, redis: RedisInterface, api: str, *, limit: int = 1000,
+                 warn_at: float = 0.8):
+        """
+        :param redis: The :class:`.RedisInterface` to count calls in.
+        :param api: The name of the API.
+        :param limit: The number of calls allowed per day.
+        :param warn_at: The fraction of the quota to warn at.
+        """
+        self.redis = redis
+        self.api = api
+        self.limit = limit
+        self.warn_at = warn_at
+
+        self._warned = None  # type: str
+
+    @staticmethod
+    def today() -> str:
+        return datetime.datetime.utcnow().date().isoformat()
+
+    async def spend(self):
+        """
+        Counts a call against the quota.
+
+        :raises QuotaExhausted: If the quota is already used up.
+        """
+        day = self.today()
+        used = await self.redis.incr_api_usage(self.api, day)
+        if used > self.limit:
+            raise QuotaExhausted(self.api, self.limit)
+
+        if used >= self.limit * self.warn_at and self._warned != day:
+            self._warned = day
+            logger.warning(f"{self.api} has used {used} of its {self.limit} calls today.")
+
+    async def used(self) -> int:
+        """
+        :return: The number of calls made today.
+        """
+        return await self.redis.get_api_usage(self.api, self.today())
+
+    async def is_low(self) -> bool:
+        """
+        :return: If the quota is close to being used up.
+        """
+        return await self.used() >= self.limit * self.warn_at
+
+
+class DepartureCache(object):
+    """
+    A short-lived cache of live departure boards, keyed by stop.
+
+    Boards younger than the TTL are served as-is. Older boards, up to the stale TTL, are still
+    served immediately, but are refreshed in the background so that the next lookup gets a new
+    one. Concurrent refreshes of the same stop share one request.
+    """
+
+    def __init__(self, *, ttl: float = 45, stale_ttl: float = 300, max_items: int = 1024):
+        """
+        :param ttl: The number of seconds a board is fresh for.
+        :param stale_ttl: The number of seconds a board can be served for while it is refreshed.
+        :param max_items: The maximum number of boards to keep.
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.boards = LRU(max_items)
+        self.flights = SingleFlight()
+
+        #: The number of lookups that were fresh, stale, or missed.
+        self.stats = Counter()
+
+    async def _refresh(self, key: str, fetch: Callable[..., Awaitable[Optional[Any]]],
+                       *args) -> Optional[Any]:
+        board = await fetch(*args)
+        # errors and unavailable boards aren't cached, so the next lookup tries again
+        if board is not None and "error" not in board:
+            self.boards[key] = (time.monotonic(), board)
+
+        return board
+
+    async def _revalidate(self, key: str, fetch: Callable[..., Awaitable[Optional[Any]]], *args):
+        try:
+            await self.flights.do(key, self._refresh, key, fetch, *args)
+        except Exception:
+            logger.exception(f"Failed to refresh the departures for {key}")
+
+    async def get(self, key: str, fetch: Callable[..., Awaitable[Optional[Any]]],
+                  *args) -> Tuple[Optional[Any], float]:
+        """
+        Gets a departure board.
+
+        :param key: The key of the stop, e.g. ``bus:<ATCO>`` or ``train:<CRS>``.
+        :param fetch: A coroutine function that gets the live board, or None if it is unavailable.
+        :param args: The arguments to the function.
+        :return: A tuple of (board, age in seconds). The board is None if it is unavailable.
+        """
+        cached = self.boards.get(key)
+        if cached is not None:
+            fetched_at, board = cached
+            age = time.monotonic() - fetched_at
+            if age < self.ttl:
+                self.stats["fresh"] += 1
+                return board, age
+
+            if age < self.stale_ttl:
+                self.stats["stale"] += 1
+                await curio.spawn(self._revalidate, key, fetch, *args, daemon=True)
+                return board, age
+
+        self.stats["miss"] += 1
+        board = await self.flights.do(key, self._refresh, key, fetch, *args)
+        return board, 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        :return: The fraction of lookups answered from the cache.
+        """
+        total = sum(self.stats.values())
+        if not total:
+            return 0.0
+
+        return (self.stats["fresh"] + self.stats["stale"]) / total
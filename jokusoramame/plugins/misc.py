@@ -11,6 +11,7 @@ from curious.commands.decorators import autoplugin, ratelimit
 from yapf.yapflib.style import CreatePEP8Style
 from yapf.yapflib.yapf_api import FormatCode
 
+from jokusoramame.cache import make_key
 from jokusoramame.utils import rgbize
 
 code_regexp = re.compile(r"```([^\n]+)\n?(.+)\n?```", re.DOTALL)
@@ -161,24 +162,36 @@ class Misc(Plugin):
         Shows a palette plot.
         """
         pal_colours = rgbize(colours[:12])
+        cache = ctx.bot.render_cache
+        light_key = make_key("palette", "light", pal_colours)
+        dark_key = make_key("palette", "dark_background", pal_colours)
 
         @async_thread
-        def plot_palette() -> Awaitable[BytesIO]:
+        def plot_palette() -> Awaitable[bytes]:
+            data = cache.get(light_key)
+            if data is not None:
+                return data
+
             with ctx.bot._plot_lock:
                 sns.palplot(pal_colours, size=1)
                 plt.tight_layout()  # remove useless padding
 
                 buf = BytesIO()
                 plt.savefig(buf, format="png")
-                buf.seek(0)
 
                 plt.clf()
                 plt.cla()
 
-                return buf
+            data = buf.getvalue()
+            cache.put(light_key, data)
+            return data
 
         @async_thread()
-        def plot_dark_palette() -> Awaitable[BytesIO]:
+        def plot_dark_palette() -> Awaitable[bytes]:
+            data = cache.get(dark_key)
+            if data is not None:
+                return data
+
             with ctx.bot._plot_lock:
                 with plt.style.context("dark_background"):
                     sns.palplot(pal_colours, size=1)
@@ -186,22 +199,24 @@ class Misc(Plugin):
 
                     buf = BytesIO()
                     plt.savefig(buf, format="png")
-                    buf.seek(0)
 
                     plt.clf()
                     plt.cla()
 
-                return buf
+            data = buf.getvalue()
+            cache.put(dark_key, data)
+            return data
 
-        if ctx.bot._plot_lock.locked():
+        cached = light_key in cache and dark_key in cache
+        if not cached and ctx.bot._plot_lock.locked():
             await ctx.channel.messages.send("Waiting for plot lock...")
 
         async with ctx.channel.typing:
-            buf = await plot_palette()
-            buf2 = await plot_dark_palette()
+            data = await plot_palette()
+            data2 = await plot_dark_palette()
 
-        await ctx.channel.messages.upload(fp=buf.read(), filename="plot.png")
-        await ctx.channel.messages.upload(fp=buf2, filename="plot_dark.png")
+        await ctx.channel.messages.upload(fp=data, filename="plot.png")
+        await ctx.channel.messages.upload(fp=data2, filename="plot_dark.png")
 
     def _normalize_language(self, lang: str) -> str:
         """
@@ -5,6 +5,7 @@ import zlib
 
 import json
 import redis
+from typing import Dict, List, Set, Tuple
 from curio.thread import async_thread
 from curious import Guild, Message, User
 
@@ -48,30 +49,39 @@ class RedisInterface(object):
         Adds a message to Redis, for usage in analysis.
 
         :param message: The :class:`.Message` to add.
+        :return: If the message was stored.
         """
 
         enabled = self.redis.get(f"analytics_enabled_{message.guild_id}")
         if enabled is None:
-            return
+            return False
 
         allowed = self.redis.get(f"analytics_flag_{message.author.user.id}")
         if allowed is not None:
-            return
+            return False
 
         key = f"messages_{message.author_id}"
+        timestamp = message.created_at.timestamp()
         body = json.dumps({
             "c": message.content,
-            "dt": message.created_at.timestamp(),
+            "dt": timestamp,
             "ch": message.channel_id
         })
         compressed = zlib.compress(body.encode())
 
+        # hours since monday 00:00; the epoch was a thursday
+        hour_of_week = (int(timestamp) // 3600 + 72) % 168
+
         pipeline = self.redis.pipeline()
         with pipeline:
             pipeline.lpush(key, compressed)
             pipeline.ltrim(key, 0, 5000)
+            pipeline.hincrby(f"heatmap_{message.guild_id}",
+                             f"{message.channel_id}:{hour_of_week}", 1)
             pipeline.execute()
 
+        return True
+
     @async_thread
     def get_messages(self, user: User):
         """
@@ -85,3 +95,237 @@ class RedisInterface(object):
         results = self.redis.lrange(key, 0, 5000)
         results = [json.loads(zlib.decompress(i).decode()) for i in results]
         return results
+
+    @async_thread
+    def get_cached_response(self, key: str):
+        """
+        Gets a cached API response.
+        """
+        return self.redis.get(f"response_cache_{key}")
+
+    @async_thread
+    def set_cached_response(self, key: str, content: bytes, ttl: int):
+        """
+        Caches an API response for ``ttl`` seconds.
+        """
+        self.redis.setex(f"response_cache_{key}", ttl, content)
+
+    @async_thread
+    def get_message_range(self, user: User, start: int, stop: int):
+        """
+        Gets a range of the raw, compressed messages for a user, newest first.
+        """
+        allowed = self.redis.get(f"analytics_flag_{user.id}")
+        if allowed is not None:
+            return self.FLAGGED
+
+        return self.redis.lrange(f"messages_{user.id}", start, stop)
+
+    async def iter_messages(self, user: User, batch_size: int = 250):
+        """
+        Lazily iterates over the messages for a user, newest first.
+
+        Messages are fetched from Redis in batches and only decoded when reached, so stopping early
+        avoids fetching and decoding the rest.
+        """
+        start = 0
+        while start <= 5000:
+            batch = await self.get_message_range(user, start, min(start + batch_size - 1, 5000))
+            if batch is self.FLAGGED or not batch:
+                return
+
+            for item in batch:
+                yield json.loads(zlib.decompress(item).decode())
+
+            if len(batch) < batch_size:
+                return
+
+            start += batch_size
+
+    @async_thread
+    def update_activity(self, message: Message):
+        """
+        Updates the activity index for the author of a message.
+
+        This is kept for every guild, regardless of if analytics are enabled.
+        """
+        if message.guild_id is None:
+            return
+
+        if self.redis.get(f"analytics_flag_{message.author_id}") is not None:
+            return
+
+        field = str(message.author_id)
+        pipeline = self.redis.pipeline()
+        with pipeline:
+            pipeline.hset(f"activity_last_{message.guild_id}", field,
+                          message.created_at.timestamp())
+            pipeline.hincrby(f"activity_count_{message.guild_id}", field, 1)
+            pipeline.execute()
+
+    @async_thread
+    def get_heatmap(self, guild: Guild) -> Dict[Tuple[int, int], int]:
+        """
+        Gets the message counters for a guild.
+
+        :return: A mapping of (channel ID, hour of the week) -> message count. Hours of the week
+            start at Monday 00:00 UTC.
+        """
+        counters = {}
+        for field, count in self.redis.hgetall(f"heatmap_{guild.id}").items():
+            channel_id, hour = field.decode().split(":")
+            counters[int(channel_id), int(hour)] = int(count)
+
+        return counters
+
+    @async_thread
+    def get_activity_index(self, guild: Guild) -> Dict[int, Tuple[float, int]]:
+        """
+        Gets the activity index for a guild.
+
+        :return: A mapping of user ID -> (last post timestamp, post count).
+        """
+        pipeline = self.redis.pipeline()
+        with pipeline:
+            pipeline.hgetall(f"activity_last_{guild.id}")
+            pipeline.hgetall(f"activity_count_{guild.id}")
+            last_posts, counts = pipeline.execute()
+
+        return {int(user_id): (float(last_post), int(counts.get(user_id, 0)))
+                for (user_id, last_post) in last_posts.items()}
+
+    @async_thread
+    def is_activity_index_complete(self, guild: Guild) -> bool:
+        """
+        Checks if the activity index for a guild has been backfilled.
+
+        Until it has, members who only posted before the index existed look like they never posted.
+        """
+        return self.redis.exists(f"activity_backfilled_{guild.id}") > 0
+
+    @async_thread
+    def backfill_activity_index(self, guild: Guild, user_ids: List[int],
+                                batch_size: int = 500):
+        """
+        Backfills the activity index for a guild from the stored messages of its members.
+
+        Only the newest entry and the length of each message list are read. Message lists are per
+        user rather than per guild, so this can overestimate activity, but never underestimates
+        it. Entries already in the index are only ever moved forward.
+
+        :param user_ids: The IDs of the members to backfill. Members who have opted out of
+            analytics should not be included.
+        """
+        last_key, count_key = f"activity_last_{guild.id}", f"activity_count_{guild.id}"
+
+        for start in range(0, len(user_ids), batch_size):
+            batch = [str(user_id) for user_id in user_ids[start:start + batch_size]]
+
+            pipeline = self.redis.pipeline()
+            with pipeline:
+                for user_id in batch:
+                    pipeline.lindex(f"messages_{user_id}", 0)
+                    pipeline.llen(f"messages_{user_id}")
+                pipeline.hmget(last_key, batch)
+                pipeline.hmget(count_key, batch)
+                *results, last_posts, counts = pipeline.execute()
+
+            pipeline = self.redis.pipeline()
+            with pipeline:
+                for i, user_id in enumerate(batch):
+                    newest, length = results[i * 2], results[i * 2 + 1]
+                    if newest is None:
+                        continue
+
+                    newest = json.loads(zlib.decompress(newest).decode())["dt"]
+                    if last_posts[i] is None or float(last_posts[i]) < newest:
+                        pipeline.hset(last_key, user_id, newest)
+
+                    if counts[i] is None or int(counts[i]) < length:
+                        pipeline.hset(count_key, user_id, length)
+
+                pipeline.execute()
+
+        self.redis.set(f"activity_backfilled_{guild.id}", "true")
+
+    @async_thread
+    def get_flagged(self, user_ids: List[int]) -> Set[int]:
+        """
+        Gets which of the specified users have opted out of analytics.
+        """
+        if not user_ids:
+            return set()
+
+        flags = self.redis.mget([f"analytics_flag_{user_id}" for user_id in user_ids])
+        return {user_id for (user_id, flag) in zip(user_ids, flags) if flag is not None}
+
+    @async_thread
+    def get_bulk_checkpoint(self, job_id: str) -> Set[int]:
+        """
+        Gets the IDs of the members that a bulk job has already processed.
+        """
+        return {int(member_id) for member_id in self.redis.smembers(f"bulk_done_{job_id}")}
+
+    @async_thread
+    def add_bulk_checkpoint(self, job_id: str, member_id: int):
+        """
+        Marks a member as processed by a bulk job. Checkpoints expire after a day.
+        """
+        key = f"bulk_done_{job_id}"
+        pipeline = self.redis.pipeline()
+        with pipeline:
+            pipeline.sadd(key, member_id)
+            pipeline.expire(key, 86_400)
+            pipeline.execute()
+
+    @async_thread
+    def clear_bulk_checkpoint(self, job_id: str):
+        """
+        Clears the checkpoint of a finished bulk job.
+        """
+        self.redis.delete(f"bulk_done_{job_id}")
+
+    @async_thread
+    def is_analytics_enabled(self, guild: Guild) -> bool:
+        """
+        Checks if analytics are enabled for a guild.
+        """
+        return self.redis.get(f"analytics_enabled_{guild.id}") is not None
+
+    @async_thread
+    def get_snapshot(self, guild: Guild):
+        """
+        Gets the latest encoded analytics snapshot for a guild.
+        """
+        return self.redis.get(f"snapshot_{guild.id}")
+
+    @async_thread
+    def set_snapshot(self, guild: Guild, data: bytes, ttl: int):
+        """
+        Stores an encoded analytics snapshot for a guild.
+        """
+        self.redis.set(f"snapshot_{guild.id}", data, ex=ttl)
+
+    @async_thread
+    def incr_api_usage(self, api: str, day: str) -> int:
+        """
+        Counts a call to an external API against its daily usage.
+
+        :param day: The day to count against, as an ISO date.
+        :return: The number of calls made on that day, including this one.
+        """
+        key = f"api_usage_{api}_{day}"
+        pipeline = self.redis.pipeline()
+        with pipeline:
+            pipeline.incr(key)
+            pipeline.expire(key, 172_800)
+            used, _ = pipeline.execute()
+
+        return used
+
+    @async_thread
+    def get_api_usage(self, api: str, day: str) -> int:
+        """
+        Gets the number of calls made to an external API on a day.
+        """
+        return int(self.redis.get(f"api_usage_{api}_{day}") or 0)
@@ -0,0 +1,128 @@
+"""
+Sampling utilities for approximate analytics.
+"""
+import math
+import random
+from typing import Iterable, List, Tuple, TypeVar
+
+import numpy as np
+
+T = TypeVar("T")
+
+#: The z-score of a 95% confidence interval.
+Z_95 = 1.96
+
+
+def reservoir_sample(iterable: Iterable[T], k: int, seed: int) -> List[T]:
+    """
+    Takes a uniform random sample of k items from an iterable, in a single pass (Algorithm R).
+
+    The same seed over the same items always produces the same sample.
+
+    :param iterable: The items to sample from.
+    :param k: The size of the sample.
+    :param seed: The seed for the random number generator.
+    :return: The sample. This is every item if there are k items or fewer.
+    """
+    rng = random.Random(seed)
+    reservoir = []
+    for i, item in enumerate(iterable):
+        if i < k:
+            reservoir.append(item)
+        else:
+            j = rng.randint(0, i)
+            if j < k:
+                reservoir[j] = item
+
+    return reservoir
+
+
+def mean_interval(values: np.ndarray, population: int = None,
+                  z: float = Z_95) -> Tuple[float, float]:
+    """
+    Estimates a mean from a sample, with a confidence interval.
+
+    :param values: The sampled values.
+    :param population: The size of the population, if known. This applies the finite population
+        correction, so that a sample of the whole population has no uncertainty.
+    :param z: The z-score of the confidence level.
+    :return: A tuple of (mean, half-width of the interval). The half-width is NaN if there are
+        too few values to estimate it.
+    """
+    n = len(values)
+    if n == 0:
+        return math.nan, math.nan
+
+    mean = float(np.mean(values))
+    if n == 1:
+        # one value has no spread to estimate an interval from, unless it is the whole population
+        return mean, 0.0 if population == 1 else math.nan
+
+    error = float(np.std(values, ddof=1)) / math.sqrt(n)
+    if population is not None and population > 1:
+        error *= math.sqrt(max(population - n, 0) / (population - 1))
+
+    return mean, z * error
+
+
+def total_interval(values: np.ndarray, population: int,
+                   z: float = Z_95) -> Tuple[float, float]:
+    """
+    Estimates a population total from a sample, with a confidence interval.
+
+    :return: A tuple of (total, half-width of the interval).
+    """
+    mean, error = mean_interval(values, population, z)
+    return mean * population, error * population
+
+
+def format_interval(value: float, error: float, spec: str = ".2f") -> str:
+    """
+    Formats a value with its confidence interval. The interval is left out if it is unknown.
+    """
+    if not math.isfinite(error) or error == 0:
+        return format(value, spec)
+
+    return f"{format(value, spec)} ± {format(error, spec)}"
+
+
+class SampleSizer(object):
+    """
+    Chooses sample sizes that meet a latency target.
+
+    The cost of each sampled item is measured as samples are analysed, and the sample size is the
+    number of items that fit in the target at that cost.
+    """
+
+    def __init__(self, target: float = 1.0, min_size: int = 30, max_size: int = 5000,
+                 initial_cost: float = 0.005, smoothing: float = 0.3):
+        """
+        :param target: The latency target, in seconds.
+        :param min_size: The minimum sample size.
+        :param max_size: The maximum sample size.
+        :param initial_cost: The assumed cost per item, in seconds, before any are measured.
+        :param smoothing: The weight of each new measurement in the moving average of the cost.
+        """
+        self.target = target
+        self.min_size = min_size
+        self.max_size = max_size
+        self.smoothing = smoothing
+
+        #: The moving average of the cost per item, in seconds.
+        self.cost = initial_cost
+
+    def size(self) -> int:
+        """
+        :return: The sample size to use.
+        """
+        return max(self.min_size, min(self.max_size, int(self.target / self.cost)))
+
+    def observe(self, items: int, seconds: float):
+        """
+        Records how long a sample took to analyse.
+        """
+        if items <= 0:
+            return
+
+        cost = seconds / items
+        self.cost = self.smoothing * cost + (1 - self.smoothing) * self.cost
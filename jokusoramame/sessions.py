@@ -0,0 +1,148 @@
+"""
+Pooled HTTP sessions for outbound API traffic.
+"""
+import collections
+import json
+from typing import Dict
+from urllib.parse import urlsplit
+
+import asks
+from asks.response_objects import Response
+
+from jokusoramame import USER_AGENT
+from jokusoramame.breakers import BreakerRegistry
+from jokusoramame.cache import make_key
+from jokusoramame.singleflight import SingleFlight
+
+
+class _MeteredSession(asks.Session):
+    """
+    An :class:`asks.Session` that counts the connections it opens.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        #: The number of new connections made by this session.
+        self.connections_made = 0
+
+    async def _make_connection(self, *args, **kwargs):
+        self.connections_made += 1
+        return await super()._make_connection(*args, **kwargs)
+
+
+def _is_server_error(response: Response) -> bool:
+    return response.status_code >= 500 or response.status_code == 429
+
+
+class SessionPool(object):
+    """
+    A registry of persistent, per-host HTTP sessions.
+
+    Each host gets its own :class:`asks.Session`, so that connections are kept alive between
+    requests and the number of connections to any one host is limited.
+    """
+
+    def __init__(self, breakers: BreakerRegistry = None, *, connections: int = 10,
+                 timeout: float = 30, headers: Dict[str, str] = None):
+        """
+        :param breakers: The :class:`.BreakerRegistry` used for requests to named upstreams.
+        :param connections: The maximum number of connections per host.
+        :param timeout: The default timeout of a request, in seconds.
+        :param headers: Extra default headers to send with every request.
+        """
+        self.breakers = breakers or BreakerRegistry()
+        self.connections = connections
+        self.timeout = timeout
+        self.headers = {"User-Agent": USER_AGENT, **(headers or {})}
+
+        #: The sessions for each host.
+        self.sessions = {}  # type: Dict[str, _MeteredSession]
+
+        #: The number of requests made, by host.
+        self.requests = collections.Counter()
+
+        #: The number of requests that failed without a response, by host.
+        self.errors = collections.Counter()
+
+        #: The single-flight group used for coalescing identical requests.
+        self.flights = SingleFlight()
+
+    def get_session(self, uri: str) -> asks.Session:
+        """
+        Gets the session for the host of the specified URI, creating it if needed.
+        """
+        parts = urlsplit(uri)
+        host = f"{parts.scheme}://{parts.netloc}"
+        try:
+            return self.sessions[host]
+        except KeyError:
+            session = _MeteredSession(headers=self.headers, connections=self.connections)
+            self.sessions[host] = session
+            return session
+
+    @staticmethod
+    def fingerprint(method: str, uri: str, kwargs: dict) -> str:
+        """
+        Gets the fingerprint of a request, used to find identical requests.
+        """
+        body = json.dumps(kwargs, sort_keys=True, default=repr)
+        return make_key(method.upper(), uri, body)
+
+    async def request(self, method: str, uri: str, *, coalesce: bool = False,
+                      upstream: str = None, **kwargs) -> Response:
+        """
+        Makes a request using the session for the URI's host.
+
+        :param method: The HTTP method to use.
+        :param uri: The URI to request.
+        :param coalesce: If True, this request will share the response of an identical request
+            that is already in flight.
+        :param upstream: The name of the upstream API, if any. Requests to an upstream go through
+            its circuit breaker, and server errors count against it.
+        :param kwargs: Any extra arguments to pass to asks.
+        """
+        if coalesce:
+            key = self.fingerprint(method, uri, kwargs)
+            return await self.flights.do(key, self.request, method, uri, upstream=upstream,
+                                         **kwargs)
+
+        if upstream is not None:
+            breaker = self.breakers.get(upstream)
+            return await breaker.call(self.request, method, uri, failed=_is_server_error,
+                                      **kwargs)
+
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlsplit(uri).netloc
+        session = self.get_session(uri)
+
+        self.requests[host] += 1
+        try:
+            return await session.request(method, uri, **kwargs)
+        except Exception:
+            self.errors[host] += 1
+            raise
+
+    async def get(self, uri: str, **kwargs) -> Response:
+        return await self.request("GET", uri, **kwargs)
+
+    async def post(self, uri: str, **kwargs) -> Response:
+        return await self.request("POST", uri, **kwargs)
+
+    def get_stats(self) -> Dict[str, dict]:
+        """
+        Gets connection reuse statistics, by host.
+        """
+        stats = {}
+        for host, session in self.sessions.items():
+            netloc = urlsplit(host).netloc
+            requests = self.requests[netloc]
+            made = session.connections_made
+            stats[netloc] = {
+                "requests": requests,
+                "connections": made,
+                "reused": max(requests - made, 0),
+                "errors": self.errors[netloc],
+            }
+
+        return stats
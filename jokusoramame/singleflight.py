@@ -0,0 +1,78 @@
+"""
+Single-flight coalescing of identical concurrent calls.
+"""
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+import curio
+
+
+class _Flight(object):
+    """
+    Represents a call that is currently in flight.
+    """
+
+    def __init__(self, task: curio.Task):
+        #: The task running the call.
+        self.task = task
+
+        #: The number of callers waiting on the task.
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls with the same key into one shared task.
+
+    The first caller for a key spawns the task; any caller that arrives while it is still running
+    waits on the same task and gets the same result. A cancelled caller only stops waiting - the
+    shared task is only cancelled once every caller waiting on it has left.
+    """
+
+    def __init__(self):
+        self._flights = {}  # type: Dict[Hashable, _Flight]
+
+        #: The number of calls that were coalesced into an existing flight.
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def _run(self, key: Hashable, func: Callable[..., Awaitable[Any]], args, kwargs):
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            # new callers after this point get a fresh flight
+            flight = self._flights.get(key)
+            if flight is not None and flight.task is await curio.current_task():
+                del self._flights[key]
+
+    async def do(self, key: Hashable, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Calls ``func(*args, **kwargs)``, or joins an identical call already in flight.
+
+        :param key: The key that identifies identical calls.
+        :param func: The coroutine function to call.
+        :return: The result of the call.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            task = await curio.spawn(self._run, key, func, args, kwargs,
+                                     daemon=True, report_crash=False)
+            flight = _Flight(task)
+            self._flights[key] = flight
+        else:
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            return await flight.task.join()
+        except curio.TaskError as e:
+            raise e.__cause__ from None
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.terminated:
+                # everybody left, so nobody wants the result any more
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+                await flight.task.cancel()
@@ -0,0 +1,269 @@
+"""
+Mergeable quantile sketches.
+"""
+import json
+import math
+import random
+import socket
+import time
+from typing import Dict, List, Sequence, Tuple
+
+from curio.thread import async_thread
+
+from jokusoramame.redis import RedisInterface
+
+
+class KLLSketch(object):
+    """
+    A KLL quantile sketch.
+
+    Values are kept in a stack of compactors. Values at level ``h`` each stand for ``2 ** h``
+    original values. When a compactor is full, it is sorted, and every other value is promoted to
+    the next level. Lower levels get exponentially smaller capacities, so the sketch stays at
+    roughly ``3k`` values no matter how many are added, and sketches of disjoint data can be merged
+    into a sketch of their union.
+    """
+
+    def __init__(self, k: int = 200):
+        """
+        :param k: The capacity of the top compactor. Larger values are more accurate.
+        """
+        self.k = k
+
+        #: The number of values added to this sketch.
+        self.n = 0
+
+        #: The smallest and largest values added to this sketch.
+        self.min = math.inf
+        self.max = -math.inf
+
+        self.levels = [[]]  # type: List[List[float]]
+
+    def __len__(self) -> int:
+        return self.n
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(int(math.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) >= self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append([])
+
+                items = sorted(self.levels[level])
+                # an odd value out stays at this level, so no weight is lost
+                keep = [items.pop()] if len(items) % 2 else []
+                self.levels[level + 1].extend(items[random.randint(0, 1)::2])
+                self.levels[level] = keep
+
+            level += 1
+
+    def update(self, value: float):
+        """
+        Adds a value to this sketch.
+        """
+        value = float(value)
+        self.levels[0].append(value)
+        self.n += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+        if len(self.levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def merge(self, other: 'KLLSketch'):
+        """
+        Merges another sketch into this one.
+        """
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+
+    def _weighted(self) -> Tuple[List[float], List[int]]:
+        items = sorted((value, 2 ** level) for (level, values) in enumerate(self.levels)
+                       for value in values)
+        values = []
+        cumulative = []
+        total = 0
+        for value, weight in items:
+            total += weight
+            values.append(value)
+            cumulative.append(total)
+
+        return values, cumulative
+
+    def quantiles(self, qs: Sequence[float]) -> List[float]:
+        """
+        Estimates some quantiles of the values added to this sketch.
+
+        :param qs: The quantiles to estimate, between 0 and 1.
+        """
+        if self.n == 0:
+            return [math.nan] * len(qs)
+
+        values, cumulative = self._weighted()
+        total = cumulative[-1]
+        results = []
+        for q in qs:
+            if q <= 0:
+                results.append(self.min)
+                continue
+            if q >= 1:
+                results.append(self.max)
+                continue
+
+            target = q * total
+            index = next(i for (i, weight) in enumerate(cumulative) if weight >= target)
+            results.append(values[index])
+
+        return results
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile of the values added to this sketch.
+        """
+        return self.quantiles([q])[0]
+
+    def to_bytes(self) -> bytes:
+        return json.dumps({"k": self.k, "n": self.n, "min": self.min, "max": self.max,
+                           "levels": self.levels}).encode()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'KLLSketch':
+        loaded = json.loads(data.decode())
+        sketch = cls(loaded["k"])
+        sketch.n = loaded["n"]
+        sketch.min = loaded["min"]
+        sketch.max = loaded["max"]
+        sketch.levels = loaded["levels"]
+        return sketch
+
+
+class SketchStore(object):
+    """
+    Keeps per-guild sketches, persisted in Redis.
+
+    Every process updates its own sketches in memory, and periodically writes them to its own field
+    of a Redis hash. Reads merge every process's field, so no process ever overwrites another's
+    data.
+    """
+
+    def __init__(self, redis: RedisInterface, *, shard: str = None, k: int = 200,
+                 flush_interval: float = 60.0):
+        """
+        :param redis: The :class:`.RedisInterface` to store sketches in.
+        :param shard: The name of this process's field. This must be unique to this process, and
+            stable across restarts. If this is not set, it is picked by :meth:`.bind`.
+        :param k: The accuracy parameter of new sketches.
+        :param flush_interval: The number of seconds between writes to Redis.
+        """
+        self.redis = redis.redis
+        self.shard = shard
+        self.k = k
+        self.flush_interval = flush_interval
+
+        self._sketches = {}  # type: Dict[str, KLLSketch]
+        self._dirty = set()
+        self._last_flush = time.monotonic()
+
+    def bind(self, user_id: int):
+        """
+        Picks the name of this process's field, if it wasn't configured.
+
+        The default is the hostname and the bot's user ID, so that different bots on one host
+        don't share a field. Every shard runs in this one process and shares this store, so the
+        shards don't need fields of their own.
+
+        This must be called before the first update.
+
+        :param user_id: The ID of the bot user.
+        """
+        if self.shard is not None:
+            return
+
+        self.shard = f"{socket.gethostname()}:{user_id}"
+
+    @staticmethod
+    def key(guild_id: int, metric: str) -> str:
+        return f"sketch_{guild_id}_{metric}"
+
+    @async_thread
+    def _load_own(self, key: str) -> KLLSketch:
+        data = self.redis.hget(key, self.shard)
+        if data is None:
+            return KLLSketch(self.k)
+
+        return KLLSketch.from_bytes(data)
+
+    @async_thread
+    def _write(self, sketches: Dict[str, bytes]):
+        pipeline = self.redis.pipeline()
+        with pipeline:
+            for key, data in sketches.items():
+                pipeline.hset(key, self.shard, data)
+
+            pipeline.execute()
+
+    @async_thread
+    def _load_all(self, key: str) -> Dict[bytes, bytes]:
+        return self.redis.hgetall(key)
+
+    async def update(self, guild_id: int, values: Dict[str, float]):
+        """
+        Adds values to the sketches of a guild.
+
+        :param guild_id: The ID of the guild.
+        :param values: A dict of metric -> value.
+        """
+        for metric, value in values.items():
+            key = self.key(guild_id, metric)
+            sketch = self._sketches.get(key)
+            if sketch is None:
+                # carry on from what this process stored before it was restarted
+                sketch = await self._load_own(key)
+                sketch = self._sketches.setdefault(key, sketch)
+
+            sketch.update(value)
+            self._dirty.add(key)
+
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            await self.flush()
+
+    async def flush(self):
+        """
+        Writes every changed sketch to Redis.
+        """
+        self._last_flush = time.monotonic()
+        if not self._dirty:
+            return
+
+        dirty, self._dirty = self._dirty, set()
+        await self._write({key: self._sketches[key].to_bytes() for key in dirty})
+
+    async def get(self, guild_id: int, metric: str) -> KLLSketch:
+        """
+        Gets the sketch of a metric for a guild, merged across every process.
+        """
+        key = self.key(guild_id, metric)
+        merged = KLLSketch(self.k)
+        for shard, data in (await self._load_all(key)).items():
+            # our own field may be behind what's in memory
+            if shard.decode() == self.shard and key in self._sketches:
+                continue
+
+            merged.merge(KLLSketch.from_bytes(data))
+
+        if key in self._sketches:
+            merged.merge(self._sketches[key])
+
+        return merged
@@ -0,0 +1,181 @@
+"""
+Precomputed guild analytics snapshots.
+"""
+import datetime
+import time
+from io import BytesIO
+from typing import Awaitable, Callable, Dict, Optional
+
+import curio
+import logbook
+import numpy as np
+from curious import Guild
+
+from jokusoramame.redis import RedisInterface
+
+logger = logbook.Logger("Jokusoramame.snapshots")
+
+#: A snapshot builder. Takes a guild, and returns the arrays to store for it.
+SnapshotBuilder = Callable[[Guild], Awaitable[Dict[str, np.ndarray]]]
+
+
+class GuildSnapshot(object):
+    """
+    A snapshot of the analytics of a guild.
+
+    Arrays are keyed by ``<builder name>.<array name>``.
+    """
+
+    def __init__(self, guild_id: int, created: float, arrays: Dict[str, np.ndarray]):
+        #: The ID of the guild this snapshot is for.
+        self.guild_id = guild_id
+
+        #: When this snapshot was created.
+        self.created = created
+
+        #: The arrays in this snapshot.
+        self.arrays = arrays
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return self.arrays[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.arrays
+
+    @property
+    def age(self) -> float:
+        """
+        :return: The age of this snapshot, in seconds.
+        """
+        return time.time() - self.created
+
+    def to_bytes(self) -> bytes:
+        """
+        Encodes this snapshot as a compressed ``.npz`` file.
+        """
+        buf = BytesIO()
+        np.savez_compressed(buf, _guild_id=np.int64(self.guild_id),
+                            _created=np.float64(self.created), **self.arrays)
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'GuildSnapshot':
+        """
+        Decodes a snapshot encoded with :meth:`.to_bytes`.
+        """
+        with np.load(BytesIO(data)) as npz:
+            arrays = {key: npz[key] for key in npz.files}
+
+        guild_id = int(arrays.pop("_guild_id"))
+        created = float(arrays.pop("_created"))
+        return cls(guild_id, created, arrays)
+
+
+class SnapshotScheduler(object):
+    """
+    Computes analytics snapshots for every guild with analytics enabled, once a day.
+
+    Plugins register builders, which each contribute some arrays to the snapshot of a guild.
+    Snapshots are built during off-peak hours, so that expensive commands can answer from them
+    instantly.
+    """
+
+    def __init__(self, client, redis: RedisInterface, *, hour: int = 4, ttl: int = 172_800):
+        """
+        :param client: The bot instance.
+        :param redis: The :class:`.RedisInterface` to store snapshots in.
+        :param hour: The hour of the day (UTC) to build snapshots at.
+        :param ttl: The number of seconds to keep a snapshot for.
+        """
+        self.client = client
+        self.redis = redis
+        self.hour = hour
+        self.ttl = ttl
+
+        self.builders = {}  # type: Dict[str, SnapshotBuilder]
+        self._snapshots = {}  # type: Dict[int, GuildSnapshot]
+        self._task = None  # type: curio.Task
+
+    def register(self, name: str, builder: SnapshotBuilder):
+        """
+        Registers a snapshot builder.
+
+        :param name: The name of the builder. This prefixes the keys of its arrays.
+        :param builder: A coroutine function that takes a :class:`.Guild` and returns a dict of
+            arrays.
+        """
+        self.builders[name] = builder
+
+    async def build(self, guild: Guild) -> GuildSnapshot:
+        """
+        Builds and stores a new snapshot for a guild.
+        """
+        arrays = {}
+        for name, builder in self.builders.items():
+            for key, array in (await builder(guild)).items():
+                arrays[f"{name}.{key}"] = array
+
+        snapshot = GuildSnapshot(guild.id, time.time(), arrays)
+        await self.redis.set_snapshot(guild, snapshot.to_bytes(), self.ttl)
+        self._snapshots[guild.id] = snapshot
+        return snapshot
+
+    async def get(self, guild: Guild) -> Optional[GuildSnapshot]:
+        """
+        Gets the latest snapshot for a guild.
+
+        :return: The :class:`.GuildSnapshot`, or None if there is no snapshot.
+        """
+        snapshot = self._snapshots.get(guild.id)
+        if snapshot is not None and snapshot.age < self.ttl:
+            return snapshot
+
+        data = await self.redis.get_snapshot(guild)
+        if data is None:
+            return None
+
+        snapshot = GuildSnapshot.from_bytes(data)
+        self._snapshots[guild.id] = snapshot
+        return snapshot
+
+    def seconds_until_next_run(self, now: datetime.datetime) -> float:
+        """
+        Gets the number of seconds until snapshots are next built.
+
+        :param now: The current UTC time.
+        """
+        next_run = now.replace(hour=self.hour, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += datetime.timedelta(days=1)
+
+        return (next_run - now).total_seconds()
+
+    async def build_all(self):
+        """
+        Builds snapshots for every guild with analytics enabled.
+        """
+        built = 0
+        for guild in list(self.client.guilds.values()):
+            if not await self.redis.is_analytics_enabled(guild):
+                continue
+
+            try:
+                await self.build(guild)
+            except Exception:
+                logger.exception(f"Failed to build a snapshot for {guild.id}")
+            else:
+                built += 1
+
+        logger.info(f"Built {built} snapshot(s).")
+
+    async def _run(self):
+        while True:
+            await curio.sleep(self.seconds_until_next_run(datetime.datetime.utcnow()))
+            await self.build_all()
+
+    async def start(self):
+        """
+        Starts the scheduler.
+        """
+        if self._task is None:
+            self._task = await curio.spawn(self._run, daemon=True)
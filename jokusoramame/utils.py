@@ -4,7 +4,10 @@ Misc utilities.
 # create the asyncio event loop
 import asyncio
 import json
-from typing import Any, Generator, List, Sequence, Tuple
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Generator, Iterable, List, Sequence, Set, \
+    Tuple
 
 from curious.commands import Context, condition
 from dataclasses import dataclass
@@ -24,6 +27,7 @@ except ImportError:
         print("Using vanilla asyncio")
         asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
 
+import curio
 from curio import AsyncioLoop
 
 # create the asyncio bridge
@@ -98,6 +102,24 @@ def get_apikeys(name: str) -> APIKey:
     return APIKey(**data)
 
 
+def parse_flags(text: str) -> Tuple[List[str], Set[str]]:
+    """
+    Splits command arguments into positional words and ``--flags``.
+
+    :param text: The argument text.
+    :return: A tuple of (positional words, flag names without the dashes).
+    """
+    words = []
+    flags = set()
+    for word in text.split():
+        if word.startswith("--") and len(word) > 2:
+            flags.add(word[2:].lower())
+        else:
+            words.append(word)
+
+    return words, flags
+
+
 def chunked(sequence: Sequence[Any], chunk_size: int) -> Generator[Any, None, None]:
     """
     Splits a sequence into sized chunks
@@ -109,6 +131,98 @@ def chunked(sequence: Sequence[Any], chunk_size: int) -> Generator[Any, None, No
         yield sequence[i:i + chunk_size]
 
 
+class SliceStats(object):
+    """
+    Records how long each slice of a time-sliced loop held the event loop.
+    """
+
+    def __init__(self, keep: int = 1000):
+        """
+        :param keep: The number of recent slice durations to keep.
+        """
+        #: The recent slice durations, in microseconds.
+        self.durations = deque(maxlen=keep)
+
+        #: The total number of slices.
+        self.slices = 0
+
+        #: The total number of items iterated over.
+        self.items = 0
+
+        #: The longest slice, in microseconds.
+        self.longest = 0.0
+
+    def record(self, duration: float, items: int):
+        self.durations.append(duration)
+        self.slices += 1
+        self.items += items
+        self.longest = max(self.longest, duration)
+
+    def percentile(self, p: float) -> float:
+        """
+        Gets a percentile of the recent slice durations, in microseconds.
+        """
+        if not self.durations:
+            return 0.0
+
+        ordered = sorted(self.durations)
+        return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+
+#: The slice stats for each named time-sliced loop.
+slice_stats = {}  # type: Dict[str, SliceStats]
+
+#: The default slice budget, in microseconds.
+DEFAULT_SLICE_BUDGET = 5_000
+
+
+async def timesliced(iterable: Iterable[Any], *, name: str = "default",
+                     budget: int = DEFAULT_SLICE_BUDGET) -> AsyncIterator[Any]:
+    """
+    Iterates over a large collection, yielding to the event loop periodically.
+
+    Once a slice has held the loop for longer than the budget, control is handed back to the
+    scheduler before the next item. The time spent in the body of the loop counts towards the
+    slice, so long loops over CPU-heavy work don't block heartbeats. If the body suspends, such
+    as to wait on Redis, the loop has already been handed back, so a new slice is started instead
+    of counting the time spent waiting.
+
+    :param iterable: The collection to iterate over.
+    :param name: The name to record slice durations under, in :data:`.slice_stats`.
+    :param budget: The maximum time a slice can take, in microseconds.
+    """
+    try:
+        stats = slice_stats[name]
+    except KeyError:
+        stats = slice_stats[name] = SliceStats()
+
+    # the task's cycle count goes up every time it is resumed after suspending
+    task = await curio.current_task()
+    budget = budget / 1_000_000
+    start = time.perf_counter()
+    count = 0
+
+    for item in iterable:
+        cycles = task.cycles
+        yield item
+
+        if task.cycles != cycles:
+            start = time.perf_counter()
+            count = 0
+            continue
+
+        count += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= budget:
+            stats.record(elapsed * 1_000_000, count)
+            await curio.sleep(0)
+            start = time.perf_counter()
+            count = 0
+
+    if count:
+        stats.record((time.perf_counter() - start) * 1_000_000, count)
+
+
 def is_owner():
     def predicate(ctx: Context):
         return ctx.author.id in [ctx.bot.application_info.owner.id, 214796473689178133, 396290259907903491]
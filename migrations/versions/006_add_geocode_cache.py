@@ -0,0 +1,32 @@
+"""
+Autogenerated migration file.
+
+Revision: 6
+Message: Add geocode cache.
+"""
+from asyncqlio.orm.ddl.ddlsession import DDLSession
+
+revision = "6"
+message = "Add geocode cache."
+
+
+async def upgrade(session: DDLSession):
+    """
+    Performs an upgrade. Put your upgrading SQL here.
+    """
+    await session.execute("""
+    CREATE TABLE geocode_cache (
+        query TEXT PRIMARY KEY,
+        result TEXT NOT NULL,
+        cached_at BIGINT NOT NULL
+    );
+    """)
+
+
+async def downgrade(session: DDLSession):
+    """
+    Performs a downgrade. Put your downgrading SQL here.
+    """
+    await session.execute("""
+    DROP TABLE geocode_cache;
+    """)
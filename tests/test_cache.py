@@ -0,0 +1,215 @@
+"""
+Tests for the response cache, against a stub HTTP server.
+"""
+import os
+
+import curio
+import pytest
+
+from jokusoramame import cache
+from jokusoramame.cache import CachedResponse, RenderCache, ResponseCache
+
+
+class FakeClock(object):
+    """
+    A wall clock that only moves when told to.
+    """
+
+    def __init__(self):
+        self.now = 1_500_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+class FakeRedisTier(object):
+    """
+    The parts of :class:`.RedisInterface` used by the response cache, with expiring keys.
+    """
+
+    def __init__(self, clock: FakeClock):
+        self.clock = clock
+        self.items = {}
+
+    async def get_cached_response(self, key: str):
+        try:
+            expires, content = self.items[key]
+        except KeyError:
+            return None
+
+        if expires <= self.clock.time():
+            del self.items[key]
+            return None
+
+        return content
+
+    async def set_cached_response(self, key: str, content: bytes, ttl: int):
+        self.items[key] = (self.clock.time() + ttl, content)
+
+
+class StubServer(object):
+    """
+    A HTTP server that answers every request with a canned response for its path.
+    """
+
+    RESPONSES = {
+        "/ok": (200, b'{"score": 0.5}'),
+        "/error": (500, b"<html>Internal Server Error</html>"),
+    }
+
+    def __init__(self):
+        self.port = None
+        self.requests = 0
+        self._task = None
+
+    async def _handle(self, client, addr):
+        stream = client.as_stream()
+        request_line = await stream.readline()
+        while (await stream.readline()).strip():
+            pass
+
+        self.requests += 1
+        path = request_line.split()[1].decode()
+        status, body = self.RESPONSES[path]
+        await stream.write(b"HTTP/1.0 %d Stub\r\nContent-Length: %d\r\n\r\n%s"
+                           % (status, len(body), body))
+        await client.close()
+
+    async def start(self):
+        sock = curio.tcp_server_socket("127.0.0.1", 0)
+        self.port = sock.getsockname()[1]
+        self._task = await curio.spawn(curio.network.run_server, sock, self._handle, daemon=True)
+
+    async def stop(self):
+        await self._task.cancel()
+
+    async def get(self, path: str) -> CachedResponse:
+        sock = await curio.open_connection("127.0.0.1", self.port)
+        async with sock:
+            stream = sock.as_stream()
+            await stream.write(f"GET {path} HTTP/1.0\r\nHost: stub\r\n\r\n".encode())
+            raw = await stream.read()
+
+        head, body = raw.split(b"\r\n\r\n", 1)
+        return CachedResponse(int(head.split()[1]), body, cached=False)
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+def run_with_server(coro_func):
+    async def runner():
+        server = StubServer()
+        await server.start()
+        try:
+            return await coro_func(server)
+        finally:
+            await server.stop()
+
+    return curio.run(runner)
+
+
+def test_memory_hit(clock):
+    response_cache = ResponseCache()
+
+    async def scenario(server):
+        first = await response_cache.fetch("perspective", "TOXICITY", "hello  world",
+                                           lambda: server.get("/ok"))
+        second = await response_cache.fetch("perspective", "TOXICITY", "hello world",
+                                            lambda: server.get("/ok"))
+        return server.requests, first, second
+
+    requests, first, second = run_with_server(scenario)
+    assert requests == 1
+    assert not first.cached
+    assert second.cached
+    assert second.json() == {"score": 0.5}
+    assert response_cache.hits["perspective"] == 1
+    assert response_cache.misses["perspective"] == 1
+    assert response_cache.tier_hits == {"memory": 1}
+
+
+def test_redis_hit(clock):
+    redis = FakeRedisTier(clock)
+    warm = ResponseCache(redis)
+    cold = ResponseCache(redis)
+
+    async def scenario(server):
+        await warm.fetch("aylien.sentiment", "tweet", "text", lambda: server.get("/ok"))
+        from_redis = await cold.fetch("aylien.sentiment", "tweet", "text",
+                                      lambda: server.get("/ok"))
+        from_memory = await cold.fetch("aylien.sentiment", "tweet", "text",
+                                       lambda: server.get("/ok"))
+        return server.requests, from_redis, from_memory
+
+    requests, from_redis, from_memory = run_with_server(scenario)
+    assert requests == 1
+    assert from_redis.cached and from_memory.cached
+    assert from_redis.content == b'{"score": 0.5}'
+    assert cold.hits["aylien.sentiment"] == 2
+    assert "aylien.sentiment" not in cold.misses
+    assert cold.tier_hits == {"redis": 1, "memory": 1}
+
+
+def test_ttl_expiry(clock):
+    redis = FakeRedisTier(clock)
+    response_cache = ResponseCache(redis, ttls={"perspective": 60})
+
+    async def scenario(server):
+        await response_cache.fetch("perspective", "TOXICITY", "text", lambda: server.get("/ok"))
+        clock.now += 59
+        await response_cache.fetch("perspective", "TOXICITY", "text", lambda: server.get("/ok"))
+        assert server.requests == 1
+
+        clock.now += 2
+        expired = await response_cache.fetch("perspective", "TOXICITY", "text",
+                                             lambda: server.get("/ok"))
+        return server.requests, expired
+
+    requests, expired = run_with_server(scenario)
+    assert requests == 2
+    assert not expired.cached
+    assert response_cache.hits["perspective"] == 1
+    assert response_cache.misses["perspective"] == 2
+
+
+def test_only_ok_responses_are_cached(clock):
+    redis = FakeRedisTier(clock)
+    response_cache = ResponseCache(redis)
+
+    async def scenario(server):
+        responses = []
+        for _ in range(2):
+            responses.append(await response_cache.fetch("perspective", "TOXICITY", "text",
+                                                        lambda: server.get("/error")))
+        return server.requests, responses
+
+    requests, responses = run_with_server(scenario)
+    assert requests == 2
+    assert [response.status_code for response in responses] == [500, 500]
+    assert len(response_cache.memory) == 0
+    assert not redis.items
+    assert response_cache.misses["perspective"] == 2
+
+
+def test_render_cache_disk_budget(tmp_path):
+    path = str(tmp_path)
+    render_cache = RenderCache(max_bytes=100, disk_path=path, max_disk_bytes=250)
+    for i in range(6):
+        render_cache.put(f"plot{i}", bytes([i]) * 100)
+
+    # plot5 is in memory, and only the two newest of the evicted plots fit on disk
+    assert sorted(os.listdir(path)) == ["plot3.bin", "plot4.bin"]
+    assert render_cache.disk_size == 200
+
+    assert render_cache.get("plot3") == bytes([3]) * 100
+    assert render_cache.get("plot0") is None
+
+    # a new process picks up the spilled files, oldest first
+    reloaded = RenderCache(max_bytes=100, disk_path=path, max_disk_bytes=150)
+    assert reloaded.disk_size == 100
+    assert reloaded.get("plot5") == bytes([5]) * 100
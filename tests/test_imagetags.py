@@ -0,0 +1,167 @@
+"""
+Tests for image tagging, with a stub Clarifai model and stub image downloads.
+"""
+import random
+from io import BytesIO
+from typing import Dict, List, Tuple
+
+import curio
+import pytest
+from PIL import Image
+
+from jokusoramame.imagetags import ImageDownloadError, ImageTagger, dhash
+
+
+def encode(image: Image.Image, format: str = "PNG") -> bytes:
+    buf = BytesIO()
+    image.save(buf, format=format)
+    return buf.getvalue()
+
+
+def blocky_image(seed: int) -> Image.Image:
+    """
+    Makes an image with plenty of structure for a perceptual hash to pick up.
+    """
+    rng = random.Random(seed)
+    small = Image.new("L", (9, 8))
+    small.putdata([rng.randrange(256) for _ in range(9 * 8)])
+    return small.resize((180, 160), Image.NEAREST).convert("RGB")
+
+
+class StubBody(object):
+    def __init__(self, data: bytes, chunk_size: int = 4096):
+        self.data = data
+        self.chunk_size = chunk_size
+        self.closed = False
+
+    async def __aiter__(self):
+        for start in range(0, len(self.data), self.chunk_size):
+            await curio.sleep(0)
+            yield self.data[start:start + self.chunk_size]
+
+    async def close(self):
+        self.closed = True
+
+
+class StubResponse(object):
+    def __init__(self, status_code: int, data: bytes, headers: Dict[str, str]):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = StubBody(data)
+
+
+class StubSessions(object):
+    """
+    Serves canned streamed responses, tracking how many downloads run at once.
+    """
+
+    def __init__(self, files: Dict[str, Tuple[int, bytes]], send_length: bool = True):
+        self.files = files
+        self.send_length = send_length
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.responses = []
+
+    async def get(self, url: str, *, stream: bool = False) -> StubResponse:
+        assert stream
+        self.requests.append(url)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await curio.sleep(0.05)
+        finally:
+            self.in_flight -= 1
+
+        status, data = self.files[url]
+        headers = {"content-length": str(len(data))} if self.send_length else {}
+        response = StubResponse(status, data, headers)
+        self.responses.append(response)
+        return response
+
+
+class StubClarifai(object):
+    """
+    Tags every image with its size, recording each batch it was sent.
+    """
+
+    def __init__(self):
+        self.batches = []  # type: List[List[bytes]]
+
+    async def predict(self, images: List[bytes]) -> List[dict]:
+        self.batches.append(images)
+        return [{"data": {"concepts": [{"name": "image", "value": 1.0}]},
+                 "model": {"name": "stub"}, "size": len(image)} for image in images]
+
+
+async def expect_download_error(tagger: ImageTagger, urls: List[str]) -> ImageDownloadError:
+    with pytest.raises(ImageDownloadError) as e:
+        await tagger.tag(urls)
+
+    return e.value
+
+
+def test_downloads_are_parallel_and_batched():
+    files = {f"https://cdn/{i}.png": (200, encode(blocky_image(i))) for i in range(3)}
+    sessions, clarifai = StubSessions(files), StubClarifai()
+    tagger = ImageTagger(sessions, clarifai.predict)
+
+    outputs = curio.run(tagger.tag, list(files))
+    assert sessions.max_in_flight == 3
+    assert len(clarifai.batches) == 1
+    assert [output["size"] for output in outputs] == [len(data) for (_, data) in files.values()]
+    assert all(response.body.closed for response in sessions.responses)
+
+    # cached by URL now
+    curio.run(tagger.tag, list(files))
+    assert len(sessions.requests) == 3
+    assert len(clarifai.batches) == 1
+
+
+def test_error_pages_are_not_tagged():
+    files = {"https://cdn/gone.png": (404, b"<html>Not Found</html>")}
+    sessions, clarifai = StubSessions(files), StubClarifai()
+    tagger = ImageTagger(sessions, clarifai.predict)
+
+    error = curio.run(expect_download_error, tagger, ["https://cdn/gone.png"])
+    assert "404" in error.reason
+    assert not clarifai.batches
+    assert sessions.responses[0].body.closed
+
+
+@pytest.mark.parametrize("send_length", [True, False])
+def test_oversized_images_are_rejected(send_length: bool):
+    files = {"https://cdn/big.bin": (200, b"\x00" * 20_000)}
+    sessions, clarifai = StubSessions(files, send_length=send_length), StubClarifai()
+    tagger = ImageTagger(sessions, clarifai.predict, max_bytes=10_000)
+
+    error = curio.run(expect_download_error, tagger, ["https://cdn/big.bin"])
+    assert error.reason == "the image is too big"
+    assert not clarifai.batches
+
+
+def test_reencoded_copies_share_a_result():
+    image = blocky_image(42)
+    files = {"https://cdn/original.png": (200, encode(image)),
+             "https://cdn/copy.jpg": (200, encode(image, "JPEG"))}
+    sessions, clarifai = StubSessions(files), StubClarifai()
+    tagger = ImageTagger(sessions, clarifai.predict)
+
+    curio.run(tagger.tag, ["https://cdn/original.png"])
+    outputs = curio.run(tagger.tag, ["https://cdn/copy.jpg"])
+    assert len(clarifai.batches) == 1
+    assert outputs[0]["size"] == len(files["https://cdn/original.png"][1])
+
+
+def test_flat_images_do_not_match_each_other():
+    white = encode(Image.new("RGB", (64, 64), (255, 255, 255)))
+    black = encode(Image.new("RGB", (64, 64), (0, 0, 0)), "JPEG")
+    assert dhash(white) is None and dhash(black) is None
+
+    files = {"https://cdn/white.png": (200, white), "https://cdn/black.jpg": (200, black)}
+    sessions, clarifai = StubSessions(files), StubClarifai()
+    tagger = ImageTagger(sessions, clarifai.predict)
+
+    curio.run(tagger.tag, ["https://cdn/white.png"])
+    curio.run(tagger.tag, ["https://cdn/black.jpg"])
+    assert len(clarifai.batches) == 2
@@ -0,0 +1,301 @@
+"""
+Tests for the curio-native PostgreSQL client, against a fake server.
+"""
+import hashlib
+import struct
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import curio
+import pytest
+
+from jokusoramame.db.pgwire import ConnectionPool, DecodeError, PostgresConnection, \
+    PostgresError, ScramSHA256, _message
+
+#: A result for the fake server; (columns as (name, type OID), rows of text values).
+Result = Tuple[List[Tuple[str, int]], List[Sequence[Optional[str]]]]
+
+
+def _cstr(body: bytes, offset: int) -> Tuple[str, int]:
+    end = body.index(b"\x00", offset)
+    return body[offset:end].decode(), end + 1
+
+
+class FakeServer(object):
+    """
+    Speaks just enough of the extended query protocol to answer scripted queries.
+    """
+
+    def __init__(self, results: Dict[str, Result], *, password: str = None):
+        """
+        :param results: The result of each query, keyed by its SQL.
+        :param password: The password to ask for with md5 authentication, if any.
+        """
+        self.results = results
+        self.password = password
+
+        #: The kinds of the messages in each batch, up to and including the Sync.
+        self.batches = []  # type: List[bytes]
+
+        #: The SQL of queries that should fail with an error.
+        self.failing = set()
+
+        #: The SQL of queries that should never be answered.
+        self.hanging = set()
+
+        self.port = None
+        self._task = None
+
+    def _row_description(self, query: str) -> bytes:
+        columns, _ = self.results[query]
+        body = struct.pack("!h", len(columns))
+        for name, oid in columns:
+            body += name.encode() + b"\x00" + struct.pack("!ihihih", 0, 0, oid, -1, -1, 0)
+
+        return _message(b"T", body)
+
+    def _rows(self, query: str) -> bytes:
+        _, rows = self.results[query]
+        out = b""
+        for row in rows:
+            body = struct.pack("!h", len(row))
+            for value in row:
+                if value is None:
+                    body += struct.pack("!i", -1)
+                else:
+                    body += struct.pack("!i", len(value.encode())) + value.encode()
+            out += _message(b"D", body)
+
+        return out + _message(b"C", f"SELECT {len(rows)}".encode() + b"\x00")
+
+    async def _read(self, stream) -> Tuple[bytes, bytes]:
+        kind, length = struct.unpack("!ci", await stream.read_exactly(5))
+        return kind, await stream.read_exactly(length - 4)
+
+    async def _startup(self, stream):
+        length = struct.unpack("!i", await stream.read_exactly(4))[0]
+        startup = await stream.read_exactly(length - 4)
+        user = startup[4:].split(b"\x00")[1].decode()
+
+        if self.password is not None:
+            await stream.write(_message(b"R", struct.pack("!i", 5), b"salt"))
+            _, body = await self._read(stream)
+            inner = hashlib.md5(f"{self.password}{user}".encode()).hexdigest().encode()
+            expected = b"md5" + hashlib.md5(inner + b"salt").hexdigest().encode() + b"\x00"
+            if body != expected:
+                await stream.write(_message(b"E", b"C28P01\x00Mbad password\x00\x00"))
+                return False
+
+        await stream.write(_message(b"R", struct.pack("!i", 0))
+                           + _message(b"S", b"server_version\x0010.0\x00")
+                           + _message(b"K", struct.pack("!ii", 1234, 5678))
+                           + _message(b"Z", b"I"))
+        return True
+
+    async def _handle(self, client, addr):
+        stream = client.as_stream()
+        if not await self._startup(stream):
+            return
+
+        statements = {}
+        bound = None
+        batch, out = b"", b""
+        failed = False
+
+        while True:
+            kind, body = await self._read(stream)
+            if kind == b"X":
+                return
+
+            batch += kind
+            if kind == b"Q":
+                query, _ = _cstr(body, 0)
+                await stream.write(_message(b"C", query.split()[0].encode() + b"\x00")
+                                   + _message(b"Z", b"I"))
+                self.batches.append(batch)
+                batch = b""
+                continue
+
+            if kind == b"S":
+                self.batches.append(batch)
+                if failed or bound not in self.hanging:
+                    await stream.write(out + _message(b"Z", b"I"))
+
+                batch, out, failed = b"", b"", False
+                continue
+
+            if failed:
+                # skip to the Sync after an error
+                continue
+
+            if kind == b"P":
+                name, offset = _cstr(body, 0)
+                statements[name], _ = _cstr(body, offset)
+                out += _message(b"1")
+            elif kind == b"D":
+                if body[:1] == b"S":
+                    query = statements[_cstr(body, 1)[0]]
+                    out += _message(b"t", struct.pack("!h", 0))
+                else:
+                    query = bound
+
+                out += self._row_description(query)
+            elif kind == b"B":
+                _, offset = _cstr(body, 0)
+                name, _ = _cstr(body, offset)
+                bound = statements[name]
+                out += _message(b"2")
+            elif kind == b"E":
+                if bound in self.failing:
+                    out += _message(b"E", b"SERROR\x00C42P01\x00Mrelation does not exist\x00\x00")
+                    failed = True
+                else:
+                    out += self._rows(bound)
+            elif kind == b"C":
+                name, _ = _cstr(body, 1)
+                statements.pop(name, None)
+                out += _message(b"3")
+
+    async def start(self):
+        sock = curio.tcp_server_socket("127.0.0.1", 0)
+        self.port = sock.getsockname()[1]
+        self._task = await curio.spawn(curio.network.run_server, sock, self._handle, daemon=True)
+
+    async def stop(self):
+        await self._task.cancel()
+
+    async def connect(self, **kwargs) -> PostgresConnection:
+        return await PostgresConnection.connect("127.0.0.1", self.port, "joku", self.password,
+                                                **kwargs)
+
+
+def run_with_server(server: FakeServer, coro_func):
+    async def runner():
+        await server.start()
+        try:
+            return await coro_func()
+        finally:
+            await server.stop()
+
+    return curio.run(runner)
+
+
+RESULTS = {
+    "SELECT $1::int AS value, $2 AS name": ([("value", 23), ("name", 25)], [("42", None)]),
+    "SELECT * FROM missing": ([("id", 23)], []),
+    "SELECT 'infinity'::timestamp AS at": ([("at", 1114)], [("infinity",)]),
+    "SELECT pg_sleep(60)": ([("pg_sleep", 2278)], [("",)]),
+}
+
+
+def test_scram_rfc7677():
+    # the example exchange from RFC 7677, section 3
+    scram = ScramSHA256("pencil")
+    scram.nonce = "rOprNGfwEbeRWgbNEkqO"
+    scram.client_first_bare = f"n=user,r={scram.nonce}"
+
+    server_first = b"r=rOprNGfwEbeRWgbNEkqO%hvYDpWUa2RaTCAfuxFIlj)hNlF$k0," \
+                   b"s=W22ZaJ0SNY7soEsUEjb6gQ==,i=4096"
+    assert scram.client_final(server_first) == \
+        b"c=biws,r=rOprNGfwEbeRWgbNEkqO%hvYDpWUa2RaTCAfuxFIlj)hNlF$k0," \
+        b"p=dHzbZapWIk4jUhN+Ute9ytag9zjfMHgsqmmiz7AndVQ="
+
+    scram.verify(b"v=6rriTRBi23WpRR/wtup+mMhUZUn/dB5nLTJRsjl95G4=")
+
+
+def test_extended_query_round_trip():
+    server = FakeServer(RESULTS, password="secret")
+
+    async def scenario():
+        connection = await server.connect()
+        try:
+            first = await connection.execute("SELECT $1::int AS value, $2 AS name", (42, None))
+            second = await connection.execute("SELECT $1::int AS value, $2 AS name", (42, None))
+        finally:
+            await connection.close()
+
+        return connection, first, second
+
+    connection, first, second = run_with_server(server, scenario)
+    assert connection.parameters == {"server_version": "10.0"}
+    assert (connection.process_id, connection.secret_key) == (1234, 5678)
+
+    assert first.columns == ["value", "name"]
+    assert first.rows == [(42, None)]
+    assert first.status == "SELECT 1"
+    assert second == first
+
+    # prepared the first time, and only bound and executed after that
+    assert server.batches == [b"PDBES", b"BES"]
+    stats = connection.statements.stats
+    assert (stats["misses"], stats["hits"], stats["evictions"]) == (1, 1, 0)
+
+
+def test_error_recovery_through_sync():
+    server = FakeServer(RESULTS)
+    server.failing.add("SELECT * FROM missing")
+
+    async def scenario():
+        connection = await server.connect()
+        try:
+            with pytest.raises(PostgresError) as e:
+                await connection.execute("SELECT * FROM missing")
+
+            assert e.value.sqlstate == "42P01"
+            assert not connection.broken
+            assert connection.transaction_status == b"I"
+
+            return await connection.execute("SELECT $1::int AS value, $2 AS name", (1, "a"))
+        finally:
+            await connection.close()
+
+    result = run_with_server(server, scenario)
+    assert result.rows == [(42, None)]
+    # the failed statement is closed along with the next query
+    assert server.batches == [b"PDBES", b"CPDBES"]
+
+
+def test_decode_errors_are_database_errors():
+    server = FakeServer(RESULTS)
+
+    async def scenario():
+        connection = await server.connect()
+        try:
+            with pytest.raises(DecodeError) as e:
+                await connection.execute("SELECT 'infinity'::timestamp AS at")
+
+            assert e.value.sqlstate == "22000"
+            assert not connection.broken
+
+            return await connection.execute("SELECT $1::int AS value, $2 AS name", (1, "a"))
+        finally:
+            await connection.close()
+
+    result = run_with_server(server, scenario)
+    assert result.rows == [(42, None)]
+
+
+def test_cancellation_marks_connection_broken():
+    server = FakeServer(RESULTS)
+    server.hanging.add("SELECT pg_sleep(60)")
+
+    async def scenario():
+        pool = ConnectionPool(server.connect, max_size=1)
+        connection = await pool.acquire()
+        with pytest.raises(curio.TaskTimeout):
+            async with curio.timeout_after(0.2):
+                await connection.execute("SELECT pg_sleep(60)")
+
+        assert connection.broken
+        await pool.release(connection)
+        assert connection.closed
+        assert pool.idle == 0
+
+        # the pool opens a fresh connection in its place
+        replacement = await pool.acquire()
+        assert replacement is not connection
+        await pool.release(replacement)
+        await pool.close()
+        return pool
+
+    pool = run_with_server(server, scenario)
+    assert pool.connections_made == 2